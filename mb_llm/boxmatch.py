@@ -0,0 +1,229 @@
+"""
+Box Matching Module
+
+This module provides vectorized bounding box comparison and matching utilities.
+It supports L1, IoU and GIoU metrics over whole sets of boxes at once, as well as
+optimal one-to-one assignment between query boxes and candidate boxes.
+"""
+
+import numpy as np
+from typing import List, Tuple, Union
+
+__all__ = ["BoxMatcher", "pairwise_iou", "pairwise_giou", "pairwise_l1",
+           "match_boxes", "assign_boxes"]
+
+BoxArray = Union[List[float], List[List[float]], np.ndarray]
+
+
+class BoxMatcher:
+    """
+    A class for matching query boxes against candidate boxes.
+
+    All boxes are given as (x0, y0, x1, y1) corners. Since every metric is symmetric
+    in the two axes, boxes in (y0, x0, y1, x1) order can be used as well, as long
+    as query and candidate boxes share the same order.
+
+    Attributes:
+        metric (str): Metric used for matching ('l1', 'iou' or 'giou')
+    """
+
+    metrics = ('l1', 'iou', 'giou')
+
+    def __init__(self, metric: str = 'l1') -> None:
+        """
+        Initialize the BoxMatcher.
+
+        Args:
+            metric (str): Metric used for matching ('l1', 'iou' or 'giou')
+        """
+        if metric not in self.metrics:
+            raise ValueError(f"metric should be one of {self.metrics}, got {metric}")
+        self.metric = metric
+
+    @staticmethod
+    def as_boxes(boxes: BoxArray) -> np.ndarray:
+        """
+        Convert a box or a list of boxes to a (N, 4) float array.
+
+        Args:
+            boxes (BoxArray): Single box or list of boxes
+
+        Returns:
+            np.ndarray: Array of shape (N, 4)
+        """
+        boxes = np.asarray(boxes, dtype=np.float64)
+        if boxes.size == 0:
+            return boxes.reshape(0, 4)
+        return boxes.reshape(-1, 4)
+
+    @staticmethod
+    def pairwise_l1(boxes1: BoxArray, boxes2: BoxArray) -> np.ndarray:
+        """
+        Compute the L1 distance between every pair of boxes.
+
+        Args:
+            boxes1 (BoxArray): Boxes of shape (Q, 4)
+            boxes2 (BoxArray): Boxes of shape (N, 4)
+
+        Returns:
+            np.ndarray: Distance matrix of shape (Q, N)
+        """
+        boxes1 = BoxMatcher.as_boxes(boxes1)
+        boxes2 = BoxMatcher.as_boxes(boxes2)
+        return np.abs(boxes1[:, None, :] - boxes2[None, :, :]).sum(-1)
+
+    @staticmethod
+    def _area(boxes: np.ndarray) -> np.ndarray:
+        """Compute the area of (N, 4) boxes."""
+        return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+    @staticmethod
+    def _iou_and_union(boxes1: np.ndarray, boxes2: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Compute the pairwise IoU and union area of two box arrays."""
+        area1 = BoxMatcher._area(boxes1)
+        area2 = BoxMatcher._area(boxes2)
+        lt = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+        rb = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+        wh = np.clip(rb - lt, 0, None)
+        inter = wh[..., 0] * wh[..., 1]
+        union = area1[:, None] + area2[None, :] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        return iou, union
+
+    @staticmethod
+    def pairwise_iou(boxes1: BoxArray, boxes2: BoxArray) -> np.ndarray:
+        """
+        Compute the IoU between every pair of boxes.
+
+        Args:
+            boxes1 (BoxArray): Boxes of shape (Q, 4)
+            boxes2 (BoxArray): Boxes of shape (N, 4)
+
+        Returns:
+            np.ndarray: IoU matrix of shape (Q, N)
+        """
+        iou, _ = BoxMatcher._iou_and_union(BoxMatcher.as_boxes(boxes1), BoxMatcher.as_boxes(boxes2))
+        return iou
+
+    @staticmethod
+    def pairwise_giou(boxes1: BoxArray, boxes2: BoxArray) -> np.ndarray:
+        """
+        Compute the generalized IoU between every pair of boxes.
+
+        Args:
+            boxes1 (BoxArray): Boxes of shape (Q, 4)
+            boxes2 (BoxArray): Boxes of shape (N, 4)
+
+        Returns:
+            np.ndarray: GIoU matrix of shape (Q, N), with values in [-1, 1]
+        """
+        boxes1 = BoxMatcher.as_boxes(boxes1)
+        boxes2 = BoxMatcher.as_boxes(boxes2)
+        iou, union = BoxMatcher._iou_and_union(boxes1, boxes2)
+        lt = np.minimum(boxes1[:, None, :2], boxes2[None, :, :2])
+        rb = np.maximum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+        wh = np.clip(rb - lt, 0, None)
+        hull = wh[..., 0] * wh[..., 1]
+        penalty = np.divide(hull - union, hull, out=np.zeros_like(hull), where=hull > 0)
+        return iou - penalty
+
+    def cost_matrix(self, query: BoxArray, boxes: BoxArray) -> np.ndarray:
+        """
+        Compute the matching cost between query and candidate boxes. Lower is better.
+
+        Args:
+            query (BoxArray): Query boxes of shape (Q, 4)
+            boxes (BoxArray): Candidate boxes of shape (N, 4)
+
+        Returns:
+            np.ndarray: Cost matrix of shape (Q, N)
+        """
+        if self.metric == 'l1':
+            return self.pairwise_l1(query, boxes)
+        if self.metric == 'iou':
+            return 1.0 - self.pairwise_iou(query, boxes)
+        return 1.0 - self.pairwise_giou(query, boxes)
+
+    def match(self, query: BoxArray, boxes: BoxArray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the best candidate box for every query box independently.
+
+        Ties are resolved towards the lowest candidate index.
+
+        Args:
+            query (BoxArray): Query boxes of shape (Q, 4)
+            boxes (BoxArray): Candidate boxes of shape (N, 4), N > 0
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Candidate index and cost for each query box
+        """
+        cost = self.cost_matrix(query, boxes)
+        if cost.shape[1] == 0:
+            raise ValueError("No candidate boxes to match against")
+        index = cost.argmin(axis=1)
+        return index, cost[np.arange(len(index)), index]
+
+    def assign(self, query: BoxArray, boxes: BoxArray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the optimal one-to-one assignment between query and candidate boxes.
+
+        Uses the Hungarian algorithm from scipy when available, and a greedy
+        lowest-cost-first assignment otherwise. When Q > N, only N query boxes
+        are assigned.
+
+        Args:
+            query (BoxArray): Query boxes of shape (Q, 4)
+            boxes (BoxArray): Candidate boxes of shape (N, 4)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Assigned query indices and candidate indices
+        """
+        cost = self.cost_matrix(query, boxes)
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            return self._greedy_assign(cost)
+        query_idx, box_idx = linear_sum_assignment(cost)
+        return query_idx, box_idx
+
+    @staticmethod
+    def _greedy_assign(cost: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Assign pairs greedily in order of increasing cost."""
+        order = np.argsort(cost, axis=None, kind='stable')
+        rows, cols = np.unravel_index(order, cost.shape)
+        used_rows = np.zeros(cost.shape[0], dtype=bool)
+        used_cols = np.zeros(cost.shape[1], dtype=bool)
+        query_idx, box_idx = [], []
+        for r, c in zip(rows, cols):
+            if used_rows[r] or used_cols[c]:
+                continue
+            used_rows[r] = used_cols[c] = True
+            query_idx.append(r)
+            box_idx.append(c)
+            if len(query_idx) == min(cost.shape):
+                break
+        query_idx = np.array(query_idx, dtype=np.int64)
+        box_idx = np.array(box_idx, dtype=np.int64)
+        order = np.argsort(query_idx)
+        return query_idx[order], box_idx[order]
+
+
+def pairwise_iou(*args, **kwargs):
+    """Convenience function to compute pairwise IoU."""
+    return BoxMatcher.pairwise_iou(*args, **kwargs)
+
+def pairwise_giou(*args, **kwargs):
+    """Convenience function to compute pairwise GIoU."""
+    return BoxMatcher.pairwise_giou(*args, **kwargs)
+
+def pairwise_l1(*args, **kwargs):
+    """Convenience function to compute pairwise L1 distance."""
+    return BoxMatcher.pairwise_l1(*args, **kwargs)
+
+def match_boxes(query: BoxArray, boxes: BoxArray, metric: str = 'l1'):
+    """Convenience function to match every query box to its best candidate."""
+    return BoxMatcher(metric).match(query, boxes)
+
+def assign_boxes(query: BoxArray, boxes: BoxArray, metric: str = 'iou'):
+    """Convenience function for optimal one-to-one box assignment."""
+    return BoxMatcher(metric).assign(query, boxes)
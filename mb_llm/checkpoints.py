@@ -0,0 +1,170 @@
+"""
+Checkpoints Module
+
+This module provides delta checkpoints for SAM2 fine-tuning. Only the parameters being
+trained (by default the mask decoder and prompt encoder) are saved, the copy to disk runs
+on a background thread so training does not wait on I/O, and old checkpoints are pruned
+by a retention setting. A delta is restored by loading it over the base checkpoint.
+"""
+
+import glob
+import os
+import queue
+import threading
+import torch
+from typing import Dict, List, Optional, Sequence, Union
+
+__all__ = ["DeltaCheckpointer", "trainable_state", "load_delta"]
+
+DEFAULT_PREFIXES = ('sam_mask_decoder.', 'sam_prompt_encoder.')
+
+
+def trainable_state(model: torch.nn.Module, prefixes: Sequence[str] = DEFAULT_PREFIXES) -> Dict[str, torch.Tensor]:
+    """
+    Copy the state entries under the given module prefixes to the CPU.
+
+    Args:
+        model (torch.nn.Module): SAM2 model
+        prefixes (Sequence[str]): State dict key prefixes to keep
+
+    Returns:
+        Dict[str, torch.Tensor]: Detached CPU copies of the selected entries
+    """
+    return {k: v.detach().to('cpu', copy=True) for k, v in model.state_dict().items()
+            if k.startswith(tuple(prefixes))}
+
+
+def load_delta(model: torch.nn.Module, delta: Union[str, Dict], base_checkpoint: Optional[str] = None) -> int:
+    """
+    Load a delta checkpoint into a model, optionally loading the base checkpoint first.
+
+    Args:
+        model (torch.nn.Module): SAM2 model
+        delta (Union[str, Dict]): Path of the delta checkpoint, or its loaded contents
+        base_checkpoint (Optional[str]): Path of a full SAM2 checkpoint to load before the delta
+
+    Returns:
+        int: Training iteration the delta was saved at
+    """
+    if base_checkpoint:
+        base = torch.load(base_checkpoint, map_location='cpu')
+        model.load_state_dict(base.get('model', base))
+    if isinstance(delta, str):
+        delta = torch.load(delta, map_location='cpu')
+    missing, unexpected = model.load_state_dict(delta['model'], strict=False)
+    if unexpected:
+        raise KeyError(f"Delta checkpoint has keys the model does not: {unexpected[:5]}")
+    return delta['iteration']
+
+
+class DeltaCheckpointer:
+    """
+    A writer of trainable-parameter checkpoints on a background thread.
+
+    Attributes:
+        directory (str): Directory checkpoints are written to
+        prefixes (Tuple[str, ...]): State dict key prefixes saved in every checkpoint
+        keep_last (Optional[int]): Number of checkpoints kept, None to keep all
+        base_checkpoint (Optional[str]): Full checkpoint the deltas apply to, recorded in each delta
+    """
+
+    def __init__(self, directory: str = './sam_model_checkpoints', prefixes: Sequence[str] = DEFAULT_PREFIXES,
+                 keep_last: Optional[int] = 3, base_checkpoint: Optional[str] = None,
+                 async_write: bool = True, max_pending: int = 2) -> None:
+        """
+        Initialize the DeltaCheckpointer.
+
+        Args:
+            directory (str): Directory checkpoints are written to
+            prefixes (Sequence[str]): State dict key prefixes saved in every checkpoint
+            keep_last (Optional[int]): Number of checkpoints kept, None to keep all
+            base_checkpoint (Optional[str]): Full checkpoint the deltas apply to
+            async_write (bool): Whether to write on a background thread
+            max_pending (int): Snapshots queued for writing before save() blocks, bounding memory
+        """
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last must be at least 1, or None to keep all checkpoints")
+        self.directory = directory
+        self.prefixes = tuple(prefixes)
+        self.keep_last = keep_last
+        self.base_checkpoint = base_checkpoint
+        os.makedirs(directory, exist_ok=True)
+        self.exception = None
+        self._queue = None
+        self._thread = None
+        if async_write:
+            self._queue = queue.Queue(maxsize=max_pending)
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+
+    def path_for(self, iteration: int) -> str:
+        """Get the checkpoint path of an iteration."""
+        return os.path.join(self.directory, f"sam_delta_{iteration:08d}.pt")
+
+    def checkpoints(self) -> List[str]:
+        """List the checkpoints in the directory, oldest first."""
+        return sorted(glob.glob(os.path.join(self.directory, "sam_delta_*.pt")))
+
+    def latest(self) -> Optional[str]:
+        """Get the most recent checkpoint, or None."""
+        paths = self.checkpoints()
+        return paths[-1] if paths else None
+
+    def save(self, model: torch.nn.Module, iteration: int) -> str:
+        """
+        Snapshot the trainable parameters and queue them for writing.
+
+        Args:
+            model (torch.nn.Module): SAM2 model
+            iteration (int): Training iteration
+
+        Returns:
+            str: Path the checkpoint is written to
+        """
+        if self.exception is not None:
+            raise RuntimeError("Failure in checkpoint writer thread") from self.exception
+        payload = {'iteration': iteration, 'prefixes': self.prefixes, 'base_checkpoint': self.base_checkpoint,
+                   'model': trainable_state(model, self.prefixes)}
+        path = self.path_for(iteration)
+        if self._queue is None:
+            self._write(path, payload)
+        else:
+            self._queue.put((path, payload))
+        return path
+
+    def _write(self, path: str, payload: Dict) -> None:
+        """Write one checkpoint atomically and prune old ones."""
+        tmp_path = path + '.tmp'
+        torch.save(payload, tmp_path)
+        os.replace(tmp_path, path)
+        if self.keep_last is not None:
+            for old in self.checkpoints()[:-self.keep_last]:
+                os.remove(old)
+
+    def _write_loop(self) -> None:
+        """Write queued checkpoints until a None sentinel arrives."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self.exception is None:
+                    self._write(*item)
+            except Exception as e:
+                self.exception = e
+            finally:
+                self._queue.task_done()
+
+    def wait(self) -> None:
+        """Block until every queued checkpoint is on disk."""
+        if self._queue is not None:
+            self._queue.join()
+        if self.exception is not None:
+            raise RuntimeError("Failure in checkpoint writer thread") from self.exception
+
+    def close(self) -> None:
+        """Finish pending writes and stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.wait()
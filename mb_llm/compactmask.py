@@ -0,0 +1,301 @@
+"""
+Compact Mask Module
+
+This module provides a run-length encoded binary mask type. Masks are stored as
+COCO-style uncompressed RLE (column-major run lengths, starting with a background run),
+which is typically orders of magnitude smaller than a dense boolean array. Area, bounding
+box, IoU, union and intersection are computed directly on the runs, and the dense array
+is only built when it is explicitly requested.
+"""
+
+import numpy as np
+from typing import Dict, List, Tuple, Union
+
+__all__ = ["CompactMask", "to_compact", "to_dense"]
+
+
+class CompactMask:
+    """
+    A binary mask stored as COCO-style run-length encoding.
+
+    Runs are counted over the mask in column-major (Fortran) order and alternate between
+    background and foreground, starting with a (possibly empty) background run, exactly
+    like the 'counts' of an uncompressed COCO RLE.
+
+    Attributes:
+        counts (np.ndarray): Run lengths, alternating background/foreground
+        shape (Tuple[int, int]): Mask height and width
+    """
+
+    __slots__ = ('counts', 'shape')
+
+    def __init__(self, counts: Union[List[int], np.ndarray], shape: Tuple[int, int]) -> None:
+        """
+        Initialize the CompactMask.
+
+        Args:
+            counts (Union[List[int], np.ndarray]): Run lengths, starting with a background run
+            shape (Tuple[int, int]): Mask height and width
+        """
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    @classmethod
+    def from_dense(cls, mask: np.ndarray) -> "CompactMask":
+        """
+        Encode a dense (H, W) mask.
+
+        Args:
+            mask (np.ndarray): Boolean or 0/1 mask of shape (H, W)
+
+        Returns:
+            CompactMask: The encoded mask
+        """
+        mask = np.asarray(mask)
+        if mask.ndim == 3 and mask.shape[0] == 1:
+            mask = mask[0]
+        flat = mask.ravel(order='F').astype(bool)
+        change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        bounds = np.concatenate([[0], change, [flat.size]])
+        counts = np.diff(bounds)
+        if flat.size and flat[0]:
+            counts = np.concatenate([[0], counts])
+        return cls(counts, mask.shape[:2])
+
+    @classmethod
+    def from_intervals(cls, starts: np.ndarray, ends: np.ndarray, shape: Tuple[int, int]) -> "CompactMask":
+        """
+        Build a mask from sorted, disjoint foreground intervals [start, end) in column-major order.
+
+        Args:
+            starts (np.ndarray): Interval start offsets
+            ends (np.ndarray): Interval end offsets (exclusive)
+            shape (Tuple[int, int]): Mask height and width
+
+        Returns:
+            CompactMask: The encoded mask
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if len(starts) > 1:
+            # merge touching intervals so runs stay canonical
+            keep = np.concatenate([[True], starts[1:] != ends[:-1]])
+            starts = starts[keep]
+            ends = ends[np.concatenate([keep[1:], [True]])]
+        bounds = np.empty(2 * len(starts) + 2, dtype=np.int64)
+        bounds[0] = 0
+        bounds[1:-1:2] = starts
+        bounds[2:-1:2] = ends
+        bounds[-1] = shape[0] * shape[1]
+        counts = np.diff(bounds)
+        if len(counts) > 1 and counts[-1] == 0:
+            counts = counts[:-1]
+        return cls(counts, shape)
+
+    @classmethod
+    def from_coco(cls, rle: Dict) -> "CompactMask":
+        """
+        Build a mask from a COCO RLE dict, with either list or compressed string counts.
+
+        Args:
+            rle (Dict): Dict with 'size' ([H, W]) and 'counts'
+
+        Returns:
+            CompactMask: The decoded mask
+        """
+        counts = rle['counts']
+        if isinstance(counts, (str, bytes)):
+            counts = cls._string_to_counts(counts)
+        return cls(counts, rle['size'])
+
+    def to_coco(self, compressed: bool = False) -> Dict:
+        """
+        Convert to a COCO RLE dict.
+
+        Args:
+            compressed (bool): Whether to encode counts as a COCO compressed string
+
+        Returns:
+            Dict: Dict with 'size' and 'counts'
+        """
+        if compressed:
+            counts = self._counts_to_string(self.counts)
+        else:
+            counts = self.counts.tolist()
+        return {'size': list(self.shape), 'counts': counts}
+
+    def intervals(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the foreground runs as [start, end) offsets in column-major order.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Start and end offsets
+        """
+        bounds = np.cumsum(self.counts)
+        starts = bounds[0::2][:len(bounds) // 2]
+        ends = bounds[1::2]
+        nonempty = ends > starts
+        return starts[nonempty], ends[nonempty]
+
+    def to_dense(self) -> np.ndarray:
+        """
+        Decode to a dense boolean array.
+
+        Returns:
+            np.ndarray: Boolean mask of shape (H, W)
+        """
+        values = np.zeros(len(self.counts), dtype=bool)
+        values[1::2] = True
+        flat = np.repeat(values, self.counts)
+        return flat.reshape(self.shape, order='F')
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        """Decode lazily when used as a numpy array."""
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    @property
+    def area(self) -> int:
+        """Number of foreground pixels."""
+        return int(self.counts[1::2].sum())
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the encoded runs in bytes."""
+        return self.counts.nbytes
+
+    @property
+    def bbox(self) -> List[int]:
+        """Bounding box of the foreground in COCO [x, y, w, h] format."""
+        starts, ends = self.intervals()
+        if len(starts) == 0:
+            return [0, 0, 0, 0]
+        h = self.shape[0]
+        last = ends - 1
+        x0, x1 = starts[0] // h, last[-1] // h
+        single_column = (starts // h) == (last // h)
+        if np.all(single_column):
+            y0 = int((starts % h).min())
+            y1 = int((last % h).max())
+        else:
+            y0, y1 = 0, h - 1
+        return [int(x0), y0, int(x1 - x0 + 1), y1 - y0 + 1]
+
+    def _combine(self, other: "CompactMask", min_coverage: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get intervals covered by at least min_coverage of the two masks."""
+        if self.shape != other.shape:
+            raise ValueError(f"Mask shapes differ: {self.shape} and {other.shape}")
+        s1, e1 = self.intervals()
+        s2, e2 = other.intervals()
+        positions = np.concatenate([s1, s2, e1, e2])
+        deltas = np.concatenate([np.ones(len(s1) + len(s2), dtype=np.int64),
+                                 -np.ones(len(e1) + len(e2), dtype=np.int64)])
+        # ends sort before starts at the same offset so touching runs do not overlap
+        order = np.lexsort((deltas, positions))
+        positions, deltas = positions[order], deltas[order]
+        coverage = np.cumsum(deltas)
+        covered = coverage >= min_coverage
+        enter = covered & ~np.concatenate([[False], covered[:-1]])
+        leave = ~covered & np.concatenate([[False], covered[:-1]])
+        return positions[enter], positions[leave]
+
+    def intersection(self, other: "CompactMask") -> "CompactMask":
+        """
+        Compute the intersection with another mask.
+
+        Args:
+            other (CompactMask): Mask of the same shape
+
+        Returns:
+            CompactMask: The intersection
+        """
+        return CompactMask.from_intervals(*self._combine(other, 2), self.shape)
+
+    def union(self, other: "CompactMask") -> "CompactMask":
+        """
+        Compute the union with another mask.
+
+        Args:
+            other (CompactMask): Mask of the same shape
+
+        Returns:
+            CompactMask: The union
+        """
+        return CompactMask.from_intervals(*self._combine(other, 1), self.shape)
+
+    def iou(self, other: "CompactMask") -> float:
+        """
+        Compute the intersection over union with another mask.
+
+        Args:
+            other (CompactMask): Mask of the same shape
+
+        Returns:
+            float: IoU value, 0 when both masks are empty
+        """
+        starts, ends = self._combine(other, 2)
+        inter = int((ends - starts).sum())
+        union = self.area + other.area - inter
+        return inter / union if union > 0 else 0.0
+
+    def __and__(self, other: "CompactMask") -> "CompactMask":
+        return self.intersection(other)
+
+    def __or__(self, other: "CompactMask") -> "CompactMask":
+        return self.union(other)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompactMask):
+            return NotImplemented
+        return self.shape == other.shape and np.array_equal(self.counts, other.counts)
+
+    def __repr__(self) -> str:
+        return f"CompactMask(shape={self.shape}, area={self.area}, runs={len(self.counts)})"
+
+    @staticmethod
+    def _counts_to_string(counts: np.ndarray) -> str:
+        """Encode run lengths as a COCO compressed RLE string."""
+        chars = []
+        for i, c in enumerate(counts.tolist()):
+            x = c - counts[i - 2] if i > 2 else c
+            x = int(x)
+            more = True
+            while more:
+                ch = x & 0x1f
+                x >>= 5
+                more = (x != -1) if (ch & 0x10) else (x != 0)
+                if more:
+                    ch |= 0x20
+                chars.append(chr(ch + 48))
+        return ''.join(chars)
+
+    @staticmethod
+    def _string_to_counts(s: Union[str, bytes]) -> List[int]:
+        """Decode a COCO compressed RLE string to run lengths."""
+        if isinstance(s, bytes):
+            s = s.decode()
+        counts = []
+        p = 0
+        while p < len(s):
+            x, k, more = 0, 0, True
+            while more:
+                c = ord(s[p]) - 48
+                x |= (c & 0x1f) << (5 * k)
+                more = bool(c & 0x20)
+                p += 1
+                k += 1
+                if not more and (c & 0x10):
+                    x |= -1 << (5 * k)
+            if len(counts) > 2:
+                x += counts[-2]
+            counts.append(x)
+        return counts
+
+
+def to_compact(masks: Union[np.ndarray, List[np.ndarray]]) -> List[CompactMask]:
+    """Convenience function to encode a stack or list of dense masks."""
+    return [CompactMask.from_dense(m) for m in masks]
+
+def to_dense(masks: List[CompactMask]) -> np.ndarray:
+    """Convenience function to decode a list of compact masks into a (N, H, W) stack."""
+    return np.stack([m.to_dense() for m in masks])
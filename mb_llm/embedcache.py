@@ -0,0 +1,181 @@
+"""
+Embedding Cache Module
+
+This module provides a cache for SAM2 image embeddings, so that switching back to an
+image that was already encoded does not run the image encoder again. Entries are keyed
+by image content and model identity, kept in a byte-bounded LRU memory tier, and
+optionally persisted to an on-disk tier.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import torch
+from typing import Dict, List, Optional, Union
+
+__all__ = ["EmbeddingCache"]
+
+Features = Dict[str, Union[torch.Tensor, List[torch.Tensor]]]
+
+
+class EmbeddingCache:
+    """
+    A two-tier (memory and disk) cache for SAM2 image features.
+
+    Cached features have the layout of `SAM2ImagePredictor._features`, i.e. a dict with
+    an 'image_embed' tensor and a 'high_res_feats' list of tensors. Features are stored
+    on the CPU and moved to the requested device when restored.
+
+    Attributes:
+        max_bytes (int): Maximum size of the memory tier in bytes
+        cache_dir (Optional[str]): Directory of the disk tier, None to disable it
+        hits (int): Number of lookups served from memory or disk
+        misses (int): Number of lookups that were not cached
+    """
+
+    def __init__(self, max_bytes: int = 2 * 1024 ** 3, cache_dir: Optional[str] = None) -> None:
+        """
+        Initialize the EmbeddingCache.
+
+        Args:
+            max_bytes (int): Maximum size of the memory tier in bytes. Defaults to 2 GB
+            cache_dir (Optional[str]): Directory for the on-disk tier. Defaults to None (memory only)
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image: np.ndarray, model_id: str) -> str:
+        """
+        Build a cache key from image content and model identity.
+
+        Args:
+            image (np.ndarray): Image array in HWC format
+            model_id (str): String identifying the model (config and checkpoint)
+
+        Returns:
+            str: Hex digest identifying the (image, model) pair
+        """
+        image = np.ascontiguousarray(image)
+        digest = hashlib.sha1()
+        digest.update(model_id.encode())
+        digest.update(str((image.shape, image.dtype.str)).encode())
+        digest.update(memoryview(image).cast('B'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _features_nbytes(features: Features) -> int:
+        """Compute the size of a features dict in bytes."""
+        tensors = [features["image_embed"], *features["high_res_feats"]]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    @staticmethod
+    def _to_device(features: Features, device: Union[str, torch.device]) -> Features:
+        """Move a features dict to a device."""
+        return {
+            "image_embed": features["image_embed"].to(device),
+            "high_res_feats": [f.to(device) for f in features["high_res_feats"]],
+        }
+
+    def _disk_path(self, key: str) -> str:
+        """Get the disk tier path for a key."""
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _put_memory(self, key: str, features: Features) -> None:
+        """Insert an entry into the memory tier and evict least recently used entries."""
+        size = self._features_nbytes(features)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._current_bytes -= self._sizes[key]
+            self._entries[key] = features
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self._current_bytes -= self._sizes.pop(old_key)
+
+    def get(self, key: str, device: Union[str, torch.device] = 'cpu') -> Optional[Features]:
+        """
+        Look up cached features.
+
+        Args:
+            key (str): Cache key from make_key
+            device (Union[str, torch.device]): Device to move the features to
+
+        Returns:
+            Optional[Features]: Cached features, or None on a miss
+        """
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+        if features is None and self.cache_dir and os.path.exists(self._disk_path(key)):
+            features = torch.load(self._disk_path(key), map_location='cpu')
+            self._put_memory(key, features)
+        if features is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._to_device(features, device)
+
+    def put(self, key: str, features: Features) -> None:
+        """
+        Store features in the cache.
+
+        Args:
+            key (str): Cache key from make_key
+            features (Features): Features dict with 'image_embed' and 'high_res_feats'
+        """
+        features = {
+            "image_embed": features["image_embed"].detach().cpu().clone(),
+            "high_res_feats": [f.detach().cpu().clone() for f in features["high_res_feats"]],
+        }
+        self._put_memory(key, features)
+        if self.cache_dir and not os.path.exists(self._disk_path(key)):
+            tmp_path = self._disk_path(key) + '.tmp'
+            torch.save(features, tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+
+    def clear(self, disk: bool = False) -> None:
+        """
+        Clear the memory tier and optionally the disk tier.
+
+        Args:
+            disk (bool): Whether to delete the on-disk entries too
+        """
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._current_bytes = 0
+        if disk and self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.pt'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    @property
+    def memory_bytes(self) -> int:
+        """Current size of the memory tier in bytes."""
+        return self._current_bytes
+
+    def __len__(self) -> int:
+        """Number of entries in the memory tier."""
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        """Whether a key is cached in memory or on disk."""
+        if key in self._entries:
+            return True
+        return bool(self.cache_dir) and os.path.exists(self._disk_path(key))
@@ -0,0 +1,264 @@
+"""
+Evaluation Module
+
+This module provides a held-out evaluation harness for fine-tuned SAM2 predictors. Images
+of a validation CSV are embedded in batches, every instance is prompted with fixed seeded
+points, and mask IoU, boundary F-score and predicted-score calibration are computed on all
+instances of an image at once. Results are summarized and written as a JSON report.
+"""
+
+import json
+import os
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from typing import Dict, Optional, Union
+from .trainingdata import SAM2TrainDataset, make_train_loader
+
+__all__ = ["SegmentationEvaluator", "mask_iou", "boundary_fscore", "calibration"]
+
+
+def mask_iou(pred: torch.Tensor, gt: torch.Tensor) -> torch.Tensor:
+    """
+    Compute the IoU of paired masks.
+
+    Args:
+        pred (torch.Tensor): Boolean predicted masks of shape (N, H, W)
+        gt (torch.Tensor): Boolean ground truth masks of shape (N, H, W)
+
+    Returns:
+        torch.Tensor: IoU per pair, shape (N,)
+    """
+    inter = (pred & gt).flatten(1).sum(1).float()
+    union = (pred | gt).flatten(1).sum(1).float()
+    return torch.where(union > 0, inter / union.clamp(min=1), torch.ones_like(union))
+
+
+def _boundary(masks: torch.Tensor) -> torch.Tensor:
+    """Get the inner boundary pixels of boolean (N, H, W) masks."""
+    m = masks.float().unsqueeze(1)
+    eroded = -F.max_pool2d(-m, kernel_size=3, stride=1, padding=1)
+    return (m - eroded).squeeze(1) > 0
+
+
+def _dilate(masks: torch.Tensor, radius: int) -> torch.Tensor:
+    """Dilate boolean (N, H, W) masks by a square of the given radius."""
+    if radius <= 0:
+        return masks
+    m = masks.float().unsqueeze(1)
+    return F.max_pool2d(m, kernel_size=2 * radius + 1, stride=1, padding=radius).squeeze(1) > 0
+
+
+def boundary_fscore(pred: torch.Tensor, gt: torch.Tensor, tolerance: int = 2) -> torch.Tensor:
+    """
+    Compute the boundary F-score of paired masks.
+
+    A boundary pixel counts as matched when the other mask's boundary lies within
+    `tolerance` pixels of it.
+
+    Args:
+        pred (torch.Tensor): Boolean predicted masks of shape (N, H, W)
+        gt (torch.Tensor): Boolean ground truth masks of shape (N, H, W)
+        tolerance (int): Matching distance in pixels
+
+    Returns:
+        torch.Tensor: Boundary F-score per pair, shape (N,)
+    """
+    pred_b = _boundary(pred)
+    gt_b = _boundary(gt)
+    pred_n = pred_b.flatten(1).sum(1).float()
+    gt_n = gt_b.flatten(1).sum(1).float()
+    precision = (pred_b & _dilate(gt_b, tolerance)).flatten(1).sum(1) / pred_n.clamp(min=1)
+    recall = (gt_b & _dilate(pred_b, tolerance)).flatten(1).sum(1) / gt_n.clamp(min=1)
+    fscore = 2 * precision * recall / (precision + recall).clamp(min=1e-9)
+    # two empty boundaries agree perfectly, one empty boundary not at all
+    both_empty = (pred_n == 0) & (gt_n == 0)
+    return torch.where(both_empty, torch.ones_like(fscore), fscore)
+
+
+def calibration(scores: np.ndarray, ious: np.ndarray, num_bins: int = 10) -> Dict:
+    """
+    Measure how well predicted mask scores match the actual IoU.
+
+    Args:
+        scores (np.ndarray): Predicted IoU scores of shape (N,)
+        ious (np.ndarray): Actual IoU of shape (N,)
+        num_bins (int): Number of equal-width score bins
+
+    Returns:
+        Dict: 'ece' (expected calibration error), 'mae', 'correlation' and per-bin 'bins'
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    ious = np.asarray(ious, dtype=np.float64)
+    if len(scores) == 0:
+        return {'ece': None, 'mae': None, 'correlation': None, 'bins': []}
+    bin_idx = np.clip((scores * num_bins).astype(np.int64), 0, num_bins - 1)
+    counts = np.bincount(bin_idx, minlength=num_bins)
+    score_sum = np.bincount(bin_idx, weights=scores, minlength=num_bins)
+    iou_sum = np.bincount(bin_idx, weights=ious, minlength=num_bins)
+    filled = counts > 0
+    mean_score = score_sum[filled] / counts[filled]
+    mean_iou = iou_sum[filled] / counts[filled]
+    ece = float(np.sum(counts[filled] * np.abs(mean_score - mean_iou)) / len(scores))
+    correlation = None
+    if len(scores) > 1 and scores.std() > 0 and ious.std() > 0:
+        correlation = float(np.corrcoef(scores, ious)[0, 1])
+    bins = [{'low': float(b / num_bins), 'high': float((b + 1) / num_bins), 'count': int(counts[b]),
+             'mean_score': float(s), 'mean_iou': float(i)}
+            for b, s, i in zip(np.flatnonzero(filled), mean_score, mean_iou)]
+    return {'ece': ece, 'mae': float(np.mean(np.abs(scores - ious))), 'correlation': correlation, 'bins': bins}
+
+
+class SegmentationEvaluator:
+    """
+    A class for evaluating a SAM2ImagePredictor on held-out annotated images.
+
+    Prompts are drawn once from a fixed seed, so repeated evaluations during training
+    score the same instances with the same points.
+
+    Attributes:
+        data (Dict): Held-out data dict from DataProcessor.load_data
+        batch_size (int): Images embedded together
+        max_images (Optional[int]): Number of images evaluated per call, None for all
+        tolerance (int): Boundary F-score matching distance in pixels
+        num_bins (int): Number of calibration bins
+        report_dir (Optional[str]): Directory reports are written to
+        history (List[Dict]): Summaries of previous evaluations
+    """
+
+    def __init__(self, data: Union[str, Dict], batch_size: int = 4, num_points: int = 1,
+                 max_images: Optional[int] = None, tolerance: int = 2, num_bins: int = 10,
+                 seed: int = 0, num_workers: int = 0, cache_dir: Optional[str] = None,
+                 report_dir: Optional[str] = None) -> None:
+        """
+        Initialize the SegmentationEvaluator.
+
+        Args:
+            data (Union[str, Dict]): Held-out CSV path, or a data dict from DataProcessor.load_data
+            batch_size (int): Images embedded together
+            num_points (int): Prompt points per instance
+            max_images (Optional[int]): Number of images evaluated per call. A small subset keeps
+                                        evaluations during training short. Defaults to all images
+            tolerance (int): Boundary F-score matching distance in pixels
+            num_bins (int): Number of calibration bins
+            seed (int): Seed of the image subset and prompt points
+            num_workers (int): Loader worker processes
+            cache_dir (Optional[str]): Directory of pre-resized images
+            report_dir (Optional[str]): Directory reports are written to, None to not write reports
+        """
+        if isinstance(data, str):
+            from .segsam2 import DataProcessor
+            data = DataProcessor.load_data(data)
+        self.data = data
+        self.batch_size = batch_size
+        self.max_images = max_images
+        self.tolerance = tolerance
+        self.num_bins = num_bins
+        self.report_dir = report_dir
+        self.history = []
+        self.dataset = SAM2TrainDataset(data, cache_dir=cache_dir, num_points=num_points)
+        self.loader = make_train_loader(self.dataset, batch_size=batch_size, num_workers=num_workers,
+                                        seed=seed, num_samples=min(max_images or len(data), len(data)))
+
+    @torch.inference_mode()
+    def _evaluate_image(self, predictor, img_idx: int, masks: np.ndarray, points: np.ndarray,
+                        labels: np.ndarray) -> Dict[str, np.ndarray]:
+        """Predict every instance of one image of the current batch and score the masks."""
+        _, unnorm_coords, unnorm_labels, _ = predictor._prep_prompts(
+            points, labels, box=None, mask_logits=None, normalize_coords=True, img_idx=img_idx)
+        logits, scores, _ = predictor._predict(unnorm_coords, unnorm_labels, multimask_output=True,
+                                               return_logits=True, img_idx=img_idx)
+        pred = logits[:, 0] > predictor.mask_threshold
+        gt = torch.as_tensor(masks, device=pred.device) > 0
+        return {'iou': mask_iou(pred, gt).float().cpu().numpy(),
+                'boundary_f': boundary_fscore(pred, gt, self.tolerance).float().cpu().numpy(),
+                'score': scores[:, 0].float().cpu().numpy(),
+                'area': gt.flatten(1).sum(1).cpu().numpy()}
+
+    def evaluate(self, predictor, tag: Optional[Union[int, str]] = None) -> Dict:
+        """
+        Evaluate a predictor on the held-out images.
+
+        Args:
+            predictor (SAM2ImagePredictor): Predictor to evaluate, e.g. ModelTrainer.predictor
+            tag (Optional[Union[int, str]]): Label of this evaluation, e.g. the training iteration
+
+        Returns:
+            Dict: Summary with instance counts, IoU statistics, boundary F-score and calibration
+        """
+        t_start = time.time()
+        results = []
+        num_images = 0
+        device_type = torch.device(predictor.device).type
+        with torch.amp.autocast(device_type=device_type):
+            for batch in self.loader:
+                num_images += len(batch)
+                batch = [sample for sample in batch if sample[1].shape[0] > 0]
+                if not batch:
+                    continue
+                predictor.set_image_batch([np.ascontiguousarray(sample[0]) for sample in batch])
+                for img_idx, (_, masks, points, labels) in enumerate(batch):
+                    results.append(self._evaluate_image(predictor, img_idx, masks, points, labels))
+        predictor.reset_predictor()
+
+        metrics = {k: np.concatenate([r[k] for r in results]) if results else np.zeros(0)
+                   for k in ('iou', 'boundary_f', 'score', 'area')}
+        summary = self.summarize(metrics)
+        summary.update(tag=tag, num_images=num_images, seconds=time.time() - t_start)
+        self.history.append(summary)
+        if self.report_dir:
+            self.write_report(summary, metrics)
+        return summary
+
+    def summarize(self, metrics: Dict[str, np.ndarray]) -> Dict:
+        """
+        Summarize per-instance metrics.
+
+        Args:
+            metrics (Dict[str, np.ndarray]): Per-instance 'iou', 'boundary_f', 'score' and 'area'
+
+        Returns:
+            Dict: Summary statistics
+        """
+        iou = metrics['iou']
+        if len(iou) == 0:
+            return {'num_instances': 0}
+        return {'num_instances': int(len(iou)),
+                'mean_iou': float(iou.mean()),
+                'median_iou': float(np.median(iou)),
+                'recall_50': float((iou >= 0.5).mean()),
+                'recall_75': float((iou >= 0.75).mean()),
+                'mean_boundary_f': float(metrics['boundary_f'].mean()),
+                'calibration': calibration(metrics['score'], iou, self.num_bins)}
+
+    def write_report(self, summary: Dict, metrics: Dict[str, np.ndarray]) -> str:
+        """
+        Write a JSON summary and a per-instance metrics CSV.
+
+        Args:
+            summary (Dict): Summary from evaluate
+            metrics (Dict[str, np.ndarray]): Per-instance metrics
+
+        Returns:
+            str: Path of the JSON report
+        """
+        os.makedirs(self.report_dir, exist_ok=True)
+        name = f"eval_{summary['tag']}" if summary.get('tag') is not None else f"eval_{len(self.history)}"
+        path = os.path.join(self.report_dir, name + '.json')
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        np.savetxt(os.path.join(self.report_dir, name + '_instances.csv'),
+                   np.stack([metrics[k] for k in ('iou', 'boundary_f', 'score', 'area')], axis=1),
+                   delimiter=',', header='iou,boundary_f,score,area', comments='', fmt='%.6g')
+        return path
+
+    @staticmethod
+    def format_summary(summary: Dict) -> str:
+        """Format a summary as one log line."""
+        if not summary.get('num_instances'):
+            return f"Eval {summary.get('tag')}: no instances"
+        cal = summary['calibration']
+        return (f"Eval {summary.get('tag')}: {summary['num_instances']} instances, mIoU {summary['mean_iou']:.4f}, "
+                f"boundary F {summary['mean_boundary_f']:.4f}, score ECE {cal['ece']:.4f}, "
+                f"{summary['seconds']:.1f}s")
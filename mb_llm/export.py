@@ -0,0 +1,314 @@
+"""
+Export Module
+
+This module provides a COCO export stage for masks. Masks are converted to simplified
+polygons and compressed RLE in a process pool, in chunks and with a bounded number of
+chunks in flight, and the results are streamed into a COCO JSON or JSON-lines writer in
+input order, so exporting millions of masks never holds them all in memory.
+"""
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .compactmask import CompactMask
+
+__all__ = ["CocoWriter", "MaskExporter", "mask_to_polygons"]
+
+MaskLike = Union[np.ndarray, CompactMask]
+
+
+def mask_to_polygons(mask: MaskLike, tolerance: float = 1.0, min_points: int = 3) -> List[List[float]]:
+    """
+    Convert a mask to simplified COCO polygons.
+
+    Args:
+        mask (MaskLike): Dense (H, W) mask or CompactMask
+        tolerance (float): Maximum distance in pixels between a contour and its simplification,
+                           0 to keep every contour point
+        min_points (int): Minimum number of points a polygon needs to be kept
+
+    Returns:
+        List[List[float]]: Polygons as flat [x0, y0, x1, y1, ...] lists
+    """
+    if isinstance(mask, CompactMask):
+        x, y, w, h = mask.bbox
+        if w == 0 or h == 0:
+            return []
+        crop = _decode_window(mask, x, y, w, h)
+    else:
+        mask = np.asarray(mask)
+        ys, xs = np.nonzero(mask)
+        if len(ys) == 0:
+            return []
+        x, y = int(xs.min()), int(ys.min())
+        crop = mask[y:ys.max() + 1, x:xs.max() + 1]
+    # pad by one pixel so contours of masks touching the crop edge stay closed
+    crop = np.pad(crop.astype(np.uint8), 1)
+    contours, _ = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x - 1, y - 1))
+    polygons = []
+    for contour in contours:
+        if tolerance > 0:
+            contour = cv2.approxPolyDP(contour, tolerance, True)
+        if len(contour) >= min_points:
+            polygons.append(contour.reshape(-1).astype(float).tolist())
+    return polygons
+
+
+def _decode_window(mask: CompactMask, x: int, y: int, w: int, h: int) -> np.ndarray:
+    """Decode only the (h, w) window at (x, y) of a CompactMask from its column-major runs."""
+    height = mask.shape[0]
+    starts, ends = mask.intervals()
+    # keep the parts of the runs inside columns x..x+w
+    starts = np.maximum(starts, x * height)
+    ends = np.minimum(ends, (x + w) * height)
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    # split runs spanning several columns into one segment per column
+    first, last = starts // height, (ends - 1) // height
+    num = last - first + 1
+    run = np.repeat(np.arange(len(starts)), num)
+    col = first[run] + np.arange(int(num.sum())) - np.repeat(np.cumsum(num) - num, num)
+    top = np.maximum(starts[run] - col * height, y) - y
+    bottom = np.minimum(ends[run] - col * height, y + h) - y
+    keep = bottom > top
+    col, top, bottom = col[keep] - x, top[keep], bottom[keep]
+    # mark run starts and ends, then fill each column with a running sum
+    edges = np.zeros((w, h + 1), dtype=np.int32)
+    np.add.at(edges, (col, top), 1)
+    np.add.at(edges, (col, bottom), -1)
+    return np.cumsum(edges[:, :h], axis=1).T > 0
+
+
+def _encode_chunk(chunk: List[Tuple[Dict, List[int], Tuple[int, int]]], tolerance: float,
+                  polygons: bool, rle: bool) -> List[Dict]:
+    """Convert a chunk of (fields, counts, shape) masks to COCO annotation dicts. Runs in a worker."""
+    out = []
+    for fields, counts, shape in chunk:
+        mask = CompactMask(counts, shape)
+        ann = dict(fields)
+        ann['area'] = mask.area
+        ann['bbox'] = mask.bbox
+        if polygons:
+            ann['segmentation'] = mask_to_polygons(mask, tolerance)
+        if rle:
+            key = 'rle' if polygons else 'segmentation'
+            ann[key] = mask.to_coco(compressed=True)
+        out.append(ann)
+    return out
+
+
+class CocoWriter:
+    """
+    A streaming writer of COCO annotations.
+
+    With format 'json', annotations are written to a COCO JSON file as they arrive and
+    the (small) image and category lists are appended when the writer is closed. With
+    format 'jsonl', every image, category and annotation is one line with a 'type' field.
+
+    Attributes:
+        path (str): Output path
+        format (str): 'json' or 'jsonl'
+        num_annotations (int): Number of annotations written
+    """
+
+    def __init__(self, path: str, format: Optional[str] = None) -> None:
+        """
+        Initialize the CocoWriter.
+
+        Args:
+            path (str): Output path
+            format (Optional[str]): 'json' or 'jsonl'. Defaults to the file extension
+        """
+        self.path = path
+        self.format = format or ('jsonl' if path.endswith('.jsonl') else 'json')
+        if self.format not in ('json', 'jsonl'):
+            raise ValueError("format must be 'json' or 'jsonl'")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'w')
+        self._images = []
+        self._categories = {}
+        self._image_ids = set()
+        self.num_annotations = 0
+        if self.format == 'json':
+            self._file.write('{"annotations": [')
+
+    def add_image(self, image_id: int, file_name: str, height: int, width: int, **fields) -> None:
+        """Record an image. Images added twice are written once."""
+        if image_id in self._image_ids:
+            return
+        self._image_ids.add(image_id)
+        image = {'id': image_id, 'file_name': file_name, 'height': int(height), 'width': int(width), **fields}
+        if self.format == 'jsonl':
+            self._file.write(json.dumps({'type': 'image', **image}) + '\n')
+        else:
+            self._images.append(image)
+
+    def add_category(self, category_id: int, name: str, **fields) -> None:
+        """Record a category. Categories added twice are written once."""
+        if category_id in self._categories:
+            return
+        category = {'id': category_id, 'name': name, **fields}
+        self._categories[category_id] = category
+        if self.format == 'jsonl':
+            self._file.write(json.dumps({'type': 'category', **category}) + '\n')
+
+    def write(self, annotation: Dict) -> int:
+        """
+        Write one annotation, assigning it the next annotation id.
+
+        Args:
+            annotation (Dict): COCO annotation without 'id'
+
+        Returns:
+            int: The annotation id
+        """
+        self.num_annotations += 1
+        annotation = {'id': self.num_annotations, **annotation}
+        if self.format == 'jsonl':
+            self._file.write(json.dumps({'type': 'annotation', **annotation}) + '\n')
+        else:
+            if self.num_annotations > 1:
+                self._file.write(',')
+            self._file.write('\n' + json.dumps(annotation))
+        return self.num_annotations
+
+    def close(self) -> None:
+        """Write the image and category lists and close the file."""
+        if self._file is None:
+            return
+        if self.format == 'json':
+            self._file.write('\n], "images": ' + json.dumps(self._images) +
+                             ', "categories": ' + json.dumps(list(self._categories.values())) + '}\n')
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> "CocoWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class MaskExporter:
+    """
+    A class converting masks to COCO polygons and RLE in a process pool.
+
+    Attributes:
+        num_workers (int): Worker processes, 0 to convert on the calling thread
+        tolerance (float): Polygon simplification tolerance in pixels
+        polygons (bool): Whether to export polygons as 'segmentation'
+        rle (bool): Whether to export compressed RLE ('rle', or 'segmentation' without polygons)
+        chunksize (int): Masks sent to a worker per task
+        max_pending (int): Chunks in flight before the input is read further
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, tolerance: float = 1.0, polygons: bool = True,
+                 rle: bool = True, chunksize: int = 64, max_pending: Optional[int] = None) -> None:
+        """
+        Initialize the MaskExporter.
+
+        Args:
+            num_workers (Optional[int]): Worker processes. Defaults to the number of CPUs
+            tolerance (float): Polygon simplification tolerance in pixels
+            polygons (bool): Whether to export polygons as 'segmentation'
+            rle (bool): Whether to export compressed RLE
+            chunksize (int): Masks sent to a worker per task
+            max_pending (Optional[int]): Chunks in flight. Defaults to 4 per worker
+        """
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        self.tolerance = tolerance
+        self.polygons = polygons
+        self.rle = rle
+        self.chunksize = chunksize
+        self.max_pending = max_pending or 4 * max(self.num_workers, 1)
+
+    @staticmethod
+    def _pack(annotation: Dict) -> Tuple[Dict, List[int], Tuple[int, int]]:
+        """Split an annotation into its plain fields and a compact mask that is cheap to send to a worker."""
+        fields = {k: v for k, v in annotation.items() if k not in ('segmentation', 'mask')}
+        mask = annotation['segmentation'] if 'segmentation' in annotation else annotation['mask']
+        if isinstance(mask, dict):
+            mask = CompactMask.from_coco(mask)
+        elif not isinstance(mask, CompactMask):
+            mask = CompactMask.from_dense(mask)
+        fields.setdefault('category_id', 1)
+        fields.setdefault('iscrowd', 0)
+        for key, value in fields.items():
+            if isinstance(value, np.generic):
+                fields[key] = value.item()
+            elif isinstance(value, np.ndarray):
+                fields[key] = value.tolist()
+        return fields, mask.counts.tolist(), mask.shape
+
+    def _chunks(self, annotations: Iterable[Dict]) -> Iterator[List]:
+        """Group packed annotations into chunks."""
+        chunk = []
+        for annotation in annotations:
+            chunk.append(self._pack(annotation))
+            if len(chunk) == self.chunksize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def convert(self, annotations: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Convert annotations lazily, in input order.
+
+        Args:
+            annotations (Iterable[Dict]): Dicts with 'image_id', a 'segmentation' (dense mask,
+                                          CompactMask or COCO RLE) and optional 'category_id',
+                                          'score' or other fields that are copied through
+
+        Yields:
+            Dict: COCO annotation with 'area', 'bbox', polygons and/or RLE
+        """
+        if self.num_workers == 0:
+            for chunk in self._chunks(annotations):
+                yield from _encode_chunk(chunk, self.tolerance, self.polygons, self.rle)
+            return
+        with ProcessPoolExecutor(max_workers=self.num_workers) as pool:
+            pending = deque()
+            for chunk in self._chunks(annotations):
+                pending.append(pool.submit(_encode_chunk, chunk, self.tolerance, self.polygons, self.rle))
+                if len(pending) >= self.max_pending:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def export(self, annotations: Iterable[Dict], writer: Union[str, CocoWriter],
+               images: Optional[Iterable[Dict]] = None, categories: Optional[Dict[int, str]] = None) -> int:
+        """
+        Convert annotations and stream them into a COCO writer.
+
+        Args:
+            annotations (Iterable[Dict]): Annotations as accepted by convert
+            writer (Union[str, CocoWriter]): Writer, or an output path (.json or .jsonl)
+            images (Optional[Iterable[Dict]]): Image records with 'id', 'file_name', 'height', 'width'
+            categories (Optional[Dict[int, str]]): Category names by id. Defaults to {1: 'object'}
+
+        Returns:
+            int: Number of annotations written
+        """
+        own_writer = isinstance(writer, str)
+        if own_writer:
+            writer = CocoWriter(writer)
+        try:
+            for category_id, name in (categories or {1: 'object'}).items():
+                writer.add_category(category_id, name)
+            for image in images or []:
+                writer.add_image(image['id'], image['file_name'], image['height'], image['width'])
+            count = 0
+            for annotation in self.convert(annotations):
+                writer.write(annotation)
+                count += 1
+        finally:
+            if own_writer:
+                writer.close()
+        return count
@@ -0,0 +1,182 @@
+"""
+Feature Store Module
+
+This module provides a memory-mapped on-disk store of SAM2 image features for training
+with a frozen image encoder. The Hiera encoder runs once per training image to fill the
+store, after which every training step reads `image_embed` and `high_res_feats` straight
+from the mapped files and only the prompt encoder and mask decoder are run.
+"""
+
+import json
+import os
+import numpy as np
+import torch
+from typing import Dict, List, Sequence, Tuple, Union
+
+__all__ = ["FeatureStore"]
+
+Features = Dict[str, Union[torch.Tensor, List[torch.Tensor]]]
+
+
+class FeatureStore:
+    """
+    A directory of memory-mapped .npy arrays holding SAM2 features of a fixed image list.
+
+    The store contains one (N, C, H, W) array per feature level ('image_embed.npy',
+    'high_res_feats_0.npy', ...), the original size of every image, and a 'meta.json'
+    with the image keys, model identity and the number of images written so far.
+
+    Attributes:
+        path (str): Store directory
+        keys (List[str]): Image identifiers, in store order
+        model_id (str): Identity of the model that computed the features
+        num_done (int): Number of images whose features are written
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open an existing FeatureStore for reading.
+
+        Args:
+            path (str): Store directory
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.keys = meta['keys']
+        self.model_id = meta['model_id']
+        self.num_done = meta['num_done']
+        self.num_levels = meta['num_levels']
+        self._embed = np.load(os.path.join(path, 'image_embed.npy'), mmap_mode='r')
+        self._high_res = [np.load(os.path.join(path, f'high_res_feats_{i}.npy'), mmap_mode='r')
+                          for i in range(self.num_levels)]
+        self._orig_hw = np.load(os.path.join(path, 'orig_hw.npy'))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def complete(self) -> bool:
+        """Whether features of every image are written."""
+        return self.num_done == len(self.keys)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the feature arrays in bytes."""
+        return self._embed.nbytes + sum(a.nbytes for a in self._high_res)
+
+    def get_batch(self, indices: Sequence[int], device: Union[str, torch.device] = 'cpu',
+                  dtype: torch.dtype = torch.float32) -> Tuple[Features, List[Tuple[int, int]]]:
+        """
+        Read the features of several images in the layout of `SAM2ImagePredictor._features`.
+
+        Args:
+            indices (Sequence[int]): Image indices in store order
+            device (Union[str, torch.device]): Device to move the features to
+            dtype (torch.dtype): Dtype of the returned tensors
+
+        Returns:
+            Tuple[Features, List[Tuple[int, int]]]: Features with a leading batch dimension, and
+                                                     the original (H, W) of every image
+        """
+        indices = [int(i) for i in indices]
+        if any(i >= self.num_done for i in indices):
+            raise IndexError("Requested features that have not been computed yet")
+
+        def read(array: np.ndarray) -> torch.Tensor:
+            return torch.from_numpy(np.stack([array[i] for i in indices])).to(device=device, dtype=dtype)
+
+        features = {"image_embed": read(self._embed),
+                    "high_res_feats": [read(a) for a in self._high_res]}
+        return features, [tuple(int(v) for v in self._orig_hw[i]) for i in indices]
+
+    def set_predictor(self, predictor, indices: Sequence[int]) -> None:
+        """
+        Put the features of several images into a SAM2ImagePredictor, as set_image_batch would.
+
+        Args:
+            predictor (SAM2ImagePredictor): Predictor to set up
+            indices (Sequence[int]): Image indices in store order
+        """
+        predictor.reset_predictor()
+        predictor._features, predictor._orig_hw = self.get_batch(indices, predictor.device)
+        predictor._is_image_set = True
+        predictor._is_batch = True
+
+    @classmethod
+    def build(cls, path: str, predictor, images: Sequence, keys: Sequence[str], model_id: str = '',
+              batch_size: int = 4, dtype: str = 'float16') -> "FeatureStore":
+        """
+        Compute features for a list of images and write them to a new or partially built store.
+
+        An existing store with the same keys and model is resumed from its last written image.
+
+        Args:
+            path (str): Store directory
+            predictor (SAM2ImagePredictor): Predictor whose image encoder computes the features
+            images (Sequence): Sequence of RGB images (np.ndarray), indexed in the order of keys
+            keys (Sequence[str]): Image identifiers, e.g. image paths
+            model_id (str): Identity of the model, checked when the store is used
+            batch_size (int): Images encoded together
+            dtype (str): Storage dtype, 'float16' halves the disk size of 'float32'
+
+        Returns:
+            FeatureStore: The store opened for reading
+        """
+        keys = [str(k) for k in keys]
+        meta_path = os.path.join(path, 'meta.json')
+        num_done = 0
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta['keys'] == keys and meta['model_id'] == model_id and meta['dtype'] == dtype:
+                num_done = meta['num_done']
+        os.makedirs(path, exist_ok=True)
+
+        arrays = None
+        if num_done:
+            arrays = cls._open_arrays(path, meta['num_levels'], 'r+')
+        for start in range(num_done, len(keys), batch_size):
+            batch = [np.ascontiguousarray(images[i]) for i in range(start, min(start + batch_size, len(keys)))]
+            predictor.set_image_batch(batch)
+            feats = [predictor._features["image_embed"], *predictor._features["high_res_feats"]]
+            if arrays is None:
+                arrays = cls._create_arrays(path, feats, len(keys), dtype)
+            for array, feat in zip(arrays[:-1], feats):
+                array[start:start + len(batch)] = feat.float().cpu().numpy()
+            arrays[-1][start:start + len(batch)] = [image.shape[:2] for image in batch]
+            for array in arrays:
+                array.flush()
+            cls._write_meta(meta_path, keys, model_id, dtype, len(feats) - 1, start + len(batch))
+            print(f"Computed features for {start + len(batch)}/{len(keys)} images")
+        predictor.reset_predictor()
+        if arrays is None and not num_done:
+            raise ValueError("FeatureStore.build needs at least one image")
+        return cls(path)
+
+    @staticmethod
+    def _create_arrays(path: str, feats: List[torch.Tensor], num: int, dtype: str) -> List[np.ndarray]:
+        """Create the memory-mapped arrays of a new store."""
+        names = ['image_embed'] + [f'high_res_feats_{i}' for i in range(len(feats) - 1)]
+        arrays = [np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=dtype,
+                                            shape=(num, *feat.shape[1:]))
+                  for name, feat in zip(names, feats)]
+        arrays.append(np.lib.format.open_memmap(os.path.join(path, 'orig_hw.npy'), mode='w+',
+                                                dtype=np.int64, shape=(num, 2)))
+        return arrays
+
+    @staticmethod
+    def _open_arrays(path: str, num_levels: int, mode: str) -> List[np.ndarray]:
+        """Open the memory-mapped arrays of an existing store."""
+        names = ['image_embed'] + [f'high_res_feats_{i}' for i in range(num_levels)] + ['orig_hw']
+        return [np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in names]
+
+    @staticmethod
+    def _write_meta(meta_path: str, keys: List[str], model_id: str, dtype: str, num_levels: int,
+                    num_done: int) -> None:
+        """Write the store metadata atomically."""
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'keys': keys, 'model_id': model_id, 'dtype': dtype, 'num_levels': num_levels,
+                       'num_done': num_done}, f)
+        os.replace(tmp_path, meta_path)
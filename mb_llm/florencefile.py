@@ -22,6 +22,7 @@ from torch.utils.data import Dataset, DataLoader
 from tqdm import tqdm
 from typing import List, Dict, Any, Tuple, Generator, Optional, Union
 import os
+from .render import OverlayRenderer
 
 __all__ = ["FlorenceModel", "FlorenceDatasetLoader", "FlorenceDataset"]
 
@@ -272,6 +273,32 @@ class FlorenceModel:
 
         return image
 
+    def render_polygons(self,
+                        prediction: Dict[str, List],
+                        image: Optional[Union[str, np.ndarray, Image.Image]] = None,
+                        fill_mask: bool = False,
+                        ext: Optional[str] = None) -> Union[np.ndarray, bytes]:
+        """
+        Draw all predicted polygons onto an image without matplotlib.
+
+        Args:
+            prediction (Dict[str, List]): Dictionary containing polygons and labels
+            image (Optional[Union[str, np.ndarray, Image.Image]]): Image to draw on. If not provided, it will use the set image
+            fill_mask (bool): Whether to fill the polygons
+            ext (Optional[str]): Encode the result in this format (e.g. '.png'), None to return the array
+
+        Returns:
+            Union[np.ndarray, bytes]: Rendered uint8 RGB image, or encoded bytes when ext is given
+        """
+        if image is None:
+            image = self.image
+        if isinstance(image, Image.Image):
+            image = np.array(image.convert('RGB'))
+        out = OverlayRenderer.load_image(image)
+        polygons = [polygon for polygon_set in prediction['polygons'] for polygon in polygon_set]
+        OverlayRenderer.draw_polygons(out, polygons, color=(0, 255, 0), fill=fill_mask)
+        return OverlayRenderer.encode(out, ext) if ext else out
+
     def _draw_polygon(self,
                      draw: ImageDraw.Draw,
                      polygons: List[List[float]],
@@ -0,0 +1,112 @@
+"""
+Mask Store Module
+
+This module provides an append-only on-disk store for video masks. Every record is one
+JSON line holding the frame index, object id and the mask as a compressed COCO RLE, so
+writers only ever append and readers can stream records back without loading the
+whole video into memory.
+"""
+
+import json
+import os
+from typing import Iterator, Optional, Tuple, Union
+import numpy as np
+from .compactmask import CompactMask
+
+__all__ = ["MaskStore"]
+
+
+class MaskStore:
+    """
+    An append-only JSON-lines store of (frame_idx, obj_id, mask) records.
+
+    Attributes:
+        path (str): Path of the store file
+        flush_every (int): Number of appended records between flushes
+        count (int): Number of records appended through this instance
+    """
+
+    def __init__(self, path: str, flush_every: int = 100) -> None:
+        """
+        Initialize the MaskStore. The file is created if it does not exist and appended to otherwise.
+
+        Args:
+            path (str): Path of the store file, e.g. 'masks.jsonl'
+            flush_every (int): Number of appended records between flushes
+        """
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._file = None
+
+    def _open(self) -> None:
+        """Open the store file for appending."""
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a')
+
+    def append(self, frame_idx: int, obj_id: int, mask: Union[np.ndarray, CompactMask]) -> None:
+        """
+        Append one mask record.
+
+        Args:
+            frame_idx (int): Frame index
+            obj_id (int): Object id
+            mask (Union[np.ndarray, CompactMask]): Dense (H, W) mask or CompactMask
+        """
+        self._open()
+        if not isinstance(mask, CompactMask):
+            mask = CompactMask.from_dense(mask)
+        record = {'frame_idx': int(frame_idx), 'obj_id': int(obj_id), **mask.to_coco(compressed=True)}
+        self._file.write(json.dumps(record) + '\n')
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def flush(self) -> None:
+        """Flush appended records to disk."""
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        """Flush and close the store file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "MaskStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def read(self, frame_idx: Optional[int] = None,
+             obj_id: Optional[int] = None) -> Iterator[Tuple[int, int, CompactMask]]:
+        """
+        Stream records back from disk, optionally filtered by frame and object.
+
+        Args:
+            frame_idx (Optional[int]): Only return records of this frame
+            obj_id (Optional[int]): Only return records of this object
+
+        Yields:
+            Tuple[int, int, CompactMask]: Frame index, object id and mask
+        """
+        self.flush()
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if frame_idx is not None and record['frame_idx'] != frame_idx:
+                    continue
+                if obj_id is not None and record['obj_id'] != obj_id:
+                    continue
+                yield record['frame_idx'], record['obj_id'], CompactMask.from_coco(record)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, CompactMask]]:
+        return self.read()
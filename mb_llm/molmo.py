@@ -5,14 +5,20 @@ This module provides functionality for working with the Molmo model for image an
 It includes capabilities for model initialization, inference, and coordinate extraction/plotting.
 """
 
-from transformers import AutoModelForCausalLM, AutoProcessor, GenerationConfig
+from transformers import AutoProcessor, GenerationConfig
 import torch
 from PIL import Image
 import re
+import time
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
-from typing import Union, List, Tuple, Optional, Any
+from typing import Union, List, Tuple, Optional, Any, Dict, Sequence, Iterable, Iterator
+from .render import OverlayRenderer
+from .molmopipeline import MolmoPipeline
+from .molmosession import MolmoSession, MolmoSessionCache
+from .molmoload import load_molmo
+from .molmocrops import process_example, resolve_crops
 
 __all__ = ["MolmoModel"]
 
@@ -33,13 +39,20 @@ class MolmoModel:
         model: The loaded Molmo model
         processor: The model's processor
         image: The currently loaded image
+        sessions (MolmoSessionCache): Encoded image prefixes for follow-up questions
+        load_stats (Dict[str, Any]): Load time, resident memory and settings of the model load
+        crops (Optional[Dict[str, Any]]): Default crop budget of image preprocessing
     """
 
     def __init__(self, 
                  model_name: str = "allenai/Molmo-1B-0924",
                  model_path: Optional[str] = None,
                  processor: Optional[Any] = None,
-                 device: str = 'cpu') -> None:
+                 device: str = 'cpu',
+                 max_sessions: int = 4,
+                 max_session_bytes: Optional[int] = None,
+                 load: Optional[Union[str, Dict[str, Any]]] = None,
+                 crops: Optional[Union[str, Dict[str, Any]]] = None) -> None:
         """
         Initialize the MolmoModel.
 
@@ -48,6 +61,15 @@ class MolmoModel:
             model_path (Optional[str]): Path to a local model file
             processor (Optional[Any]): Custom processor for the model
             device (str): Device to run the model on ('cpu' or 'cuda')
+            max_sessions (int): Maximum number of image sessions kept for follow-up questions
+            max_session_bytes (Optional[int]): Maximum total KV cache size of kept sessions in bytes
+            load (Optional[Union[str, Dict[str, Any]]]): Loading mode: None for the stored dtype,
+                'low_mem' to read memory-mapped safetensors with low peak memory, 'bf16' to also
+                cast to bfloat16, 'int8' to also quantize the language model's Linear layers (CPU),
+                or a dict of settings (see molmoload.load_molmo)
+            crops (Optional[Union[str, Dict[str, Any]]]): Default crop budget: None for the processor
+                defaults, a preset from MOLMO_CROP_PRESETS ('full', 'balanced', 'fast', 'minimal'),
+                or a dict with 'max_crops', 'overlap_margins' and 'max_side'
         """
         if device == 'cpu':
             device = "cpu"
@@ -61,20 +83,7 @@ class MolmoModel:
         self.model_path = model_path
         
         # Initialize model
-        if model_path:
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                trust_remote_code=True,
-                torch_dtype='auto',
-                device_map=self.device
-            )
-        else:
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_name,
-                trust_remote_code=True,
-                torch_dtype='auto',
-                device_map=self.device
-            )
+        self.model, self.load_stats = load_molmo(model_path or model_name, self.device, load)
 
         # Initialize processor
         if processor:
@@ -82,39 +91,338 @@ class MolmoModel:
         else:
             self.processor = AutoProcessor.from_pretrained(
                 model_name,
-                trust_remote_code=True,
-                torch_dtype='auto',
-                device_map=self.device
+                trust_remote_code=True
             )
+
+        self.sessions = MolmoSessionCache(max_sessions=max_sessions, max_bytes=max_session_bytes)
+        self.crops = resolve_crops(crops)
             
-    def run_inference(self, image: Union[str, Image.Image], text: str) -> str:
+    def run_inference(self, image: Union[str, Image.Image], text: str,
+                      crops: Optional[Union[str, Dict[str, Any]]] = None) -> str:
         """
         Run inference on an image-text pair using the Molmo model.
 
         Args:
             image (Union[str, Image.Image]): Path to the image or PIL Image object
             text (str): Text prompt for the model
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget preset or settings. Defaults to self.crops
 
         Returns:
             str: Generated text from the model
         """
-        if isinstance(image, str):
-            self.image = Image.open(image)
+        self.image = self._load_image(image)
+        inputs = self.preprocess(self.image, text, crops)
+        return self._generate([inputs])[0]
+
+    def preprocess(self, image: Image.Image, text: str,
+                   crops: Optional[Union[str, Dict[str, Any]]] = None) -> Dict[str, torch.Tensor]:
+        """
+        Tile and tokenize an image-text pair with a crop budget.
+
+        Args:
+            image (Image.Image): The image
+            text (str): Text prompt for the model
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget preset or settings. Defaults to self.crops
+
+        Returns:
+            Dict[str, torch.Tensor]: Outputs of processor.process
+        """
+        return process_example(self.processor, image, text, self.crops if crops is None else crops)
+
+    def run_batch(self,
+                  images: Sequence[Union[str, Image.Image]],
+                  prompts: Union[str, Sequence[str]],
+                  batch_size: int = 4,
+                  max_new_tokens: int = 1024,
+                  stop_strings: Optional[Sequence[str]] = None,
+                  crops: Optional[Union[str, Dict[str, Any]]] = None) -> List[str]:
+        """
+        Run inference on many image-text pairs, generating once per batch.
+
+        Args:
+            images (Sequence[Union[str, Image.Image]]): Image paths or PIL Image objects
+            prompts (Union[str, Sequence[str]]): One prompt per image, or a single prompt for all images
+            batch_size (int): Number of examples generated together
+            max_new_tokens (int): Maximum number of generated tokens per example
+            stop_strings (Optional[Sequence[str]]): Extra strings ending generation, e.g. "</points>"
+                                                    to skip decode steps after the points
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget preset or settings. Defaults to self.crops
+
+        Returns:
+            List[str]: Generated text per image, in input order
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts] * len(images)
+        if len(prompts) != len(images):
+            raise ValueError(f"Got {len(images)} images but {len(prompts)} prompts")
+
+        results = []
+        for start in range(0, len(images), batch_size):
+            examples = [self.preprocess(self._load_image(image), prompt, crops)
+                        for image, prompt in zip(images[start:start + batch_size],
+                                                 prompts[start:start + batch_size])]
+            results.extend(self._generate(examples, max_new_tokens, stop_strings))
+        return results
+
+    def run_stream(self,
+                   items: Iterable[Tuple[Union[str, Image.Image], str]],
+                   **kwargs) -> Iterator[Dict[str, Any]]:
+        """
+        Run inference over a stream of (image, prompt) pairs with pipelined preprocessing.
+
+        Worker threads (or processes) preprocess upcoming examples into a bounded queue while
+        the current batch generates. See MolmoPipeline for the arguments and metrics.
+
+        Args:
+            items (Iterable[Tuple[Union[str, Image.Image], str]]): Image paths or PIL images with prompts
+            **kwargs: MolmoPipeline arguments, e.g. batch_size, num_workers, queue_size, crops
+
+        Yields:
+            Dict[str, Any]: Result per example with 'index', 'prompt', 'text' and 'image_size'
+        """
+        kwargs.setdefault('crops', self.crops)
+        self.pipeline = MolmoPipeline(self, **kwargs)
+        yield from self.pipeline.run(items)
+
+    def open_session(self, image: Union[str, Image.Image],
+                     crops: Optional[Union[str, Dict[str, Any]]] = None) -> MolmoSession:
+        """
+        Encode an image once for several questions.
+
+        Runs the vision encoder and the prefill over the image prefix of the prompt and keeps
+        its KV cache. Sessions are cached by image content, so opening the same image again
+        returns the cached session until it is evicted.
+
+        Args:
+            image (Union[str, Image.Image]): Path to the image or PIL Image object
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget preset or settings. Defaults to self.crops
+
+        Returns:
+            MolmoSession: The session
+        """
+        image = self._load_image(image)
+        crops = resolve_crops(self.crops if crops is None else crops)
+        key = self.sessions.make_key(image, crops)
+        session = self.sessions.get(key)
+        if session is not None:
+            return session
+
+        start = time.perf_counter()
+        inputs = process_example(self.processor, image, "", crops)
+        prefix_len = self._prefix_len(inputs)
+        # one-time check that prompts can be tokenized without the image for this processor
+        if not torch.equal(inputs['input_ids'][prefix_len:].long(), self._text_tokens("")):
+            raise ValueError("Processor prompt format does not match the session text tokenization")
+        prefix = dict(inputs, input_ids=inputs['input_ids'][:prefix_len])
+        prefix = {k: v.to(self.model.device) for k, v in self.collate([prefix]).items()}
+        with torch.inference_mode():
+            output = self.model(
+                **prefix,
+                attention_mask=torch.ones_like(prefix['input_ids']),
+                position_ids=torch.arange(prefix_len, device=self.model.device)[None],
+                use_cache=True
+            )
+        session = MolmoSession(key, image, inputs['input_ids'][:prefix_len].clone(), output.past_key_values,
+                               encode_s=time.perf_counter() - start, crops=crops)
+        self.sessions.put(session)
+        return session
+
+    def ask(self,
+            image: Union[str, Image.Image, MolmoSession],
+            prompts: Union[str, Sequence[str]],
+            max_new_tokens: int = 1024,
+            crops: Optional[Union[str, Dict[str, Any]]] = None) -> Union[str, List[str]]:
+        """
+        Answer one or more prompts about an image, reusing its encoded prefix.
+
+        The image is encoded and its prefix prefilled once per session; every prompt then
+        only runs its own text tokens and the generated tokens through the model. Decoding
+        is greedy, like run_inference.
+
+        Args:
+            image (Union[str, Image.Image, MolmoSession]): Image path, PIL Image or an open session
+            prompts (Union[str, Sequence[str]]): A prompt, or several prompts about the same image
+            max_new_tokens (int): Maximum number of generated tokens per prompt
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget of a new session. Defaults to self.crops
+
+        Returns:
+            Union[str, List[str]]: Generated text, or one text per prompt when a list is given
+        """
+        session = image if isinstance(image, MolmoSession) else self.open_session(image, crops)
+        self.image = session.image
+        texts = []
+        for prompt in ([prompts] if isinstance(prompts, str) else prompts):
+            texts.append(self._generate_from_prefix(session, self._text_tokens(prompt), max_new_tokens))
+            session.num_questions += 1
+        return texts[0] if isinstance(prompts, str) else texts
+
+    def stream_points(self,
+                      image: Union[str, Image.Image, MolmoSession],
+                      text: str,
+                      max_new_tokens: int = 1024,
+                      max_points: Optional[int] = None,
+                      stop_strings: Sequence[str] = ("</points>", "</point>"),
+                      crops: Optional[Union[str, Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Generate for a pointing prompt token by token, yielding text and points as they appear.
+
+        Generation runs on the image's session (see open_session), so asking again about the
+        same image skips the image prefix. It stops at the end of text, after max_points
+        points, or once one of the stop strings has been generated.
+
+        Args:
+            image (Union[str, Image.Image, MolmoSession]): Image path, PIL Image or an open session
+            text (str): Pointing prompt for the model
+            max_new_tokens (int): Maximum number of generated tokens
+            max_points (Optional[int]): Stop once this many points are parsed, None for no limit
+            stop_strings (Sequence[str]): Stop once the generated text contains one of these,
+                                          e.g. the closing points tag. Empty to disable
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget of a new session. Defaults to self.crops
+
+        Yields:
+            Dict[str, Any]: Per generated token, 'text' (newly decoded text), 'points' (newly
+                            completed points in pixels, shape (M, 2)), 'num_tokens' and 'done'.
+                            The last item has 'done' True and a 'stop_reason' of 'eos',
+                            'max_points', 'stop_string' or 'max_new_tokens'
+        """
+        session = image if isinstance(image, MolmoSession) else self.open_session(image, crops)
+        self.image = session.image
+        suffix_ids = self._text_tokens(text)
+        session.num_questions += 1
+
+        scale = np.array(session.image.size) / 100
+        generated = []
+        decoded = ""
+        num_points = 0
+        stop_reason = "max_new_tokens"
+        for token in self._greedy_tokens(session, suffix_ids, max_new_tokens):
+            generated.append(token)
+            full = self.processor.tokenizer.decode(generated, skip_special_tokens=True)
+            if full.endswith("\ufffd"):
+                # wait for the rest of a multi-byte character
+                continue
+            delta, decoded = full[len(decoded):], full
+            points = self.extract_points(decoded).reshape(-1, 2)
+            new_points, num_points = points[num_points:] * scale, len(points)
+            if max_points is not None and num_points >= max_points:
+                new_points = new_points[:len(new_points) - (num_points - max_points)]
+                stop_reason = "max_points"
+            elif any(s in decoded for s in stop_strings):
+                # drop text generated in the same token after the stop string
+                end = min(decoded.index(s) + len(s) for s in stop_strings if s in decoded)
+                delta = delta[:max(len(delta) - (len(decoded) - end), 0)]
+                stop_reason = "stop_string"
+            yield {'text': delta, 'points': new_points, 'num_tokens': len(generated),
+                   'done': False}
+            if stop_reason != "max_new_tokens":
+                break
         else:
-            self.image = image
+            if len(generated) < max_new_tokens:
+                stop_reason = "eos"
+        yield {'text': "", 'points': np.zeros((0, 2)), 'num_tokens': len(generated), 'done': True,
+               'stop_reason': stop_reason}
+
+    def _text_tokens(self, prompt: str) -> torch.Tensor:
+        """
+        Tokenize a prompt in Molmo's chat format, as processor.process places it after the image
+        tokens, so session prompts skip preprocessing the image again.
+        """
+        tokens = self.processor.tokenizer.encode(" User: " + prompt + " Assistant:", add_special_tokens=False)
+        return torch.tensor(tokens, dtype=torch.long)
+
+    def _prefix_len(self, inputs: Dict[str, torch.Tensor]) -> int:
+        """Get the length of the prompt prefix that ends with the last image token."""
+        tokenizer = self.processor.tokenizer
+        image_token_ids = set()
+        for token in ('<im_start>', '<im_end>', '<im_patch>', '<im_col>', '<|image|>'):
+            token_id = tokenizer.convert_tokens_to_ids(token)
+            if token_id is not None and token_id != tokenizer.unk_token_id:
+                image_token_ids.add(token_id)
+        positions = [i for i, t in enumerate(inputs['input_ids'].tolist()) if t in image_token_ids]
+        if positions:
+            return positions[-1] + 1
+        return int(inputs['image_input_idx'].max()) + 1
 
-        inputs = self.processor.process(images=[self.image], text=text)
-        inputs = {k: v.to(self.model.device).unsqueeze(0) for k, v in inputs.items()}
+    def _generate_from_prefix(self, session: MolmoSession, suffix_ids: torch.Tensor, max_new_tokens: int) -> str:
+        """Greedily generate after a session prefix, prefilling only the prompt's own tokens."""
+        generated = list(self._greedy_tokens(session, suffix_ids, max_new_tokens))
+        return self.processor.tokenizer.decode(generated, skip_special_tokens=True)
+
+    def _greedy_tokens(self, session: MolmoSession, suffix_ids: torch.Tensor, max_new_tokens: int) -> Iterator[int]:
+        """Yield greedily generated token ids after a session prefix, stopping at the end-of-text token."""
+        tokenizer = self.processor.tokenizer
+        stop_ids = {tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("<|endoftext|>")}
+        device = self.model.device
+        past_key_values = session.fork_cache()
+        length = session.prefix_len
+        tokens = suffix_ids[None].to(device)
+        for _ in range(max_new_tokens):
+            n = tokens.size(1)
+            # inference mode per step, so it does not leak into the caller between tokens
+            with torch.inference_mode():
+                output = self.model(
+                    input_ids=tokens,
+                    attention_mask=torch.ones(1, length + n, dtype=torch.long, device=device),
+                    position_ids=torch.arange(length, length + n, device=device)[None],
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+            past_key_values = output.past_key_values
+            length += n
+            next_id = int(output.logits[0, -1].argmax())
+            if next_id in stop_ids:
+                return
+            yield next_id
+            tokens = torch.tensor([[next_id]], device=device)
+
+    @staticmethod
+    def _load_image(image: Union[str, Image.Image]) -> Image.Image:
+        """Open an image path, or pass a PIL Image through."""
+        if isinstance(image, str):
+            return Image.open(image)
+        return image
+
+    @staticmethod
+    def collate(examples: Sequence[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        """
+        Pad and stack processed examples into one batch.
+
+        Every tensor (input_ids, images, image_masks, image_input_idx) is right-padded with -1
+        along each dimension. That is the padding value Molmo's generate_from_batch expects:
+        it derives the attention mask and position ids from input_ids != -1, and padded
+        crops are ignored through image_masks and image_input_idx.
+
+        Args:
+            examples (Sequence[Dict[str, torch.Tensor]]): Outputs of processor.process
+
+        Returns:
+            Dict[str, torch.Tensor]: Batched tensors with a leading batch dimension
+        """
+        batch = {}
+        for key in examples[0]:
+            tensors = [example[key] for example in examples]
+            shape = [max(t.shape[d] for t in tensors) for d in range(tensors[0].dim())]
+            out = tensors[0].new_full((len(tensors), *shape), -1)
+            for i, t in enumerate(tensors):
+                out[i][tuple(slice(0, n) for n in t.shape)] = t
+            batch[key] = out
+        return batch
+
+    def _generate(self, examples: Sequence[Dict[str, torch.Tensor]], max_new_tokens: int = 1024,
+                  stop_strings: Optional[Sequence[str]] = None) -> List[str]:
+        """Generate for a batch of processed examples and decode each example's new tokens."""
+        inputs = {k: v.to(self.model.device) for k, v in self.collate(examples).items()}
 
         output = self.model.generate_from_batch(
             inputs,
-            GenerationConfig(max_new_tokens=1024, stop_strings="<|endoftext|>"),
+            GenerationConfig(max_new_tokens=max_new_tokens, stop_strings=["<|endoftext|>", *(stop_strings or [])]),
             tokenizer=self.processor.tokenizer
         )
-        
-        generated_tokens = output[0, inputs['input_ids'].size(1):]
-        generated_text = self.processor.tokenizer.decode(generated_tokens, skip_special_tokens=True)            
-        return generated_text
+
+        # generation starts after the padded prompt length for every example
+        prompt_len = inputs['input_ids'].size(1)
+        return [self.processor.tokenizer.decode(tokens[prompt_len:], skip_special_tokens=True)
+                for tokens in output]
 
     def extract_points(self, text: str) -> np.ndarray:
         """
@@ -176,3 +484,24 @@ class MolmoModel:
                 thickness=thickness
             )
         plt.imshow(image_point)
+
+    def render_points(self,
+                      points: np.ndarray,
+                      radius: int = 10,
+                      color: Tuple[int, int, int] = (0, 0, 255),
+                      ext: Optional[str] = None) -> Union[np.ndarray, bytes]:
+        """
+        Draw points on the current image without matplotlib.
+
+        Args:
+            points (np.ndarray): Array of coordinates to draw
+            radius (int): Radius of the drawn points
+            color (Tuple[int, int, int]): RGB color for the points
+            ext (Optional[str]): Encode the result in this format (e.g. '.png'), None to return the array
+
+        Returns:
+            Union[np.ndarray, bytes]: Rendered uint8 RGB image, or encoded bytes when ext is given
+        """
+        image_point = OverlayRenderer.load_image(np.array(self.image.convert('RGB')))
+        OverlayRenderer.draw_points(image_point, points, radius=radius, color=color)
+        return OverlayRenderer.encode(image_point, ext) if ext else image_point
@@ -0,0 +1,199 @@
+"""
+Molmo Crops Module
+
+This module provides crop budget presets for Molmo preprocessing. Molmo's processor tiles
+every image into up to `max_crops` overlapping 336px crops plus a global view, and the
+number of image tokens this produces drives most of the prefill cost on CPU. A preset caps
+the crop count, sets the crop overlap and optionally downscales the image first. Molmo
+points are percentages of the image size, so points stay in the original image frame.
+
+It also provides a latency and point accuracy benchmark per preset on annotated sample
+images, run with `python -m mb_llm.molmocrops samples.json`.
+"""
+
+import json
+import time
+import numpy as np
+from PIL import Image
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from .boxmatch import BoxMatcher
+
+__all__ = ["MOLMO_CROP_PRESETS", "resolve_crops", "process_example", "point_accuracy", "benchmark_crops"]
+
+MOLMO_CROP_PRESETS = {
+    'full': {'max_crops': 12, 'overlap_margins': (4, 4), 'max_side': None},
+    'balanced': {'max_crops': 6, 'overlap_margins': (4, 4), 'max_side': 1024},
+    'fast': {'max_crops': 4, 'overlap_margins': (2, 2), 'max_side': 768},
+    'minimal': {'max_crops': 1, 'overlap_margins': (2, 2), 'max_side': 512},
+}
+
+CropOption = Optional[Union[str, Dict[str, Any]]]
+
+
+def resolve_crops(crops: CropOption) -> Optional[Dict[str, Any]]:
+    """
+    Turn a `crops=` value into crop settings.
+
+    Args:
+        crops (CropOption): None for the processor defaults, a preset name from
+                            MOLMO_CROP_PRESETS, or a dict with 'max_crops', 'overlap_margins'
+                            and/or 'max_side' (longest image side in pixels before tiling)
+
+    Returns:
+        Optional[Dict[str, Any]]: Crop settings, or None for the processor defaults
+    """
+    if crops is None:
+        return None
+    if isinstance(crops, str):
+        if crops not in MOLMO_CROP_PRESETS:
+            raise ValueError(f"Unknown crops preset {crops!r}, expected one of {list(MOLMO_CROP_PRESETS)}")
+        return dict(MOLMO_CROP_PRESETS[crops])
+    unknown = set(crops) - {'max_crops', 'overlap_margins', 'max_side'}
+    if unknown:
+        raise ValueError(f"Unknown crop settings {sorted(unknown)}")
+    return dict(crops)
+
+
+def process_example(processor: Any, image: Image.Image, text: str, crops: CropOption = None) -> Dict:
+    """
+    Run processor.process on one example with crop settings.
+
+    Args:
+        processor (Any): Molmo processor
+        image (Image.Image): The image
+        text (str): Prompt text
+        crops (CropOption): Crop preset name or settings, None for the processor defaults
+
+    Returns:
+        Dict: Processed tensors (input_ids, images, image_masks, image_input_idx)
+    """
+    settings = resolve_crops(crops)
+    if settings is None:
+        return processor.process(images=[image], text=text)
+    max_side = settings.get('max_side')
+    if max_side and max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.BILINEAR)
+    images_kwargs = {}
+    if settings.get('max_crops') is not None:
+        images_kwargs['max_crops'] = settings['max_crops']
+    if settings.get('overlap_margins') is not None:
+        images_kwargs['overlap_margins'] = list(settings['overlap_margins'])
+    return processor.process(images=[image], text=text, images_kwargs=images_kwargs)
+
+
+def point_accuracy(pred: np.ndarray, gt: np.ndarray, image_size: Tuple[int, int],
+                   threshold: float = 0.03) -> Dict[str, float]:
+    """
+    Score predicted points against ground truth points with a one-to-one assignment.
+
+    Args:
+        pred (np.ndarray): Predicted pixel points of shape (P, 2)
+        gt (np.ndarray): Ground truth pixel points of shape (G, 2)
+        image_size (Tuple[int, int]): Image (width, height)
+        threshold (float): Match distance as a fraction of the image diagonal
+
+    Returns:
+        Dict[str, float]: 'precision', 'recall', 'f1', 'matched' and 'mean_dist' (pixels, over matches)
+    """
+    pred = np.asarray(pred, dtype=np.float64).reshape(-1, 2)
+    gt = np.asarray(gt, dtype=np.float64).reshape(-1, 2)
+    matched, mean_dist = 0, None
+    if len(pred) and len(gt):
+        dist = np.linalg.norm(pred[:, None] - gt[None], axis=-1)
+        try:
+            from scipy.optimize import linear_sum_assignment
+            rows, cols = linear_sum_assignment(dist)
+        except ImportError:
+            rows, cols = BoxMatcher._greedy_assign(dist)
+        good = dist[rows, cols] <= threshold * np.hypot(*image_size)
+        matched = int(good.sum())
+        if matched:
+            mean_dist = float(dist[rows, cols][good].mean())
+    precision = matched / len(pred) if len(pred) else float(len(gt) == 0)
+    recall = matched / len(gt) if len(gt) else float(len(pred) == 0)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1, 'matched': matched, 'mean_dist': mean_dist}
+
+
+def benchmark_crops(model, samples: Sequence[Dict[str, Any]],
+                    presets: Sequence[Optional[str]] = ('full', 'balanced', 'fast', 'minimal'),
+                    max_new_tokens: int = 512, threshold: float = 0.03, warmup: int = 1) -> List[Dict[str, Any]]:
+    """
+    Measure latency, image token count and point accuracy of a Molmo model per crop preset.
+
+    Args:
+        model (MolmoModel): Model to benchmark
+        samples (Sequence[Dict[str, Any]]): Dicts with 'image' (path or PIL image), 'prompt' and
+                                            'points', the ground truth pixel points (G, 2)
+        presets (Sequence[Optional[str]]): MOLMO_CROP_PRESETS names, None for the processor defaults
+        max_new_tokens (int): Maximum number of generated tokens per sample
+        threshold (float): Point match distance as a fraction of the image diagonal
+        warmup (int): Untimed samples run first per preset
+
+    Returns:
+        List[Dict[str, Any]]: One row per preset with mean latencies in milliseconds, mean image
+                              tokens, and precision, recall and F1 over all points
+    """
+    images = [model._load_image(sample['image']).convert('RGB') for sample in samples]
+    rows = []
+    for preset in presets:
+        for image, sample in list(zip(images, samples))[:warmup]:
+            model._generate([process_example(model.processor, image, sample['prompt'], preset)], max_new_tokens)
+        process_ms, generate_ms, tokens = [], [], []
+        totals = {'pred': 0, 'gt': 0, 'matched': 0}
+        for image, sample in zip(images, samples):
+            start = time.perf_counter()
+            inputs = process_example(model.processor, image, sample['prompt'], preset)
+            process_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            text = model._generate([inputs], max_new_tokens)[0]
+            generate_ms.append((time.perf_counter() - start) * 1000)
+            tokens.append(int(inputs['input_ids'].numel()))
+
+            pred = model.extract_points(text).reshape(-1, 2) * np.array(image.size) / 100
+            gt = np.asarray(sample['points'], dtype=np.float64).reshape(-1, 2)
+            score = point_accuracy(pred, gt, image.size, threshold)
+            totals['pred'] += len(pred)
+            totals['gt'] += len(gt)
+            totals['matched'] += score['matched']
+
+        precision = totals['matched'] / max(totals['pred'], 1)
+        recall = totals['matched'] / max(totals['gt'], 1)
+        rows.append({'preset': preset or 'default', 'num_samples': len(samples),
+                     'prompt_tokens': float(np.mean(tokens)),
+                     'process_ms': float(np.mean(process_ms)), 'generate_ms': float(np.mean(generate_ms)),
+                     'latency_ms': float(np.mean(process_ms) + np.mean(generate_ms)),
+                     'precision': precision, 'recall': recall,
+                     'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0})
+        print(f"{rows[-1]['preset']:>9}: {rows[-1]['latency_ms']:.0f} ms/sample "
+              f"({rows[-1]['prompt_tokens']:.0f} prompt tokens), point P {precision:.3f} R {recall:.3f} "
+              f"F1 {rows[-1]['f1']:.3f}")
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark Molmo latency and point accuracy per crop preset")
+    parser.add_argument('samples', help="JSON list of {'image', 'prompt', 'points': [[x, y], ...]}")
+    parser.add_argument('--model', default="allenai/Molmo-1B-0924")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--load', default=None, help="Load preset, e.g. bf16")
+    parser.add_argument('--presets', nargs='+', default=['full', 'balanced', 'fast', 'minimal'],
+                        choices=list(MOLMO_CROP_PRESETS))
+    parser.add_argument('--max-new-tokens', type=int, default=512)
+    parser.add_argument('--threshold', type=float, default=0.03)
+    parser.add_argument('--output', default=None, help="Write the rows as JSON")
+    args = parser.parse_args()
+
+    from .molmo import MolmoModel
+
+    with open(args.samples) as f:
+        samples = json.load(f)
+    molmo = MolmoModel(args.model, device=args.device, load=args.load)
+    results = benchmark_crops(molmo, samples, args.presets, args.max_new_tokens, args.threshold)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,184 @@
+"""
+Molmo Load Module
+
+This module provides low-memory loading modes for Molmo models. Weights are read from
+memory-mapped safetensors shards tensor by tensor instead of being materialized in a full
+state dict first, optionally cast to bf16, and the language model's Linear layers can be
+replaced one at a time with int8 dynamically quantized layers for CPU inference. Load time
+and peak resident memory are measured, so the number of workers that fit on a node can
+be planned.
+"""
+
+import gc
+import resource
+import sys
+import time
+import torch
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+
+__all__ = ["MOLMO_LOAD_PRESETS", "load_molmo", "quantize_linear_int8", "rss_mb", "weights_mb"]
+
+MOLMO_LOAD_PRESETS = {
+    'default': {'dtype': 'auto', 'low_cpu_mem_usage': False, 'use_safetensors': None, 'quantize': None},
+    'low_mem': {'dtype': 'auto', 'low_cpu_mem_usage': True, 'use_safetensors': True, 'quantize': None},
+    'bf16': {'dtype': 'bfloat16', 'low_cpu_mem_usage': True, 'use_safetensors': True, 'quantize': None},
+    'int8': {'dtype': 'bfloat16', 'low_cpu_mem_usage': True, 'use_safetensors': True, 'quantize': 'int8'},
+}
+
+LoadOption = Optional[Union[str, Dict[str, Any]]]
+
+
+def rss_mb(peak: bool = False) -> float:
+    """
+    Get the resident memory of this process in MB.
+
+    Args:
+        peak (bool): Whether to return the peak since process start instead of the current value
+
+    Returns:
+        float: Resident memory in MB
+    """
+    if peak:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return maxrss / 1024 ** 2 if sys.platform == 'darwin' else maxrss / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+    except OSError:
+        return rss_mb(peak=True)
+
+
+def quantize_linear_int8(model: torch.nn.Module, skip: Sequence[str] = ('vision_backbone',)) -> int:
+    """
+    Replace Linear layers with int8 dynamically quantized layers, one layer at a time.
+
+    Each layer is converted to float32 right before it is quantized, so peak memory stays
+    close to the loaded model instead of a full float32 copy. The rest of the model keeps
+    its dtype (e.g. bf16); activations are cast to float32 at each quantized layer and back.
+
+    Args:
+        model (torch.nn.Module): Model to quantize in place, on the CPU
+        skip (Sequence[str]): Layers whose qualified name contains one of these are kept as is.
+                              The Molmo vision backbone reads its Linear weights directly
+
+    Returns:
+        int: Number of quantized layers
+    """
+    count = 0
+    for name, module in list(model.named_modules()):
+        if any(s in name for s in skip):
+            continue
+        for child_name, child in list(module.named_children()):
+            qualified = f"{name}.{child_name}" if name else child_name
+            if type(child) is not torch.nn.Linear or any(s in qualified for s in skip):
+                continue
+            wrapper = torch.nn.Sequential(child.float())
+            quantized = torch.ao.quantization.quantize_dynamic(wrapper, {torch.nn.Linear}, dtype=torch.qint8)
+            setattr(module, child_name, _Int8Linear(quantized[0]))
+            del wrapper, quantized, child
+            count += 1
+    gc.collect()
+    return count
+
+
+class _Int8Linear(torch.nn.Module):
+    """A dynamically quantized Linear layer that takes and returns activations of any float dtype."""
+
+    def __init__(self, linear: torch.nn.Module) -> None:
+        super().__init__()
+        self.linear = linear
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.linear(x.float()).to(x.dtype)
+
+
+def _tensor_nbytes(value: Any, seen: set) -> int:
+    """Size in bytes of a state dict value, including packed quantized weights, counting shared storage once."""
+    if isinstance(value, torch.Tensor):
+        if value.data_ptr() in seen:
+            return 0
+        seen.add(value.data_ptr())
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_nbytes(v, seen) for v in value)
+    return 0
+
+
+def weights_mb(model: torch.nn.Module) -> float:
+    """
+    Get the size of a model's weights in MB.
+
+    Unlike summing parameters(), this counts the packed int8 weights of dynamically quantized
+    layers, which are only exposed through the state dict.
+
+    Args:
+        model (torch.nn.Module): The model
+
+    Returns:
+        float: Weight size in MB
+    """
+    seen = set()
+    return sum(_tensor_nbytes(v, seen) for v in model.state_dict().values()) / 1024 ** 2
+
+
+def _resolve(load: LoadOption) -> Dict[str, Any]:
+    """Turn a `load=` value into loading settings."""
+    if load is None:
+        load = 'default'
+    if isinstance(load, str):
+        if load not in MOLMO_LOAD_PRESETS:
+            raise ValueError(f"Unknown load preset {load!r}, expected one of {list(MOLMO_LOAD_PRESETS)}")
+        return dict(MOLMO_LOAD_PRESETS[load])
+    settings = dict(MOLMO_LOAD_PRESETS['low_mem'])
+    settings.update(load)
+    return settings
+
+
+def load_molmo(name_or_path: str, device: str = 'cpu', load: LoadOption = None) -> Tuple[torch.nn.Module, Dict[str, Any]]:
+    """
+    Load a Molmo model with the given loading mode and measure the load.
+
+    Args:
+        name_or_path (str): Model name on the Hub or local model directory
+        device (str): Device to load the model on
+        load (LoadOption): A preset name from MOLMO_LOAD_PRESETS ('default', 'low_mem', 'bf16',
+                           'int8'), or a dict of 'dtype', 'low_cpu_mem_usage', 'use_safetensors'
+                           and 'quantize' overriding the 'low_mem' preset
+
+    Returns:
+        Tuple[torch.nn.Module, Dict[str, Any]]: The model, and load statistics with 'seconds',
+                                                'rss_mb', 'peak_rss_mb', 'param_mb' (weights including packed int8 layers) and the settings
+    """
+    from transformers import AutoModelForCausalLM
+
+    settings = _resolve(load)
+    if settings['quantize'] not in (None, 'int8'):
+        raise ValueError(f"Unknown quantize mode {settings['quantize']!r}, expected None or 'int8'")
+    if settings['quantize'] and torch.device(device).type != 'cpu':
+        raise ValueError("int8 dynamic quantization runs on the CPU only")
+
+    dtype = settings['dtype']
+    kwargs = {'trust_remote_code': True, 'device_map': device,
+              'torch_dtype': dtype if dtype == 'auto' else getattr(torch, dtype)}
+    if settings['low_cpu_mem_usage']:
+        kwargs['low_cpu_mem_usage'] = True
+    if settings['use_safetensors'] is not None:
+        kwargs['use_safetensors'] = settings['use_safetensors']
+
+    start = time.perf_counter()
+    rss_before = rss_mb()
+    model = AutoModelForCausalLM.from_pretrained(name_or_path, **kwargs)
+    num_quantized = quantize_linear_int8(model) if settings['quantize'] == 'int8' else 0
+    model.eval()
+    stats = {'seconds': time.perf_counter() - start,
+             'rss_mb': rss_mb(),
+             'rss_before_mb': rss_before,
+             'peak_rss_mb': rss_mb(peak=True),
+             'param_mb': weights_mb(model),
+             'num_quantized': num_quantized,
+             **settings}
+    print(f"Loaded {name_or_path} in {stats['seconds']:.1f}s: RSS {stats['rss_mb']:.0f} MB, "
+          f"peak RSS {stats['peak_rss_mb']:.0f} MB, parameters {stats['param_mb']:.0f} MB"
+          + (f", {num_quantized} int8 layers" if num_quantized else ""))
+    return model, stats
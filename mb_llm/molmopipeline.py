@@ -0,0 +1,213 @@
+"""
+Molmo Pipeline Module
+
+This module provides a producer/consumer pipeline for Molmo inference. A pool of thread or
+process workers opens and preprocesses upcoming images (multi-crop tiling and tokenization
+in `processor.process`) into a bounded queue, while the generation loop takes ready batches
+off the queue, so preprocessing of the next items is hidden behind generation of the current
+ones. The pipeline records backpressure metrics showing which side is the bottleneck.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .molmocrops import process_example, resolve_crops
+
+__all__ = ["MolmoPipeline"]
+
+_SENTINEL = object()
+_worker_processor = None
+
+
+def _init_process_worker(processor_name: str) -> None:
+    """Load a processor once in every worker process."""
+    global _worker_processor
+    from transformers import AutoProcessor
+    _worker_processor = AutoProcessor.from_pretrained(processor_name, trust_remote_code=True)
+
+
+def _preprocess(image: Union[str, Image.Image], prompt: str, processor: Any = None,
+                crops: Optional[Dict[str, Any]] = None) -> Tuple[Dict, Tuple[int, int], float]:
+    """Open and preprocess one example, returning its inputs, image size and preprocessing time."""
+    start = time.perf_counter()
+    processor = processor or _worker_processor
+    if isinstance(image, str):
+        image = Image.open(image)
+    inputs = process_example(processor, image, prompt, crops)
+    return inputs, image.size, time.perf_counter() - start
+
+
+class MolmoPipeline:
+    """
+    A pipelined runner of Molmo inference over a stream of (image, prompt) pairs.
+
+    Attributes:
+        model (MolmoModel): Model used for generation
+        batch_size (int): Examples generated together
+        num_workers (int): Preprocessing workers
+        queue_size (int): Preprocessed examples that may wait for generation
+        use_processes (bool): Whether workers are processes instead of threads
+        max_new_tokens (int): Maximum number of generated tokens per example
+        crops (Optional[Dict[str, Any]]): Crop budget of image preprocessing
+        metrics (Dict[str, float]): Backpressure and throughput metrics of the last run
+    """
+
+    def __init__(self, model, batch_size: int = 4, num_workers: int = 2, queue_size: int = 8,
+                 use_processes: bool = False, max_new_tokens: int = 1024,
+                 max_wait: Optional[float] = None, processor_name: Optional[str] = None,
+                 crops: Optional[Union[str, Dict[str, Any]]] = None) -> None:
+        """
+        Initialize the MolmoPipeline.
+
+        Args:
+            model (MolmoModel): Model used for generation
+            batch_size (int): Examples generated together
+            num_workers (int): Preprocessing workers
+            queue_size (int): Preprocessed examples that may wait for generation. Producers block
+                              when the queue is full, which bounds memory
+            use_processes (bool): Whether to preprocess in worker processes, each loading its own
+                                  processor, instead of threads sharing the model's processor
+            max_new_tokens (int): Maximum number of generated tokens per example
+            max_wait (Optional[float]): Seconds to wait for a batch to fill once its first example
+                                        is ready, None to always wait for a full batch
+            processor_name (Optional[str]): Processor to load in worker processes. Defaults to the
+                                            model's name
+            crops (Optional[Union[str, Dict[str, Any]]]): Crop budget preset or settings, None for the
+                                                          processor defaults
+        """
+        self.model = model
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+        self.max_new_tokens = max_new_tokens
+        self.max_wait = max_wait
+        self.processor_name = processor_name or model.model_name
+        self.crops = resolve_crops(crops)
+        self.metrics = {}
+
+    def _executor(self):
+        """Create the preprocessing worker pool."""
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_process_worker,
+                                       initargs=(self.processor_name,))
+        return ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def _submit(self, executor, image: Union[str, Image.Image], prompt: str) -> Future:
+        """Submit one example for preprocessing."""
+        processor = None if self.use_processes else self.model.processor
+        return executor.submit(_preprocess, image, prompt, processor, self.crops)
+
+    @staticmethod
+    def _put(pending: queue.Queue, item: Tuple, stop: threading.Event) -> bool:
+        """Put an item on the queue, blocking while it is full. Returns False if the run was stopped."""
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, items: Iterable[Tuple[Union[str, Image.Image], str]], executor, pending: queue.Queue,
+              stop: threading.Event) -> None:
+        """Submit examples for preprocessing in order, blocking while the queue is full."""
+        try:
+            for index, (image, prompt) in enumerate(items):
+                future = self._submit(executor, image, prompt)
+                start = time.perf_counter()
+                queued = self._put(pending, (index, prompt, future), stop)
+                self.metrics['producer_blocked_s'] += time.perf_counter() - start
+                if not queued:
+                    return
+        except Exception as e:
+            self._put(pending, (_SENTINEL, e, None), stop)
+            return
+        self._put(pending, (_SENTINEL, None, None), stop)
+
+    def _next_batch(self, pending: queue.Queue) -> Tuple[List[Tuple[int, str, Future]], bool]:
+        """Take the next batch of queued examples. Returns the batch and whether the stream ended."""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            timeout = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            try:
+                index, prompt, future = pending.get(timeout=timeout)
+            except queue.Empty:
+                return batch, False
+            if index is _SENTINEL:
+                if prompt is not None:
+                    raise RuntimeError("Failure while reading pipeline input") from prompt
+                return batch, True
+            batch.append((index, prompt, future))
+            if self.max_wait is not None and deadline is None:
+                deadline = time.perf_counter() + self.max_wait
+        return batch, False
+
+    def run(self, items: Iterable[Tuple[Union[str, Image.Image], str]]) -> Iterator[Dict[str, Any]]:
+        """
+        Run inference over a stream of (image, prompt) pairs.
+
+        Args:
+            items (Iterable[Tuple[Union[str, Image.Image], str]]): Image paths or PIL images with prompts.
+                                                                   May be a lazy iterator
+
+        Yields:
+            Dict[str, Any]: Result per example in input order, with 'index', 'prompt', 'text' and
+                            'image_size' (width, height)
+        """
+        self.metrics = {'items': 0, 'batches': 0, 'producer_blocked_s': 0.0, 'consumer_wait_s': 0.0,
+                        'preprocess_s': 0.0, 'generate_s': 0.0, 'queue_depth_sum': 0, 'queue_depth_max': 0}
+        pending = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        start = time.perf_counter()
+        with self._executor() as executor:
+            feeder = threading.Thread(target=self._feed, args=(items, executor, pending, stop), daemon=True)
+            feeder.start()
+            try:
+                done = False
+                while not done:
+                    depth = pending.qsize()
+                    self.metrics['queue_depth_sum'] += depth
+                    self.metrics['queue_depth_max'] = max(self.metrics['queue_depth_max'], depth)
+                    wait_start = time.perf_counter()
+                    batch, done = self._next_batch(pending)
+                    examples = [future.result() for _, _, future in batch]
+                    self.metrics['consumer_wait_s'] += time.perf_counter() - wait_start
+                    if not batch:
+                        continue
+
+                    gen_start = time.perf_counter()
+                    texts = self.model._generate([inputs for inputs, _, _ in examples], self.max_new_tokens)
+                    self.metrics['generate_s'] += time.perf_counter() - gen_start
+                    self.metrics['preprocess_s'] += sum(seconds for _, _, seconds in examples)
+                    self.metrics['batches'] += 1
+                    self.metrics['items'] += len(batch)
+                    for (index, prompt, _), (_, size, _), text in zip(batch, examples, texts):
+                        yield {'index': index, 'prompt': prompt, 'text': text, 'image_size': size}
+            finally:
+                stop.set()
+                feeder.join()
+                self._finish_metrics(time.perf_counter() - start)
+
+    def _finish_metrics(self, elapsed: float) -> None:
+        """Derive rates and averages once a run ends."""
+        m = self.metrics
+        m['elapsed_s'] = elapsed
+        m['items_per_s'] = m['items'] / max(elapsed, 1e-9)
+        m['queue_depth_mean'] = m.pop('queue_depth_sum') / max(m['batches'], 1)
+        # share of the run the generation loop spent waiting for preprocessed examples
+        m['starvation'] = m['consumer_wait_s'] / max(elapsed, 1e-9)
+
+    def report(self) -> str:
+        """Format the metrics of the last run as one line."""
+        m = self.metrics
+        if 'elapsed_s' not in m:
+            return "MolmoPipeline: no run yet"
+        return (f"{m['items']} items in {m['batches']} batches, {m['items_per_s']:.2f} items/s, "
+                f"generate {m['generate_s']:.1f}s, preprocess {m['preprocess_s']:.1f}s (worker time), "
+                f"producers blocked {m['producer_blocked_s']:.1f}s, generation starved {m['consumer_wait_s']:.1f}s, "
+                f"queue depth mean {m['queue_depth_mean']:.1f} / max {m['queue_depth_max']}")
@@ -0,0 +1,208 @@
+"""
+Molmo Session Module
+
+This module provides image sessions for asking Molmo several questions about one image.
+Molmo places the image tokens before the prompt text, so the prefix up to the last image
+token is the same for every question on an image. A session runs the vision encoder and
+the prefill over that prefix once and keeps its KV cache; follow-up prompts then only
+prefill their own text tokens on top of it. Sessions are kept in a byte-bounded LRU cache.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from PIL import Image
+import torch
+from typing import Any, Dict, List, Optional
+
+__all__ = ["MolmoSession", "MolmoSessionCache"]
+
+
+def _cache_tensors(past_key_values: Any) -> List[torch.Tensor]:
+    """Collect the tensors of a KV cache, either legacy nested tuples or a transformers Cache object."""
+    if isinstance(past_key_values, torch.Tensor):
+        return [past_key_values]
+    if isinstance(past_key_values, (tuple, list)):
+        return [t for item in past_key_values for t in _cache_tensors(item)]
+    if hasattr(past_key_values, 'key_cache'):
+        return list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    return []
+
+
+class MolmoSession:
+    """
+    The encoded image prefix of one image.
+
+    Attributes:
+        key (str): Identifier of the image
+        image (Image.Image): The image
+        prefix_ids (torch.Tensor): Token ids of the shared prefix, shape (P,)
+        past_key_values (Any): KV cache of the prefix as returned by the model
+        nbytes (int): Size of the KV cache in bytes
+        num_questions (int): Number of prompts answered with this session
+        encode_s (float): Seconds spent encoding the image and prefilling the prefix
+        crops (Optional[Dict[str, Any]]): Crop settings the image was preprocessed with
+    """
+
+    def __init__(self, key: str, image: Image.Image, prefix_ids: torch.Tensor, past_key_values: Any,
+                 encode_s: float = 0.0, crops: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Initialize the MolmoSession.
+
+        Args:
+            key (str): Identifier of the image
+            image (Image.Image): The image
+            prefix_ids (torch.Tensor): Token ids of the shared prefix, shape (P,)
+            past_key_values (Any): KV cache of the prefix
+            encode_s (float): Seconds spent encoding the image and prefilling the prefix
+            crops (Optional[Dict[str, Any]]): Crop settings, reused for every prompt of the session
+        """
+        self.key = key
+        self.image = image
+        self.prefix_ids = prefix_ids
+        self.past_key_values = past_key_values
+        self.nbytes = sum(t.numel() * t.element_size() for t in _cache_tensors(past_key_values))
+        self.num_questions = 0
+        self.encode_s = encode_s
+        self.crops = crops
+
+    def fork_cache(self) -> Any:
+        """
+        Get a KV cache to continue generation from the prefix.
+
+        Legacy tuple caches are extended by concatenation and can be shared; Cache objects
+        are extended in place and are copied so the session's prefix stays intact.
+        """
+        if isinstance(self.past_key_values, (tuple, list)):
+            return self.past_key_values
+        return copy.deepcopy(self.past_key_values)
+
+    @property
+    def prefix_len(self) -> int:
+        """Number of tokens in the shared prefix."""
+        return int(self.prefix_ids.numel())
+
+    def __repr__(self) -> str:
+        return (f"MolmoSession(key={self.key[:12]!r}, prefix_len={self.prefix_len}, "
+                f"nbytes={self.nbytes}, num_questions={self.num_questions})")
+
+
+class MolmoSessionCache:
+    """
+    A byte- and count-bounded LRU cache of MolmoSessions.
+
+    Attributes:
+        max_sessions (int): Maximum number of cached sessions
+        max_bytes (Optional[int]): Maximum total KV cache size in bytes, None for no limit
+        hits (int): Number of lookups served from the cache
+        misses (int): Number of lookups that were not cached
+        evictions (int): Number of sessions evicted
+    """
+
+    def __init__(self, max_sessions: int = 4, max_bytes: Optional[int] = None) -> None:
+        """
+        Initialize the MolmoSessionCache.
+
+        Args:
+            max_sessions (int): Maximum number of cached sessions
+            max_bytes (Optional[int]): Maximum total KV cache size in bytes. Defaults to None (count bound only)
+        """
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be at least 1")
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image: Image.Image, crops: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Build a session key from image content and crop settings.
+
+        Args:
+            image (Image.Image): The image
+            crops (Optional[Dict[str, Any]]): Crop settings the image is preprocessed with
+
+        Returns:
+            str: Hex digest identifying the image and its preprocessing
+        """
+        digest = hashlib.sha1()
+        digest.update(json.dumps(crops, sort_keys=True).encode())
+        digest.update(str((image.mode, image.size)).encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[MolmoSession]:
+        """
+        Look up a session and mark it as recently used.
+
+        Args:
+            key (str): Session key
+
+        Returns:
+            Optional[MolmoSession]: The session, or None on a miss
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(key)
+            self.hits += 1
+            return session
+
+    def put(self, session: MolmoSession) -> None:
+        """
+        Store a session and evict least recently used sessions beyond the bounds.
+
+        A session larger than max_bytes on its own is not stored.
+
+        Args:
+            session (MolmoSession): Session to store
+        """
+        if self.max_bytes is not None and session.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._sessions.pop(session.key, None)
+            if old is not None:
+                self._current_bytes -= old.nbytes
+            self._sessions[session.key] = session
+            self._current_bytes += session.nbytes
+            while len(self._sessions) > self.max_sessions or (
+                    self.max_bytes is not None and self._current_bytes > self.max_bytes):
+                _, evicted = self._sessions.popitem(last=False)
+                self._current_bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def pop(self, key: str) -> Optional[MolmoSession]:
+        """Remove a session from the cache and return it."""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self._current_bytes -= session.nbytes
+            return session
+
+    def clear(self) -> None:
+        """Drop all sessions."""
+        with self._lock:
+            self._sessions.clear()
+            self._current_bytes = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        """Current total KV cache size in bytes."""
+        return self._current_bytes
+
+    def __len__(self) -> int:
+        """Number of cached sessions."""
+        return len(self._sessions)
+
+    def __contains__(self, key: str) -> bool:
+        """Whether a session is cached."""
+        return key in self._sessions
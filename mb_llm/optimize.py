@@ -0,0 +1,280 @@
+"""
+Optimize Module
+
+This module provides CPU-friendly execution settings for SAM2 models: bf16 autocast,
+channels-last weights, optional torch.compile of the image encoder and mask decoder, and
+tuned intra-op threads. It also provides a benchmark of encoder and decoder latency per
+mode, run with `python -m mb_llm.optimize`, using the bundled sam2_hiera_s.yaml config
+and random weights so no checkpoint download is needed.
+"""
+
+import contextlib
+import functools
+import inspect
+import os
+import time
+import numpy as np
+import torch
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+__all__ = ["InferenceOptimizer", "OPTIMIZE_PRESETS", "benchmark_sam2"]
+
+OPTIMIZE_PRESETS = {
+    'none': {'bf16': False, 'channels_last': False, 'compile': False, 'num_threads': None},
+    'bf16': {'bf16': True, 'channels_last': False, 'compile': False, 'num_threads': None},
+    'cpu': {'bf16': True, 'channels_last': True, 'compile': False, 'num_threads': 'auto'},
+    'compile': {'bf16': True, 'channels_last': True, 'compile': True, 'num_threads': 'auto'},
+}
+
+OptimizeOption = Optional[Union[bool, str, Dict[str, Any]]]
+
+
+class InferenceOptimizer:
+    """
+    A set of execution settings applied to a SAM2 model and the objects that call it.
+
+    Attributes:
+        device (str): Device the model runs on
+        bf16 (bool): Whether model calls run under bf16 autocast
+        channels_last (bool): Whether image encoder weights use the channels-last layout
+        compile (bool): Whether the image encoder and mask decoder are compiled with torch.compile
+        num_threads (Optional[int]): Intra-op thread count set for torch, None to leave it unchanged
+    """
+
+    def __init__(self, device: str = 'cpu', bf16: bool = True, channels_last: bool = True,
+                 compile: bool = False, num_threads: Optional[Union[int, str]] = 'auto') -> None:
+        """
+        Initialize the InferenceOptimizer.
+
+        Args:
+            device (str): Device the model runs on
+            bf16 (bool): Whether model calls run under bf16 autocast
+            channels_last (bool): Whether image encoder weights use the channels-last layout
+            compile (bool): Whether to compile the image encoder and mask decoder with torch.compile
+            num_threads (Optional[Union[int, str]]): Intra-op threads. 'auto' uses the cores
+                                                     available to the process, None leaves torch's setting
+        """
+        self.device = str(device)
+        self.bf16 = bf16
+        self.channels_last = channels_last
+        self.compile = compile
+        if num_threads == 'auto':
+            num_threads = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+        self.num_threads = num_threads
+
+    @classmethod
+    def from_option(cls, optimize: OptimizeOption, device: str = 'cpu') -> Optional["InferenceOptimizer"]:
+        """
+        Build an InferenceOptimizer from a constructor `optimize=` value.
+
+        Args:
+            optimize (OptimizeOption): None or False for plain fp32 eager execution, True for the
+                                       'cpu' preset, a preset name from OPTIMIZE_PRESETS, or a dict
+                                       of InferenceOptimizer arguments
+            device (str): Device the model runs on
+
+        Returns:
+            Optional[InferenceOptimizer]: The optimizer, or None when nothing is to be changed
+        """
+        if optimize is None or optimize is False:
+            return None
+        if optimize is True:
+            optimize = 'cpu'
+        if isinstance(optimize, str):
+            if optimize not in OPTIMIZE_PRESETS:
+                raise ValueError(f"Unknown optimize preset {optimize!r}, expected one of {list(OPTIMIZE_PRESETS)}")
+            optimize = OPTIMIZE_PRESETS[optimize]
+        if not any(optimize.get(k) for k in ('bf16', 'channels_last', 'compile', 'num_threads')):
+            return None
+        return cls(device=device, **optimize)
+
+    @property
+    def device_type(self) -> str:
+        """torch device type of the model device."""
+        return torch.device(self.device).type
+
+    def autocast(self):
+        """Get a context manager running model calls under the configured autocast."""
+        if not self.bf16:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=torch.bfloat16)
+
+    def apply(self, model: torch.nn.Module) -> torch.nn.Module:
+        """
+        Apply layout, compilation and thread settings to a SAM2 model in place.
+
+        Args:
+            model (torch.nn.Module): SAM2 model (SAM2Base or SAM2VideoPredictor)
+
+        Returns:
+            torch.nn.Module: The model
+        """
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        if self.channels_last:
+            model.image_encoder.to(memory_format=torch.channels_last)
+        if self.compile:
+            model.image_encoder.forward = torch.compile(model.image_encoder.forward, dynamic=False)
+            model.sam_mask_decoder.forward = torch.compile(model.sam_mask_decoder.forward, dynamic=True)
+        return model
+
+    def wrap(self, obj: Any, names: Sequence[str]) -> Any:
+        """
+        Run the given methods of an object under autocast. Generator methods get autocast
+        around each step only, so the setting never leaks into the caller between items.
+
+        Args:
+            obj (Any): Object whose methods are wrapped, e.g. a SAM2ImagePredictor
+            names (Sequence[str]): Method names
+
+        Returns:
+            Any: The object
+        """
+        if not self.bf16:
+            return obj
+        for name in names:
+            method = getattr(obj, name)
+            setattr(obj, name, self._wrap_generator(method) if inspect.isgeneratorfunction(method)
+                    else self._wrap_function(method))
+        return obj
+
+    def _wrap_function(self, fn):
+        """Wrap a function to run under autocast."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.autocast():
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def _wrap_generator(self, fn):
+        """Wrap a generator function so that each step runs under autocast."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            iterator = fn(*args, **kwargs)
+            while True:
+                with self.autocast():
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+        return wrapper
+
+    def __repr__(self) -> str:
+        return (f"InferenceOptimizer(device={self.device!r}, bf16={self.bf16}, channels_last={self.channels_last}, "
+                f"compile={self.compile}, num_threads={self.num_threads})")
+
+
+def _bundled_config() -> str:
+    """Locate sam2_hiera_s.yaml, preferring the copy bundled with this repository."""
+    bundled = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sam2_hiera_s.yaml')
+    if os.path.exists(bundled):
+        return bundled
+    import sam2
+    return os.path.join(os.path.dirname(sam2.__file__), 'sam2_hiera_s.yaml')
+
+
+def _random_model(config_path: str, device: str) -> torch.nn.Module:
+    """Instantiate a SAM2 model from a config file with random weights."""
+    from hydra.utils import instantiate
+    from omegaconf import OmegaConf
+
+    cfg = OmegaConf.load(config_path)
+    OmegaConf.resolve(cfg)
+    model = instantiate(cfg.model, _recursive_=True)
+    return model.to(device).eval()
+
+
+def _time(fn, repeats: int, warmup: int) -> List[float]:
+    """Time a function in milliseconds after some warmup calls."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def benchmark_sam2(modes: Sequence[str] = ('none', 'bf16', 'cpu'), config_path: Optional[str] = None,
+                   device: str = 'cpu', repeats: int = 5, warmup: int = 2, num_prompts: int = 16,
+                   seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Measure image encoder and mask decoder latency of a randomly initialized SAM2 per optimize mode.
+
+    Args:
+        modes (Sequence[str]): OPTIMIZE_PRESETS names to benchmark
+        config_path (Optional[str]): SAM2 model config. Defaults to the bundled sam2_hiera_s.yaml
+        device (str): Device to run on
+        repeats (int): Timed calls per measurement
+        warmup (int): Untimed calls before timing, which also absorb compilation
+        num_prompts (int): Point prompts decoded together against one image embedding
+        seed (int): Seed of the random weights and inputs
+
+    Returns:
+        List[Dict[str, Any]]: One row per mode with mean and median latencies in milliseconds
+    """
+    config_path = config_path or _bundled_config()
+    default_threads = torch.get_num_threads()
+    rows = []
+    for mode in modes:
+        torch.manual_seed(seed)
+        torch.set_num_threads(default_threads)
+        model = _random_model(config_path, device)
+        optimizer = InferenceOptimizer.from_option(mode, device)
+        if optimizer is not None:
+            optimizer.apply(model)
+        autocast = optimizer.autocast if optimizer is not None else contextlib.nullcontext
+
+        size = model.image_size
+        image = torch.randn(1, 3, size, size, device=device)
+        if optimizer is not None and optimizer.channels_last:
+            image = image.contiguous(memory_format=torch.channels_last)
+        points = torch.rand(num_prompts, 1, 2, device=device) * size
+        labels = torch.ones(num_prompts, 1, dtype=torch.int64, device=device)
+
+        with torch.inference_mode(), autocast():
+            backbone_out = model.forward_image(image)
+            _, vision_feats, _, feat_sizes = model._prepare_backbone_features(backbone_out)
+            feats = [feat.permute(1, 2, 0).view(1, -1, *fs) for feat, fs in zip(vision_feats, feat_sizes)]
+            image_embed, high_res = feats[-1], feats[:-1]
+
+            def encode():
+                model.forward_image(image)
+
+            def decode():
+                sparse, dense = model.sam_prompt_encoder(points=(points, labels), boxes=None, masks=None)
+                model.sam_mask_decoder(image_embeddings=image_embed,
+                                       image_pe=model.sam_prompt_encoder.get_dense_pe(),
+                                       sparse_prompt_embeddings=sparse, dense_prompt_embeddings=dense,
+                                       multimask_output=True, repeat_image=True,
+                                       high_res_features=high_res)
+
+            encoder_ms = _time(encode, repeats, warmup)
+            decoder_ms = _time(decode, repeats, warmup)
+
+        rows.append({'mode': mode, 'threads': torch.get_num_threads(),
+                     'encoder_mean_ms': float(np.mean(encoder_ms)), 'encoder_median_ms': float(np.median(encoder_ms)),
+                     'decoder_mean_ms': float(np.mean(decoder_ms)), 'decoder_median_ms': float(np.median(decoder_ms)),
+                     'num_prompts': num_prompts})
+        print(f"{mode:>8}: encoder {rows[-1]['encoder_median_ms']:.1f} ms, "
+              f"decoder ({num_prompts} prompts) {rows[-1]['decoder_median_ms']:.1f} ms, "
+              f"{rows[-1]['threads']} threads")
+        del model
+    torch.set_num_threads(default_threads)
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark SAM2 encoder/decoder latency per optimize mode")
+    parser.add_argument('--modes', nargs='+', default=['none', 'bf16', 'cpu'], choices=list(OPTIMIZE_PRESETS))
+    parser.add_argument('--config', default=None, help="SAM2 config, defaults to the bundled sam2_hiera_s.yaml")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--num-prompts', type=int, default=16)
+    args = parser.parse_args()
+    benchmark_sam2(args.modes, args.config, args.device, args.repeats, args.warmup, args.num_prompts)
@@ -0,0 +1,159 @@
+"""
+Point Segmentation Module
+
+This module provides a fused Molmo pointing to SAM2 segmentation pipeline. Every image is
+decoded once into an RGB array that both models read: Molmo gets a PIL view of it and SAM2
+encodes the array directly. All points Molmo returns for an image are decoded by SAM2 as
+one batched prompt set, one mask per point. Across a stream of images the stages overlap:
+images are decoded ahead in a thread pool, Molmo generates on its own thread, and the SAM2
+image encoder runs on an image while Molmo is still pointing on it.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+from typing import Any, Dict, Iterable, Iterator, Tuple, Union
+from .compactmask import CompactMask
+
+__all__ = ["PointSegmentationPipeline"]
+
+
+class PointSegmentationPipeline:
+    """
+    A pipeline turning (image, pointing prompt) pairs into one SAM2 mask per Molmo point.
+
+    Attributes:
+        molmo (MolmoModel): Model answering the pointing prompts
+        predictor (ImagePredictor): SAM2 predictor segmenting the points
+        num_workers (int): Image decoding threads
+        prefetch (int): Images decoded and pointed ahead of segmentation
+        max_new_tokens (int): Maximum number of tokens Molmo generates per image
+        multimask_output (bool): Whether SAM2 returns three masks per point
+        compact (bool): Whether masks are returned as CompactMask
+    """
+
+    def __init__(self, molmo, predictor, num_workers: int = 2, prefetch: int = 2,
+                 max_new_tokens: int = 1024, multimask_output: bool = False, compact: bool = False) -> None:
+        """
+        Initialize the PointSegmentationPipeline.
+
+        Args:
+            molmo (MolmoModel): Model answering the pointing prompts
+            predictor (ImagePredictor): SAM2 predictor segmenting the points
+            num_workers (int): Image decoding threads
+            prefetch (int): Images decoded and pointed ahead of segmentation, which bounds memory
+            max_new_tokens (int): Maximum number of tokens Molmo generates per image
+            multimask_output (bool): Whether SAM2 returns three masks per point, sorted by score
+            compact (bool): Whether to return masks as CompactMask
+        """
+        self.molmo = molmo
+        self.predictor = predictor
+        self.num_workers = num_workers
+        self.prefetch = max(prefetch, 1)
+        self.max_new_tokens = max_new_tokens
+        self.multimask_output = multimask_output
+        self.compact = compact
+
+    @staticmethod
+    def decode(image: Union[str, np.ndarray, Image.Image]) -> np.ndarray:
+        """Decode an image path once into a contiguous RGB uint8 array, or convert an image in memory."""
+        if isinstance(image, str):
+            array = cv2.imread(image)
+            if array is None:
+                raise FileNotFoundError(f"Could not read image {image}")
+            return cv2.cvtColor(array, cv2.COLOR_BGR2RGB)
+        if isinstance(image, Image.Image):
+            return np.array(image.convert('RGB'))
+        return np.ascontiguousarray(image)
+
+    def point(self, array: np.ndarray, prompt: str) -> Tuple[str, np.ndarray]:
+        """
+        Ask Molmo to point on a decoded image.
+
+        Args:
+            array (np.ndarray): RGB image array
+            prompt (str): Pointing prompt, e.g. "Point to every bolt"
+
+        Returns:
+            Tuple[str, np.ndarray]: Generated text and (N, 2) pixel points
+        """
+        image = Image.fromarray(array)
+        inputs = self.molmo.preprocess(image, prompt)
+        text = self.molmo._generate([inputs], self.max_new_tokens)[0]
+        points = self.molmo.extract_points(text).reshape(-1, 2)
+        # Molmo points are percentages of the image width and height
+        return text, points * np.array(image.size, dtype=np.float64) / 100
+
+    def segment(self, points: np.ndarray) -> Tuple[Any, np.ndarray]:
+        """
+        Segment every point on the image currently set on the predictor, in one decoder pass.
+
+        Args:
+            points (np.ndarray): (N, 2) pixel points, each one a separate foreground prompt
+
+        Returns:
+            Tuple[Any, np.ndarray]: Masks of shape (N, H, W), or (N, 3, H, W) with multimask_output,
+                                    and scores of shape (N,) or (N, 3)
+        """
+        masks, scores, _ = self.predictor._predict_prompts(
+            0, None, points.reshape(-1, 1, 2), None, self.multimask_output, gemini_bbox=False,
+            return_logits=False)
+        if not self.multimask_output:
+            masks, scores = masks[:, 0], scores[:, 0]
+        if self.compact:
+            if self.multimask_output:
+                masks = [[CompactMask.from_dense(m) for m in point_masks] for point_masks in masks]
+            else:
+                masks = [CompactMask.from_dense(m) for m in masks]
+        return masks, scores
+
+    def run(self, items: Iterable[Tuple[Union[str, np.ndarray, Image.Image], str]]) -> Iterator[Dict[str, Any]]:
+        """
+        Point and segment a stream of images.
+
+        Args:
+            items (Iterable[Tuple[Union[str, np.ndarray, Image.Image], str]]): Images (paths, RGB arrays
+                                                                              or PIL images) with
+                                                                              pointing prompts
+
+        Yields:
+            Dict[str, Any]: Result per image in input order with 'index', 'prompt', 'text',
+                            'points' (N, 2), 'masks' and 'scores'
+        """
+        items = iter(items)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.num_workers) as decoders, \
+                ThreadPoolExecutor(max_workers=1) as pointer:
+
+            def submit() -> bool:
+                try:
+                    image, prompt = next(items)
+                except StopIteration:
+                    return False
+                decoded = decoders.submit(self.decode, image)
+                pointed = pointer.submit(lambda: self.point(decoded.result(), prompt))
+                pending.append((prompt, decoded, pointed))
+                return True
+
+            for _ in range(self.prefetch):
+                if not submit():
+                    break
+            index = 0
+            while pending:
+                prompt, decoded, pointed = pending.popleft()
+                submit()
+                array = decoded.result()
+                # the image encoder runs while Molmo may still be generating for this image
+                self.predictor.set_image(array)
+                text, points = pointed.result()
+                masks, scores = self.segment(points)
+                yield {'index': index, 'prompt': prompt, 'text': text, 'points': points,
+                       'masks': masks, 'scores': scores}
+                index += 1
+        self.predictor.predictor.reset_predictor()
+
+    def __call__(self, image: Union[str, np.ndarray, Image.Image], prompt: str) -> Dict[str, Any]:
+        """Point and segment a single image."""
+        return list(self.run([(image, prompt)]))[0]
@@ -0,0 +1,299 @@
+"""
+Render Module
+
+This module provides a headless overlay renderer working directly on uint8 RGB arrays.
+All masks are composed in a single blending pass from a label map, and boxes, polygons
+and points are drawn in bulk, so previews can be produced and encoded without matplotlib.
+"""
+
+import numpy as np
+import cv2
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from .compactmask import CompactMask
+
+__all__ = ["OverlayRenderer", "render_masks"]
+
+Color = Tuple[int, int, int]
+MaskLike = Union[np.ndarray, CompactMask]
+
+
+class OverlayRenderer:
+    """
+    A class for rendering masks, boxes, polygons and points onto uint8 RGB images.
+
+    Attributes:
+        alpha (float): Opacity of mask fills
+        border_color (Color): RGB color of mask borders
+        seed (Optional[int]): Seed of the random mask palette
+    """
+
+    def __init__(self, alpha: float = 0.5, border_color: Color = (0, 0, 255),
+                 seed: Optional[int] = None) -> None:
+        """
+        Initialize the OverlayRenderer.
+
+        Args:
+            alpha (float): Opacity of mask fills, in [0, 1]
+            border_color (Color): RGB color of mask borders
+            seed (Optional[int]): Seed of the random mask palette, None for a random palette
+        """
+        self.alpha = alpha
+        self.border_color = border_color
+        self.seed = seed
+
+    @staticmethod
+    def load_image(image: Union[str, np.ndarray]) -> np.ndarray:
+        """
+        Load an image as a writable uint8 RGB array.
+
+        Args:
+            image (Union[str, np.ndarray]): Image path or array (grayscale, RGB or RGBA)
+
+        Returns:
+            np.ndarray: Image of shape (H, W, 3) and dtype uint8
+        """
+        if isinstance(image, str):
+            image = cv2.cvtColor(cv2.imread(image), cv2.COLOR_BGR2RGB)
+        image = np.asarray(image)
+        if image.dtype != np.uint8:
+            image = np.clip(image * 255 if image.max() <= 1.0 else image, 0, 255).astype(np.uint8)
+        if image.ndim == 2:
+            image = np.repeat(image[:, :, None], 3, axis=2)
+        return np.ascontiguousarray(image[:, :, :3]).copy()
+
+    def palette(self, n: int) -> np.ndarray:
+        """
+        Get a color palette for n labels, with label 0 as background.
+
+        Args:
+            n (int): Number of labels
+
+        Returns:
+            np.ndarray: Palette of shape (n + 1, 3) and dtype uint8
+        """
+        rng = np.random.default_rng(self.seed)
+        colors = rng.integers(0, 256, size=(n + 1, 3), dtype=np.uint8)
+        colors[0] = 0
+        return colors
+
+    @staticmethod
+    def label_map(masks: Sequence[MaskLike], shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Build a label map from masks. Larger masks are painted first so that smaller
+        masks stay visible on top, as in SAM2Processor.show_anns.
+
+        Args:
+            masks (Sequence[MaskLike]): Dense (H, W) masks or CompactMask
+            shape (Optional[Tuple[int, int]]): Output shape, required when masks is empty
+
+        Returns:
+            np.ndarray: int32 label map, 0 for background and i + 1 for masks[i]
+        """
+        if len(masks) == 0:
+            return np.zeros(shape, dtype=np.int32)
+        shape = shape or tuple(masks[0].shape[-2:])
+        areas = [m.area if isinstance(m, CompactMask) else int(np.count_nonzero(m)) for m in masks]
+        order = np.argsort(areas, kind='stable')[::-1]
+
+        # column-major so compact runs map to contiguous slices
+        flat = np.zeros(shape[0] * shape[1], dtype=np.int32)
+        for i in order:
+            m = masks[i]
+            if isinstance(m, CompactMask):
+                starts, ends = m.intervals()
+                lengths = ends - starts
+                offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+                flat[offsets + np.arange(lengths.sum())] = i + 1
+            else:
+                # cast so float or uint8 0/1 masks select pixels instead of indexing them
+                flat[np.asarray(m, dtype=bool).reshape(shape).ravel(order='F')] = i + 1
+        return flat.reshape(shape, order='F')
+
+    @staticmethod
+    def borders(label_map: np.ndarray) -> np.ndarray:
+        """
+        Find pixels on the boundary between different labels, excluding pure background.
+
+        Args:
+            label_map (np.ndarray): Label map of shape (H, W)
+
+        Returns:
+            np.ndarray: Boolean border map of shape (H, W)
+        """
+        edge = np.zeros(label_map.shape, dtype=bool)
+        dy = label_map[1:, :] != label_map[:-1, :]
+        dx = label_map[:, 1:] != label_map[:, :-1]
+        edge[1:, :] |= dy
+        edge[:-1, :] |= dy
+        edge[:, 1:] |= dx
+        edge[:, :-1] |= dx
+        return edge & (label_map > 0)
+
+    def compose(self, image: np.ndarray, label_map: np.ndarray, colors: np.ndarray,
+                borders: bool = True) -> np.ndarray:
+        """
+        Blend a label map onto an image in one pass.
+
+        Args:
+            image (np.ndarray): uint8 RGB image of shape (H, W, 3)
+            label_map (np.ndarray): Label map of shape (H, W)
+            colors (np.ndarray): Palette of shape (L + 1, 3)
+            borders (bool): Whether to draw label borders
+
+        Returns:
+            np.ndarray: Blended uint8 RGB image
+        """
+        out = self.load_image(image)
+        fg = label_map > 0
+        a = int(round(self.alpha * 256))
+        blended = (out[fg].astype(np.uint16) * (256 - a) + colors[label_map[fg]].astype(np.uint16) * a) >> 8
+        out[fg] = blended.astype(np.uint8)
+        if borders:
+            out[self.borders(label_map)] = self.border_color
+        return out
+
+    def render_masks(self, image: Union[str, np.ndarray], masks: Sequence[MaskLike],
+                     borders: bool = True, colors: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Render masks onto an image.
+
+        Args:
+            image (Union[str, np.ndarray]): Image path or array
+            masks (Sequence[MaskLike]): Dense masks, CompactMask, or mask records with a 'segmentation' key
+            borders (bool): Whether to draw mask borders
+            colors (Optional[np.ndarray]): Palette of shape (N + 1, 3), random when not given
+
+        Returns:
+            np.ndarray: Rendered uint8 RGB image
+        """
+        image = self.load_image(image)
+        masks = [m['segmentation'] if isinstance(m, dict) else m for m in masks]
+        labels = self.label_map(masks, image.shape[:2])
+        if colors is None:
+            colors = self.palette(len(masks))
+        return self.compose(image, labels, colors, borders=borders)
+
+    @staticmethod
+    def draw_boxes(image: np.ndarray, boxes: Union[List[List[float]], np.ndarray],
+                   color: Color = (0, 255, 0), thickness: int = 2) -> np.ndarray:
+        """
+        Draw (x0, y0, x1, y1) boxes in place with a single polyline call.
+
+        Args:
+            image (np.ndarray): uint8 RGB image
+            boxes (Union[List[List[float]], np.ndarray]): Boxes of shape (N, 4)
+            color (Color): RGB line color
+            thickness (int): Line thickness
+
+        Returns:
+            np.ndarray: The image
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if len(boxes) == 0:
+            return image
+        x0, y0, x1, y1 = boxes.T
+        corners = np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                            np.stack([x1, y1], 1), np.stack([x0, y1], 1)], axis=1)
+        cv2.polylines(image, list(np.round(corners).astype(np.int32)), True, color, thickness)
+        return image
+
+    @staticmethod
+    def draw_polygons(image: np.ndarray, polygons: Sequence[Union[List[float], np.ndarray]],
+                      color: Color = (0, 255, 0), thickness: int = 1,
+                      fill: bool = False) -> np.ndarray:
+        """
+        Draw polygons in place with a single polyline (or fill) call.
+
+        Args:
+            image (np.ndarray): uint8 RGB image
+            polygons (Sequence): Polygons as flat [x0, y0, x1, y1, ...] lists or (K, 2) arrays
+            color (Color): RGB color
+            thickness (int): Line thickness
+            fill (bool): Whether to fill the polygons
+
+        Returns:
+            np.ndarray: The image
+        """
+        pts = [np.round(np.asarray(p, dtype=np.float64).reshape(-1, 2)).astype(np.int32) for p in polygons]
+        pts = [p for p in pts if len(p) >= 3]
+        if not pts:
+            return image
+        if fill:
+            cv2.fillPoly(image, pts, color)
+        else:
+            cv2.polylines(image, pts, True, color, thickness)
+        return image
+
+    @staticmethod
+    def draw_points(image: np.ndarray, points: Union[List[List[float]], np.ndarray],
+                    labels: Optional[Union[List[int], np.ndarray]] = None, radius: int = 6,
+                    color: Color = (0, 255, 0), negative_color: Color = (255, 0, 0)) -> np.ndarray:
+        """
+        Draw filled point markers in place by stamping all disks in one scatter.
+
+        Args:
+            image (np.ndarray): uint8 RGB image
+            points (Union[List[List[float]], np.ndarray]): (x, y) points of shape (N, 2)
+            labels (Optional[Union[List[int], np.ndarray]]): 1 for positive and 0 for negative points
+            radius (int): Marker radius in pixels
+            color (Color): RGB color of positive points
+            negative_color (Color): RGB color of negative points
+
+        Returns:
+            np.ndarray: The image
+        """
+        points = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 2)).astype(np.int64)
+        if len(points) == 0:
+            return image
+        labels = np.ones(len(points), dtype=np.int64) if labels is None else np.asarray(labels).reshape(-1)
+        oy, ox = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+        disk = (ox ** 2 + oy ** 2) <= radius ** 2
+        ox, oy = ox[disk], oy[disk]
+        h, w = image.shape[:2]
+        for label, c in ((1, color), (0, negative_color)):
+            sel = points[labels == label]
+            xs = (sel[:, 0:1] + ox[None, :]).ravel()
+            ys = (sel[:, 1:2] + oy[None, :]).ravel()
+            inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+            image[ys[inside], xs[inside]] = c
+        return image
+
+    @staticmethod
+    def encode(image: np.ndarray, ext: str = '.png', quality: int = 90) -> bytes:
+        """
+        Encode an RGB image to bytes.
+
+        Args:
+            image (np.ndarray): uint8 RGB image
+            ext (str): Image format extension ('.png', '.jpg' or '.webp')
+            quality (int): JPEG/WebP quality
+
+        Returns:
+            bytes: Encoded image
+        """
+        params = []
+        if ext in ('.jpg', '.jpeg'):
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif ext == '.webp':
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        ok, buf = cv2.imencode(ext, cv2.cvtColor(image, cv2.COLOR_RGB2BGR), params)
+        if not ok:
+            raise ValueError(f"Could not encode image as {ext}")
+        return buf.tobytes()
+
+    @staticmethod
+    def save(image: np.ndarray, path: str) -> None:
+        """
+        Save an RGB image to disk.
+
+        Args:
+            image (np.ndarray): uint8 RGB image
+            path (str): Output path
+        """
+        cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+
+def render_masks(image: Union[str, np.ndarray], masks: Sequence[Union[MaskLike, Dict]], **kwargs) -> np.ndarray:
+    """Convenience function to render masks onto an image."""
+    borders = kwargs.pop('borders', True)
+    return OverlayRenderer(**kwargs).render_masks(image, masks, borders=borders)
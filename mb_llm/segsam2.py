@@ -18,7 +18,22 @@ import pandas as pd
 import torch
 from torch.amp import autocast, GradScaler
 import os
-from typing import List, Dict, Union, Tuple, Optional, Any
+import json
+import time
+from typing import List, Dict, Union, Tuple, Optional, Any, Iterator
+from .boxmatch import BoxMatcher
+from .embedcache import EmbeddingCache
+from .compactmask import CompactMask
+from .render import OverlayRenderer
+from .tiling import TiledMaskGenerator
+from .maskstore import MaskStore
+from .videosource import VideoFrameSource, sam2_frames
+from .trainingdata import SAM2TrainDataset, make_train_loader, load_pair, decode_instances
+from .featurestore import FeatureStore
+from .checkpoints import DeltaCheckpointer, load_delta
+from .evaluation import SegmentationEvaluator
+from .optimize import InferenceOptimizer
+from .export import CocoWriter, MaskExporter
 
 __all__ = ['SAM2Processor', 'VideoPredictor', 'ImagePredictor', 'DataProcessor', 'ModelTrainer',
            'get_mask_generator', 'get_mask_for_bbox', 'get_all_masks', 'load_data', 'read_batch',
@@ -30,7 +45,9 @@ class SAM2Processor:
     """
     
     def __init__(self, sam2_checkpoint: str = '../checkpoints/sam2_hiera_large.pt',
-                 model_cfg: str = 'sam2_hiera_l.yaml', device: str = 'cpu'):
+                 model_cfg: str = 'sam2_hiera_l.yaml', device: str = 'cpu',
+                 mask_generator_kwargs: Optional[Dict[str, Any]] = None,
+                 optimize: Optional[Union[bool, str, Dict[str, Any]]] = None):
         """
         Initialize SAM2Processor.
 
@@ -38,17 +55,67 @@ class SAM2Processor:
             sam2_checkpoint (str): Path to model checkpoint
             model_cfg (str): Path to model configuration
             device (str): Device to run on
+            mask_generator_kwargs (Optional[Dict[str, Any]]): Extra SAM2AutomaticMaskGenerator arguments,
+                                                              e.g. points_per_side or points_per_batch
+            optimize (Optional[Union[bool, str, Dict[str, Any]]]): Execution settings, see
+                                                                  InferenceOptimizer.from_option
         """
         self.device = device
         self.sam2_checkpoint = sam2_checkpoint
         self.model_cfg = model_cfg
+        self.mask_generator_kwargs = mask_generator_kwargs or {}
+        self.optimizer = InferenceOptimizer.from_option(optimize, device)
         self.mask_generator = self._initialize_mask_generator()
 
     def _initialize_mask_generator(self) -> SAM2AutomaticMaskGenerator:
         """Initialize the mask generator."""
         sam2 = build_sam2(self.model_cfg, self.sam2_checkpoint, 
                          device=self.device, apply_postprocessing=False)
-        return SAM2AutomaticMaskGenerator(sam2)
+        if self.optimizer is not None:
+            self.optimizer.apply(sam2)
+        return self._optimized(SAM2AutomaticMaskGenerator(sam2, **self.mask_generator_kwargs))
+
+    def _optimized(self, mask_generator: SAM2AutomaticMaskGenerator) -> SAM2AutomaticMaskGenerator:
+        """Run a mask generator's model calls under the configured autocast."""
+        if self.optimizer is not None:
+            self.optimizer.wrap(mask_generator, ['generate'])
+        return mask_generator
+
+    def generate_tiled(self, image: Union[str, np.ndarray], tile_size: int = 1024,
+                       overlap: int = 128, points_per_side: int = 32, points_per_batch: int = 64,
+                       iou_thresh: float = 0.7, keep_edge_masks: bool = False):
+        """
+        Generate masks for a large image tile by tile, yielding masks as tiles finish.
+
+        Masks are in full-image coordinates with a CompactMask 'segmentation', and duplicates
+        across tile borders are merged. Peak memory is bounded by the tile size.
+
+        Args:
+            image (Union[str, np.ndarray]): Image path, or RGB array (a np.memmap works too)
+            tile_size (int): Tile height and width in pixels
+            overlap (int): Overlap between neighbouring tiles in pixels
+            points_per_side (int): Points sampled along one side of each tile
+            points_per_batch (int): Points run through the model together
+            iou_thresh (float): Mask IoU above which masks from different tiles are merged
+            keep_edge_masks (bool): Whether to keep masks cut by interior tile edges
+
+        Yields:
+            Dict: Mask record
+        """
+        generator_kwargs = {k: v for k, v in self.mask_generator_kwargs.items()
+                            if k not in ('points_per_side', 'points_per_batch')}
+        tiled = TiledMaskGenerator.from_model(
+            self.mask_generator.predictor.model, points_per_side=points_per_side,
+            points_per_batch=points_per_batch, generator_kwargs=generator_kwargs,
+            tile_size=tile_size, overlap=overlap, iou_thresh=iou_thresh,
+            keep_edge_masks=keep_edge_masks)
+        self._optimized(tiled.mask_generator)
+        yield from tiled.generate(image)
+
+    def get_all_masks_tiled(self, image_path: str, **kwargs) -> List[Dict]:
+        """Get all masks for a large image using tiled generation. See generate_tiled for arguments."""
+        print('Getting all masks (tiled)')
+        return list(self.generate_tiled(image_path, **kwargs))
 
     def show_anns(self, anns: List[Dict], borders: bool = True, show: bool = True) -> Optional[np.ndarray]:
         """Display annotations on an image."""
@@ -62,7 +129,7 @@ class SAM2Processor:
                       sorted_anns[0]['segmentation'].shape[1], 4))
         img[:,:,3] = 0
         for ann in sorted_anns:
-            m = ann['segmentation']
+            m = np.asarray(ann['segmentation'], dtype=bool)
             color_mask = np.concatenate([np.random.random(3), [0.5]])
             img[m] = color_mask 
             if borders:
@@ -76,6 +143,26 @@ class SAM2Processor:
             ax.imshow(img)
         return img
 
+    @staticmethod
+    def render_anns(image: Union[str, np.ndarray], anns: List[Dict], borders: bool = True,
+                    ext: Optional[str] = None, seed: Optional[int] = None) -> Union[np.ndarray, bytes]:
+        """
+        Render annotations onto an image without matplotlib.
+
+        Args:
+            image (Union[str, np.ndarray]): Image path or RGB array
+            anns (List[Dict]): Mask records with a 'segmentation' key (dense or CompactMask)
+            borders (bool): Whether to draw mask borders
+            ext (Optional[str]): Encode the result in this format (e.g. '.png'), None to return the array
+            seed (Optional[int]): Seed of the mask colors
+
+        Returns:
+            Union[np.ndarray, bytes]: Rendered uint8 RGB image, or encoded bytes when ext is given
+        """
+        renderer = OverlayRenderer(seed=seed)
+        out = renderer.render_masks(image, anns, borders=borders)
+        return renderer.encode(out, ext) if ext else out
+
     def get_similarity_value(self, box1: List[float], box2: List[float]) -> float:
         """Calculate similarity between two bounding boxes."""
         val1 = abs(box1[0]-box2[0])
@@ -86,56 +173,152 @@ class SAM2Processor:
 
     def get_final_similar_box(self, box1: List[float], box2: List[List[float]]) -> Tuple[List[float], int]:
         """Find the most similar box from a list of boxes."""
-        best_box = None
-        best_val = None
-        index = None
-        for i in box2:
-            val = self.get_similarity_value(box1, i)
-            if best_box is None or val < best_val:
-                best_box = i
-                best_val = val
-                index = box2.index(i)
-        return best_box, index
-
-    def get_mask_for_bbox(self, image_path: str, bbox_value: List[float],
-                         show_full: bool = False, show_final: bool = False) -> Tuple[np.ndarray, List[float], List[List[float]]]:
-        """Get mask for a specific bounding box."""
+        if len(box2) == 0:
+            return None, None
+        index, _ = BoxMatcher('l1').match(box1, box2)
+        index = int(index[0])
+        return box2[index], index
+
+    @staticmethod
+    def _masks_to_bboxes(masks: List[Dict]) -> List[List[float]]:
+        """Convert the XYWH boxes of generated masks to [y0, x0, y1, x1] boxes."""
+        if len(masks) == 0:
+            return []
+        xywh = np.array([m['bbox'] for m in masks])
+        return np.stack([xywh[:, 1], xywh[:, 0],
+                         xywh[:, 3] + xywh[:, 1], xywh[:, 2] + xywh[:, 0]], axis=1).tolist()
+
+    def get_mask_for_bbox(self, image_path: str, bbox_value: Union[List[float], List[List[float]]],
+                         show_full: bool = False, show_final: bool = False,
+                         metric: str = 'l1', one_to_one: bool = False, compact: bool = False
+                         ) -> Tuple[Union[np.ndarray, List[np.ndarray]], Union[List[float], List[List[float]]], List[List[float]]]:
+        """
+        Get mask for a specific bounding box, or for a list of bounding boxes.
+
+        Boxes are given in [y0, x0, y1, x1] order. When a list of boxes is given,
+        all of them are matched against the generated masks in one call.
+
+        Args:
+            image_path (str): Path to the image
+            bbox_value (Union[List[float], List[List[float]]]): Query box or list of query boxes
+            show_full (bool): Whether to display all generated masks
+            show_final (bool): Whether to display the matched masks
+            metric (str): Box matching metric ('l1', 'iou' or 'giou')
+            one_to_one (bool): Use optimal one-to-one assignment for a list of boxes,
+                               so that no mask is matched twice. Unassigned boxes get None.
+            compact (bool): Whether to return masks as CompactMask instead of dense arrays
+
+        Returns:
+            Tuple: Matched mask(s), matched box(es) and all generated mask boxes
+        """
         print('Getting mask')
         image = cv2.imread(image_path)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        mask_full = self.mask_generator.generate(image)
+        mask_full = self._generate(image, compact)
         if show_full:
             self.show_anns(mask_full)
         print('Getting final mask')
 
-        main_bbox = []
-        for i in mask_full:
-            mask_val = [i['bbox'][1], i['bbox'][0],
-                       (i['bbox'][3]+i['bbox'][1]), (i['bbox'][2]+i['bbox'][0])]
-            main_bbox.append(mask_val)
-
-        value_list, index = self.get_final_similar_box(bbox_value, main_bbox)
-        final_mask = mask_full[index]
-        final_bbox = [final_mask['bbox'][1], final_mask['bbox'][0],
-                     (final_mask['bbox'][3]+final_mask['bbox'][1]),
-                     (final_mask['bbox'][2]+final_mask['bbox'][0])]
+        main_bbox = self._masks_to_bboxes(mask_full)
+        single_query = np.ndim(bbox_value) == 1
+        matcher = BoxMatcher(metric)
+        query = matcher.as_boxes(bbox_value)
+        if one_to_one and not single_query:
+            query_idx, box_idx = matcher.assign(query, main_bbox)
+            index = [None] * len(query)
+            for q, b in zip(query_idx, box_idx):
+                index[q] = int(b)
+        else:
+            index = matcher.match(query, main_bbox)[0].tolist()
+
+        final_masks = [mask_full[i] if i is not None else None for i in index]
         if show_final:
-            self.show_anns([final_mask])
-        return final_mask['segmentation'], final_bbox, main_bbox
+            self.show_anns([m for m in final_masks if m is not None])
+        segmentations = [m['segmentation'] if m is not None else None for m in final_masks]
+        final_bboxes = [main_bbox[i] if i is not None else None for i in index]
+        if single_query:
+            return segmentations[0], final_bboxes[0], main_bbox
+        return segmentations, final_bboxes, main_bbox
+
+    def get_all_masks(self, image_path: str, compact: bool = False) -> List[Dict]:
+        """
+        Get all masks for an image.
+
+        Args:
+            image_path (str): Path to the image
+            compact (bool): Whether to store each 'segmentation' as a CompactMask
 
-    def get_all_masks(self, image_path: str) -> List[Dict]:
-        """Get all masks for an image."""
+        Returns:
+            List[Dict]: Generated mask records
+        """
         print('Getting all masks')
         image = cv2.imread(image_path)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        mask_full = self.mask_generator.generate(image)
+        mask_full = self._generate(image, compact)
         print('Getting final mask')
         return mask_full
 
+    def export_coco(self, image_paths: List[str], output_path: str, num_workers: Optional[int] = None,
+                    tolerance: float = 1.0) -> int:
+        """
+        Generate all masks for a list of images and export them as COCO JSON or JSON lines.
+
+        Masks are converted to polygons and RLE in a process pool and written as they are
+        produced, so memory use does not grow with the number of images.
+
+        Args:
+            image_paths (List[str]): Image paths, numbered from 1 as COCO image ids
+            output_path (str): Output path, '.jsonl' for JSON lines and COCO JSON otherwise
+            num_workers (Optional[int]): Conversion worker processes. Defaults to the number of CPUs
+            tolerance (float): Polygon simplification tolerance in pixels
+
+        Returns:
+            int: Number of exported masks
+        """
+        exporter = MaskExporter(num_workers=num_workers, tolerance=tolerance)
+        with CocoWriter(output_path) as writer:
+            def annotations() -> Iterator[Dict]:
+                for image_id, image_path in enumerate(image_paths, start=1):
+                    anns = self.get_all_masks(image_path, compact=True)
+                    height, width = anns[0]['segmentation'].shape if anns else cv2.imread(image_path).shape[:2]
+                    writer.add_image(image_id, image_path, height, width)
+                    for ann in anns:
+                        yield {'image_id': image_id, 'segmentation': ann['segmentation'],
+                               'score': ann['predicted_iou'], 'stability_score': ann['stability_score']}
+
+            return exporter.export(annotations(), writer)
+
+    def _generate(self, image: np.ndarray, compact: bool = False) -> List[Dict]:
+        """
+        Generate all masks of an image. With compact=True the generator outputs uncompressed
+        RLE, which is turned into CompactMask directly, so no full-resolution dense mask is built.
+        """
+        if not compact:
+            return self.mask_generator.generate(image)
+        output_mode = self.mask_generator.output_mode
+        self.mask_generator.output_mode = 'uncompressed_rle'
+        try:
+            anns = self.mask_generator.generate(image)
+        finally:
+            self.mask_generator.output_mode = output_mode
+        return self._compact_anns(anns)
+
+    @staticmethod
+    def _compact_anns(anns: List[Dict]) -> List[Dict]:
+        """Replace the RLE or dense 'segmentation' of every mask record with a CompactMask."""
+        for ann in anns:
+            segmentation = ann['segmentation']
+            if isinstance(segmentation, dict):
+                ann['segmentation'] = CompactMask.from_coco(segmentation)
+            else:
+                ann['segmentation'] = CompactMask.from_dense(segmentation)
+        return anns
+
     @staticmethod
     def show_mask(mask: np.ndarray, ax: plt.Axes, obj_id: Optional[int] = None,
                  random_color: bool = False) -> None:
         """Display a mask on a given axis."""
+        mask = np.asarray(mask)
         if random_color:
             color = np.concatenate([np.random.random(3), np.array([0.6])], axis=0)
         else:
@@ -191,23 +374,74 @@ class SAM2Processor:
 class VideoPredictor:
     """Class for video prediction using SAM2."""
 
-    def __init__(self, model_cfg: str, sam2_checkpoint: str, device: str = 'cpu'):
-        """Initialize VideoPredictor."""
+    def __init__(self, model_cfg: str, sam2_checkpoint: str, device: str = 'cpu',
+                 optimize: Optional[Union[bool, str, Dict[str, Any]]] = None):
+        """
+        Initialize VideoPredictor.
+
+        Args:
+            model_cfg (str): Path to model configuration
+            sam2_checkpoint (str): Path to model checkpoint
+            device (str): Device to run on
+            optimize (Optional[Union[bool, str, Dict[str, Any]]]): Execution settings, see
+                                                                  InferenceOptimizer.from_option
+        """
         self.predictor = build_sam2_video_predictor(model_cfg, sam2_checkpoint, device=device)
+        self.optimizer = InferenceOptimizer.from_option(optimize, device)
+        if self.optimizer is not None:
+            self.optimizer.apply(self.predictor)
+            self.optimizer.wrap(self.predictor, ['init_state', 'add_new_points_or_box', 'add_new_mask',
+                                                 'propagate_in_video_preflight', 'propagate_in_video'])
         self.video_image_folder = None
         self.frame_names = None
         self.joined_frame_names = None
         self.inference_state = None
+        self.frame_source = None
+
+    def set_inference_state(self, video_image_folder: str, offload_video_to_cpu: bool = False,
+                            prefetch: int = 16, async_prefetch: bool = True) -> None:
+        """
+        Initialize inference state from a folder of video frames or directly from a video file.
 
-    def set_inference_state(self, video_image_folder: str) -> None:
-        """Initialize inference state from video frames."""
+        For a video file, frames are decoded lazily by a VideoFrameSource with a prefetch
+        thread and resized to the model input size on the fly, so no frames are written to disk.
+
+        Args:
+            video_image_folder (str): Folder of frame images, or path to a video file
+            offload_video_to_cpu (bool): Whether to keep video frames on the CPU
+            prefetch (int): Number of frames decoded ahead when reading a video file
+            async_prefetch (bool): Whether to decode video file frames in a background thread
+        """
+        if self.frame_source is not None:
+            self.frame_source.close()
+            self.frame_source = None
         self.video_image_folder = video_image_folder
+
+        if isfile(video_image_folder):
+            self.frame_source = VideoFrameSource(
+                video_image_folder, image_size=self.predictor.image_size,
+                offload_video_to_cpu=offload_video_to_cpu, compute_device=self.predictor.device,
+                prefetch=prefetch, async_prefetch=async_prefetch)
+            self.frame_names = [f"{i:05d}" for i in range(len(self.frame_source))]
+            self.joined_frame_names = None
+            with self.frame_source.as_sam2_frames():
+                self.inference_state = self.predictor.init_state(
+                    video_path=video_image_folder, offload_video_to_cpu=offload_video_to_cpu)
+            return
+
         self.frame_names = [f for f in listdir(video_image_folder)
                           if isfile(join(video_image_folder, f))]
         self.frame_names = sorted(self.frame_names)
         self.joined_frame_names = [join(video_image_folder, frame)
                                  for frame in self.frame_names]
-        self.inference_state = self.predictor.init_state(video_path=video_image_folder)
+        self.inference_state = self.predictor.init_state(video_path=video_image_folder,
+                                                         offload_video_to_cpu=offload_video_to_cpu)
+
+    def _frame_image(self, frame_idx: int) -> Union[Image.Image, np.ndarray]:
+        """Get a frame at its original resolution for visualization."""
+        if self.frame_source is not None:
+            return self.frame_source.read_original(frame_idx)
+        return Image.open(self.joined_frame_names[frame_idx])
 
     def reset_state(self) -> None:
         """Reset the inference state."""
@@ -217,9 +451,9 @@ class VideoPredictor:
                     points: Optional[List[List[float]]] = None,
                     labels: Optional[List[int]] = None,
                     frame_idx: int = 0, show: bool = True,
-                    gemini_bbox: bool = True, **kwargs) -> None:
-        """Make predictions on a single frame."""
-        ann_obj_id = 1
+                    gemini_bbox: bool = True, obj_id: int = 1, **kwargs) -> None:
+        """Make predictions on a single frame for the object with id obj_id."""
+        ann_obj_id = obj_id
         prompts = {}
 
         if points is not None and labels is not None:
@@ -242,36 +476,372 @@ class VideoPredictor:
             **kwargs)
 
         if show:
-            image_loc = self.joined_frame_names[frame_idx]
+            image_loc = self._frame_image(frame_idx)
             self._visualize_prediction(image_loc, points, labels,
                                      prompts, out_mask_logits,out_obj_ids)
 
-    def predict_video(self, vis_frame_stride: int = 30) -> None:
-        """Process all frames in the video."""
+    def add_object(self, obj_id: int, bbox: Optional[List[float]] = None,
+                   points: Optional[List[List[float]]] = None,
+                   labels: Optional[List[int]] = None,
+                   frame_idx: int = 0, gemini_bbox: bool = True) -> None:
+        """
+        Register prompts for one object on one frame. Call it repeatedly to add many
+        objects, or more frames of the same object, before a single propagation pass.
+
+        Args:
+            obj_id (int): Object id
+            bbox (Optional[List[float]]): Box prompt
+            points (Optional[List[List[float]]]): Point prompts
+            labels (Optional[List[int]]): Point labels, 1 for foreground and 0 for background
+            frame_idx (int): Frame the prompts refer to
+            gemini_bbox (bool): Whether the box is in [y0, x0, y1, x1] order
+        """
+        self.predict_item(bbox=bbox, points=points, labels=labels, frame_idx=frame_idx,
+                          show=False, gemini_bbox=gemini_bbox, obj_id=obj_id)
+
+    def add_objects(self, prompts: Dict[int, Union[Dict[str, Any], List[Dict[str, Any]]]],
+                    gemini_bbox: bool = True) -> None:
+        """
+        Register prompts for many objects.
+
+        Args:
+            prompts (Dict[int, Union[Dict, List[Dict]]]): Per object id, one or more prompt dicts
+                                                          with 'frame_idx' and 'bbox' and/or
+                                                          'points' and 'labels' keys
+            gemini_bbox (bool): Whether boxes are in [y0, x0, y1, x1] order
+        """
+        for obj_id, obj_prompts in prompts.items():
+            if isinstance(obj_prompts, dict):
+                obj_prompts = [obj_prompts]
+            for prompt in obj_prompts:
+                self.add_object(obj_id, bbox=prompt.get('bbox'), points=prompt.get('points'),
+                                labels=prompt.get('labels'), frame_idx=prompt.get('frame_idx', 0),
+                                gemini_bbox=gemini_bbox)
+
+    @property
+    def obj_ids(self) -> List[int]:
+        """Ids of the objects registered in the inference state."""
+        return list(self.inference_state["obj_ids"])
+
+    def track_objects(self, **kwargs) -> Dict[int, Dict[int, CompactMask]]:
+        """
+        Track all registered objects in a single propagation pass.
+
+        Args:
+            **kwargs: Additional arguments for stream_video
+
+        Returns:
+            Dict[int, Dict[int, CompactMask]]: Masks per object id and frame index
+        """
+        results = {obj_id: {} for obj_id in self.obj_ids}
+        for frame_idx, obj_id, mask in self.stream_video(**kwargs):
+            results.setdefault(obj_id, {})[frame_idx] = mask
+        return results
+
+    def export_objects(self, output_dir: str, overwrite: bool = True, **kwargs) -> Dict[int, str]:
+        """
+        Track all registered objects in a single propagation pass, writing one mask store per object.
+
+        Args:
+            output_dir (str): Directory for the per-object 'obj_<id>.jsonl' mask stores
+            overwrite (bool): Whether to truncate existing stores first instead of appending to them
+            **kwargs: Additional arguments for stream_video
+
+        Returns:
+            Dict[int, str]: Mask store path per object id
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        stores = {obj_id: MaskStore(join(output_dir, f"obj_{obj_id}.jsonl")) for obj_id in self.obj_ids}
+        if overwrite:
+            for store in stores.values():
+                open(store.path, 'w').close()
+        try:
+            for frame_idx, obj_id, mask in self.stream_video(**kwargs):
+                stores[obj_id].append(frame_idx, obj_id, mask)
+        finally:
+            for store in stores.values():
+                store.close()
+        return {obj_id: store.path for obj_id, store in stores.items()}
+
+    def export_coco(self, store: Union[str, MaskStore], output_path: str, num_workers: Optional[int] = None,
+                    tolerance: float = 1.0, skip_empty: bool = True) -> int:
+        """
+        Export the masks of a mask store as COCO JSON or JSON lines, one image per frame
+        with image id frame_idx + 1.
+
+        Args:
+            store (Union[str, MaskStore]): Mask store, e.g. from save_video_masks
+            output_path (str): Output path, '.jsonl' for JSON lines and COCO JSON otherwise
+            num_workers (Optional[int]): Conversion worker processes. Defaults to the number of CPUs
+            tolerance (float): Polygon simplification tolerance in pixels
+            skip_empty (bool): Whether to leave out frames where an object has no mask
+
+        Returns:
+            int: Number of exported masks, with the object id kept as 'track_id'
+        """
+        store = MaskStore(store) if isinstance(store, str) else store
+        exporter = MaskExporter(num_workers=num_workers, tolerance=tolerance)
+        with CocoWriter(output_path) as writer:
+            def annotations() -> Iterator[Dict]:
+                for frame_idx, obj_id, mask in store.read():
+                    if skip_empty and mask.area == 0:
+                        continue
+                    file_name = self.frame_names[frame_idx] if self.frame_names else f"{frame_idx:05d}"
+                    writer.add_image(frame_idx + 1, file_name, *mask.shape, frame_idx=frame_idx)
+                    yield {'image_id': frame_idx + 1, 'track_id': obj_id, 'segmentation': mask}
+
+            return exporter.export(annotations(), writer)
+
+    def propagate_chunked(self, video_path: str,
+                          prompts: Dict[int, Union[Dict[str, Any], List[Dict[str, Any]]]],
+                          output_path: str, window: int = 300, overlap: int = 16,
+                          checkpoint_path: Optional[str] = None, gemini_bbox: bool = True,
+                          offload_video_to_cpu: bool = False, prefetch: int = 16) -> List[Dict[str, float]]:
+        """
+        Track objects through a long video in overlapping windows with bounded memory.
+
+        Each window gets its own inference state over frames [start, start + window). Objects
+        are carried into the next window as mask prompts on its first frame, which lies inside
+        the previous window's last `overlap` frames, so the tracker rebuilds its memory before
+        new frames are written. Masks are appended to a mask store, and progress is
+        checkpointed after every window so an interrupted job resumes where it stopped.
+
+        Args:
+            video_path (str): Path to the video file
+            prompts (Dict[int, Union[Dict, List[Dict]]]): Per object id, one or more prompt dicts
+                                                          ('frame_idx', 'bbox', 'points', 'labels'),
+                                                          with frame indices relative to the whole video
+            output_path (str): Path of the mask store to append masks to
+            window (int): Number of frames per window
+            overlap (int): Number of frames shared by consecutive windows
+            checkpoint_path (Optional[str]): Path of the checkpoint file. Defaults to output_path + '.ckpt.json'
+            gemini_bbox (bool): Whether boxes are in [y0, x0, y1, x1] order
+            offload_video_to_cpu (bool): Whether to keep video frames on the CPU
+            prefetch (int): Number of frames decoded ahead
+
+        Returns:
+            List[Dict[str, float]]: Per-window throughput statistics, with the number of objects
+                                    'carried' into the next window, how many of those were empty on
+                                    its first frame and 'carried_stale' with their last non-empty
+                                    mask, and the number tracked but with no mask to carry ('carry_lost')
+        """
+        if not 0 <= overlap < window:
+            raise ValueError("overlap must be in [0, window)")
+        checkpoint_path = checkpoint_path or output_path + '.ckpt.json'
+        state = self._load_chunk_checkpoint(checkpoint_path, video_path, window, overlap, output_path)
+        source = VideoFrameSource(video_path, image_size=self.predictor.image_size,
+                                  offload_video_to_cpu=offload_video_to_cpu,
+                                  compute_device=self.predictor.device, prefetch=prefetch)
+        total = len(source)
+        try:
+            while state['written_until'] < total:
+                start = state['start']
+                stop = min(start + window, total)
+                next_start = stop - overlap if stop < total else stop
+                t_start = time.time()
+
+                with sam2_frames(source.window(start, stop)):
+                    self.inference_state = self.predictor.init_state(
+                        video_path=video_path, offload_video_to_cpu=offload_video_to_cpu)
+                for obj_id, rle in state['carry'].items():
+                    self.predictor.add_new_mask(self.inference_state, 0, int(obj_id),
+                                                CompactMask.from_coco(rle).to_dense())
+                for obj_id, obj_prompts in prompts.items():
+                    obj_prompts = [obj_prompts] if isinstance(obj_prompts, dict) else obj_prompts
+                    for prompt in obj_prompts:
+                        frame_idx = prompt.get('frame_idx', 0)
+                        if start <= frame_idx < stop:
+                            self.add_object(obj_id, bbox=prompt.get('bbox'), points=prompt.get('points'),
+                                            labels=prompt.get('labels'), frame_idx=frame_idx - start,
+                                            gemini_bbox=gemini_bbox)
+
+                # an object empty on the boundary frame (e.g. occluded) is carried with its last
+                # non-empty mask, falling back to the mask it was carried into this window with
+                carry = dict(state['carry'])
+                last_masks = {}
+                fresh = set()
+                tracked = set()
+                written = 0
+                if self.inference_state["obj_ids"]:
+                    tracked = {str(obj_id) for obj_id in self.inference_state["obj_ids"]}
+                    with MaskStore(output_path) as store:
+                        for frame_idx, obj_id, mask in self.stream_video():
+                            frame_idx += start
+                            if frame_idx >= state['written_until']:
+                                store.append(frame_idx, obj_id, mask)
+                                written += 1
+                            if frame_idx <= next_start and mask.area > 0:
+                                last_masks[str(obj_id)] = mask
+                                if frame_idx == next_start:
+                                    fresh.add(str(obj_id))
+                self.inference_state = None
+                carry.update({key: mask.to_coco(compressed=True) for key, mask in last_masks.items()})
+                if stop == total:
+                    carry, tracked = {}, set()
+
+                seconds = time.time() - t_start
+                stats = {'window': len(state['stats']), 'start': start, 'stop': stop,
+                         'masks': written, 'seconds': seconds, 'fps': (stop - start) / max(seconds, 1e-9),
+                         'carried': len(carry), 'carried_stale': len(set(carry) - fresh),
+                         'carry_lost': len(tracked - set(carry))}
+                print(f"Window {stats['window']}: frames {start}-{stop - 1}, {stats['fps']:.2f} frames/s")
+                if stats['carried_stale'] or stats['carry_lost']:
+                    print(f"Window {stats['window']}: {stats['carried_stale']} objects empty on frame {next_start} "
+                          f"carried with an earlier mask, {stats['carry_lost']} objects without a mask to carry")
+                state.update(start=next_start, written_until=stop, carry=carry,
+                             store_bytes=os.path.getsize(output_path) if os.path.exists(output_path) else 0)
+                state['stats'].append(stats)
+                self._save_chunk_checkpoint(checkpoint_path, state)
+        finally:
+            source.close()
+        return state['stats']
+
+    @staticmethod
+    def _load_chunk_checkpoint(checkpoint_path: str, video_path: str, window: int, overlap: int,
+                               output_path: str) -> Dict[str, Any]:
+        """Load a chunked propagation checkpoint, or start a new one, and align the mask store with it."""
+        if not os.path.exists(checkpoint_path):
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return {'video_path': video_path, 'window': window, 'overlap': overlap, 'start': 0,
+                    'written_until': 0, 'store_bytes': 0, 'carry': {}, 'stats': []}
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+        if (state['video_path'], state['window'], state['overlap']) != (video_path, window, overlap):
+            raise ValueError(f"Checkpoint {checkpoint_path} was written for a different video or window setup")
+        # drop masks written by a window that did not finish
+        if os.path.exists(output_path):
+            with open(output_path, 'r+') as f:
+                f.truncate(state['store_bytes'])
+        print(f"Resuming from frame {state['written_until']}")
+        return state
+
+    @staticmethod
+    def _save_chunk_checkpoint(checkpoint_path: str, state: Dict[str, Any]) -> None:
+        """Write a chunked propagation checkpoint atomically."""
+        tmp_path = checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def predict_video(self, vis_frame_stride: int = 30, show: bool = True,
+                      compact: bool = False) -> Dict[int, Dict[int, Union[np.ndarray, CompactMask]]]:
+        """
+        Process all frames in the video.
+
+        Args:
+            vis_frame_stride (int): Plot every vis_frame_stride-th frame
+            show (bool): Whether to plot the results
+            compact (bool): Whether to store masks as CompactMask instead of dense arrays
+
+        Returns:
+            Dict[int, Dict[int, Union[np.ndarray, CompactMask]]]: Masks per frame index and object id
+        """
         video_segments = {}
         for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(self.inference_state):
             video_segments[out_frame_idx] = {
-                out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
+                out_obj_id: self._logits_to_mask(out_mask_logits[i], compact)
                 for i, out_obj_id in enumerate(out_obj_ids)
             }
 
-        plt.close("all")
-        for out_frame_idx in range(0, len(self.frame_names), vis_frame_stride):
-            plt.figure(figsize=(6, 4))
-            ax = plt.gca()
-            plt.title(f"frame {out_frame_idx}")
-            img = Image.open(self.joined_frame_names[out_frame_idx])
-            ax.imshow(img)
-            for out_obj_id, out_mask in video_segments[out_frame_idx].items():
-                SAM2Processor.show_mask(out_mask, ax, obj_id=out_obj_id)
-    
-    def _visualize_prediction(self, image_loc: Optional[str], points: Optional[np.ndarray],
+        if show:
+            plt.close("all")
+            for out_frame_idx in range(0, len(self.frame_names), vis_frame_stride):
+                plt.figure(figsize=(6, 4))
+                ax = plt.gca()
+                plt.title(f"frame {out_frame_idx}")
+                img = self._frame_image(out_frame_idx)
+                ax.imshow(img)
+                for out_obj_id, out_mask in video_segments[out_frame_idx].items():
+                    SAM2Processor.show_mask(out_mask, ax, obj_id=out_obj_id)
+        return video_segments
+
+    def stream_video(self, store: Optional[Union[str, MaskStore]] = None,
+                     start_frame_idx: Optional[int] = None,
+                     max_frame_num_to_track: Optional[int] = None,
+                     reverse: bool = False,
+                     trim_memory: bool = True) -> Iterator[Tuple[int, int, CompactMask]]:
+        """
+        Propagate prompts through the video, yielding compact masks as frames are produced.
+
+        Nothing is accumulated per frame, and with trim_memory the tracker outputs of frames
+        that have left SAM2's memory window are dropped, so memory stays constant in video length.
+
+        Args:
+            store (Optional[Union[str, MaskStore]]): Mask store (or its path) to append every mask to
+            start_frame_idx (Optional[int]): Frame to start from. Defaults to the first prompted frame
+            max_frame_num_to_track (Optional[int]): Maximum number of frames to propagate over
+            reverse (bool): Whether to propagate backwards in time
+            trim_memory (bool): Whether to drop tracker outputs outside the memory window
+
+        Yields:
+            Tuple[int, int, CompactMask]: Frame index, object id and mask
+        """
+        owned = isinstance(store, str)
+        if owned:
+            store = MaskStore(store)
+        try:
+            for out_frame_idx, out_obj_ids, out_mask_logits in self.predictor.propagate_in_video(
+                    self.inference_state, start_frame_idx=start_frame_idx,
+                    max_frame_num_to_track=max_frame_num_to_track, reverse=reverse):
+                for i, out_obj_id in enumerate(out_obj_ids):
+                    mask = self._logits_to_mask(out_mask_logits[i], compact=True)
+                    if store is not None:
+                        store.append(out_frame_idx, out_obj_id, mask)
+                    yield out_frame_idx, out_obj_id, mask
+                if trim_memory:
+                    self._trim_memory(out_frame_idx, reverse)
+        finally:
+            if owned:
+                store.close()
+            elif store is not None:
+                store.flush()
+
+    def save_video_masks(self, path: str, **kwargs) -> int:
+        """
+        Propagate prompts through the video and append all masks to a mask store on disk.
+
+        Args:
+            path (str): Path of the mask store file
+            **kwargs: Additional arguments for stream_video
+
+        Returns:
+            int: Number of masks written
+        """
+        count = 0
+        with MaskStore(path) as store:
+            for _ in self.stream_video(store=store, **kwargs):
+                count += 1
+        return count
+
+    def _trim_memory(self, frame_idx: int, reverse: bool = False) -> None:
+        """Drop non-conditioning tracker outputs that no later frame can attend to."""
+        model = self.predictor
+        window = max(model.num_maskmem * model.memory_temporal_stride_for_eval,
+                     model.max_obj_ptrs_in_encoder) + 1
+        for obj_idx, obj_output_dict in self.inference_state["output_dict_per_obj"].items():
+            outputs = obj_output_dict["non_cond_frame_outputs"]
+            tracked = self.inference_state["frames_tracked_per_obj"][obj_idx]
+            stale = [t for t in outputs if (t > frame_idx + window if reverse else t < frame_idx - window)]
+            for t in stale:
+                del outputs[t]
+                tracked.pop(t, None)
+
+    @staticmethod
+    def _logits_to_mask(mask_logits: torch.Tensor, compact: bool = False) -> Union[np.ndarray, CompactMask]:
+        """Threshold the mask logits of one object, optionally as a CompactMask."""
+        mask = (mask_logits > 0.0).cpu().numpy()
+        if compact:
+            return CompactMask.from_dense(mask.reshape(mask.shape[-2:]))
+        return mask
+
+    def _visualize_prediction(self, image_loc: Union[str, Image.Image, np.ndarray], points: Optional[np.ndarray],
                               labels: Optional[np.ndarray], prompts: Dict[int, Tuple[np.ndarray, np.ndarray]], 
                               out_mask_logits: np.ndarray, out_obj_ids: int ) -> None:
         """Visualize the prediction."""
         plt.figure(figsize=(10, 10))
         ax = plt.gca()  # Get current axis
-        img = Image.open(image_loc)
+        img = Image.open(image_loc) if isinstance(image_loc, str) else image_loc
         ax.imshow(img)
         SAM2Processor.show_points(points, labels, ax)
         for i,val in enumerate(out_obj_ids):
@@ -281,26 +851,65 @@ class VideoPredictor:
 class ImagePredictor:
     """Class for image prediction using SAM2."""
 
-    def __init__(self, model_cfg: str, sam2_checkpoint: str, device: str = 'cpu'):
-        """Initialize ImagePredictor."""
+    def __init__(self, model_cfg: str, sam2_checkpoint: str, device: str = 'cpu',
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 optimize: Optional[Union[bool, str, Dict[str, Any]]] = None):
+        """
+        Initialize ImagePredictor.
+
+        Args:
+            model_cfg (str): Path to model configuration
+            sam2_checkpoint (str): Path to model checkpoint
+            device (str): Device to run on
+            embedding_cache (Optional[EmbeddingCache]): Cache of image embeddings, so that
+                                                        set_image skips the encoder for images seen before
+            optimize (Optional[Union[bool, str, Dict[str, Any]]]): Execution settings: True for bf16
+                autocast, channels-last and tuned threads, 'compile' to also torch.compile the image
+                encoder and mask decoder, or a dict of InferenceOptimizer arguments
+        """
         self.predictor = SAM2ImagePredictor(build_sam2(model_cfg, sam2_checkpoint, device=device))
+        self.optimizer = InferenceOptimizer.from_option(optimize, device)
+        if self.optimizer is not None:
+            self.optimizer.apply(self.predictor.model)
+            self.optimizer.wrap(self.predictor, ['set_image', 'set_image_batch', 'predict', 'predict_batch',
+                                                 '_predict'])
         self.image = None
+        self.embedding_cache = embedding_cache
+        self.model_id = f"{model_cfg}:{sam2_checkpoint}"
 
-    def set_image(self, image: Union[str, np.ndarray]) -> None:
-        """Set the image for prediction."""
+    @staticmethod
+    def _load_image(image: Union[str, np.ndarray]) -> np.ndarray:
+        """Read an image path as RGB, or pass an image array through."""
         if isinstance(image, str):
             image = cv2.imread(image)
-            self.image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return np.asarray(image)
+
+    def set_image(self, image: Union[str, np.ndarray]) -> None:
+        """Set the image for prediction, restoring cached embeddings when available."""
+        self.image = self._load_image(image)
+
+        if self.embedding_cache is None:
+            self.predictor.set_image(self.image)
+            return
+
+        key = self.embedding_cache.make_key(self.image, self.model_id)
+        features = self.embedding_cache.get(key, device=self.predictor.device)
+        if features is None:
+            self.predictor.set_image(self.image)
+            self.embedding_cache.put(key, self.predictor._features)
         else:
-            self.image = image
-        self.predictor.set_image(self.image)
+            self.predictor.reset_predictor()
+            self.predictor._orig_hw = [self.image.shape[:2]]
+            self.predictor._features = features
+            self.predictor._is_image_set = True
 
     def predict_item(self, bbox: Optional[List[List[float]]] = None,
                     points: Optional[List[List[float]]] = None,
                     labels: Optional[List[int]] = None,
-                    show: bool = True, gemini_bbox: bool = True,
-                    **kwargs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        """Make predictions on the current image."""
+                    show: bool = True, gemini_bbox: bool = True, compact: bool = False,
+                    **kwargs) -> Tuple[Union[np.ndarray, List[CompactMask]], np.ndarray, np.ndarray]:
+        """Make predictions on the current image. With compact=True, masks are returned as a list of CompactMask."""
         predict_args = {}
 
         if points is not None and labels is not None:
@@ -326,8 +935,149 @@ class ImagePredictor:
         if show:
             self._visualize_prediction(masks, scores, points, bbox, labels)
 
+        if compact:
+            masks = [CompactMask.from_dense(m) for m in masks]
         return masks, scores, logits
     
+    def _set_image_batch(self, images: List[np.ndarray]) -> None:
+        """Encode a list of images in one batch, restoring cached embeddings when available."""
+        if self.embedding_cache is None:
+            self.predictor.set_image_batch(images)
+            return
+
+        keys = [self.embedding_cache.make_key(image, self.model_id) for image in images]
+        features = [self.embedding_cache.get(key, device=self.predictor.device) for key in keys]
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            self.predictor.set_image_batch([images[i] for i in missing])
+            computed = self.predictor._features
+            for j, i in enumerate(missing):
+                features[i] = {
+                    "image_embed": computed["image_embed"][j:j + 1],
+                    "high_res_feats": [f[j:j + 1] for f in computed["high_res_feats"]],
+                }
+                self.embedding_cache.put(keys[i], features[i])
+
+        self.predictor.reset_predictor()
+        self.predictor._orig_hw = [image.shape[:2] for image in images]
+        self.predictor._features = {
+            "image_embed": torch.cat([f["image_embed"] for f in features]),
+            "high_res_feats": [torch.cat([f["high_res_feats"][level] for f in features])
+                               for level in range(len(features[0]["high_res_feats"]))],
+        }
+        self.predictor._is_image_set = True
+        self.predictor._is_batch = True
+
+    def predict_batch(self, images: List[Union[str, np.ndarray]],
+                      boxes_per_image: Optional[List[Optional[List[List[float]]]]] = None,
+                      points_per_image: Optional[List[Optional[List[List[List[float]]]]]] = None,
+                      labels_per_image: Optional[List[Optional[List[List[int]]]]] = None,
+                      batch_size: int = 4, multimask_output: bool = False,
+                      gemini_bbox: bool = True, return_logits: bool = False, compact: bool = False
+                      ) -> List[Tuple[Union[np.ndarray, List[List[CompactMask]]], np.ndarray, np.ndarray]]:
+        """
+        Make predictions for many prompts on many images.
+
+        Images are encoded batch_size at a time, and all prompts of an image are decoded
+        together in a single mask decoder pass. Each prompt is one box and/or one set of points.
+        The predictor is left without an image set, so call set_image before predict_item.
+
+        Args:
+            images (List[Union[str, np.ndarray]]): Image paths or RGB image arrays
+            boxes_per_image (Optional[List]): For each image, a list of N boxes (or None)
+            points_per_image (Optional[List]): For each image, a list of N point sets of shape (P, 2) (or None).
+                                               Sets may differ in P; shorter ones are padded with label -1
+            labels_per_image (Optional[List]): For each image, a list of N label sets of shape (P,).
+                                               Defaults to all foreground points
+            batch_size (int): Number of images encoded together
+            multimask_output (bool): Whether to return three masks per prompt
+            gemini_bbox (bool): Whether boxes are in [y0, x0, y1, x1] order
+            return_logits (bool): Whether to return mask logits instead of binary masks
+            compact (bool): Whether to return the masks of each image as N lists of C CompactMask
+
+        Returns:
+            List[Tuple[np.ndarray, np.ndarray, np.ndarray]]: For each image, masks of shape (N, C, H, W),
+                                                             scores of shape (N, C) and low resolution
+                                                             logits of shape (N, C, 256, 256), with the
+                                                             C masks of each prompt sorted by score
+        """
+        results = []
+        for start in range(0, len(images), batch_size):
+            batch = [self._load_image(image) for image in images[start:start + batch_size]]
+            self._set_image_batch(batch)
+            for img_idx in range(len(batch)):
+                boxes = boxes_per_image[start + img_idx] if boxes_per_image is not None else None
+                points = points_per_image[start + img_idx] if points_per_image is not None else None
+                labels = labels_per_image[start + img_idx] if labels_per_image is not None else None
+                masks, scores, logits = self._predict_prompts(img_idx, boxes, points, labels,
+                                                              multimask_output, gemini_bbox, return_logits)
+                if compact and not return_logits:
+                    masks = [[CompactMask.from_dense(m) for m in prompt_masks] for prompt_masks in masks]
+                results.append((masks, scores, logits))
+        self.predictor.reset_predictor()
+        self.image = None
+        return results
+
+    @staticmethod
+    def _pad_point_sets(points: List[List[List[float]]],
+                        labels: Optional[List[List[int]]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Stack point sets of different lengths, padding with label -1, which SAM2 ignores."""
+        point_sets = [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in points]
+        if labels is None:
+            label_sets = [np.ones(len(p), dtype=np.int32) for p in point_sets]
+        else:
+            if len(labels) != len(point_sets):
+                raise ValueError(f"Got {len(labels)} label sets for {len(point_sets)} point sets")
+            label_sets = [np.asarray(l, dtype=np.int32).reshape(-1) for l in labels]
+            for i, (p, l) in enumerate(zip(point_sets, label_sets)):
+                if len(p) != len(l):
+                    raise ValueError(f"Point set {i} has {len(p)} points but {len(l)} labels")
+        num_points = max(len(p) for p in point_sets)
+        coords = np.zeros((len(point_sets), num_points, 2), dtype=np.float32)
+        point_labels = np.full((len(point_sets), num_points), -1, dtype=np.int32)
+        for i, (p, l) in enumerate(zip(point_sets, label_sets)):
+            coords[i, :len(p)] = p
+            point_labels[i, :len(l)] = l
+        return coords, point_labels
+
+    def _predict_prompts(self, img_idx: int, boxes: Optional[List[List[float]]],
+                         points: Optional[List[List[List[float]]]], labels: Optional[List[List[int]]],
+                         multimask_output: bool, gemini_bbox: bool,
+                         return_logits: bool) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Decode all prompts of one image of the current batch in a single pass."""
+        if boxes is not None and len(boxes) > 0:
+            boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4)
+            if gemini_bbox:
+                boxes = boxes[:, [1,0,3,2]]
+        else:
+            boxes = None
+        if points is not None and len(points) > 0:
+            points, labels = self._pad_point_sets(points, labels)
+        else:
+            points, labels = None, None
+
+        num_masks = 3 if multimask_output else 1
+        h, w = self.predictor._orig_hw[img_idx]
+        if boxes is None and points is None:
+            return (np.zeros((0, num_masks, h, w), dtype=np.float32 if return_logits else bool),
+                    np.zeros((0, num_masks), dtype=np.float32),
+                    np.zeros((0, num_masks, 256, 256), dtype=np.float32))
+
+        _, unnorm_coords, unnorm_labels, unnorm_box = self.predictor._prep_prompts(
+            points, labels, boxes, None, normalize_coords=True, img_idx=img_idx)
+        masks, scores, logits = self.predictor._predict(
+            unnorm_coords, unnorm_labels, unnorm_box, None, multimask_output,
+            return_logits=return_logits, img_idx=img_idx)
+        masks = masks.float().cpu().numpy() if return_logits else masks.cpu().numpy()
+        scores = scores.float().cpu().numpy()
+        logits = logits.float().cpu().numpy()
+
+        sorted_ind = np.argsort(scores, axis=1)[:, ::-1]
+        masks = np.take_along_axis(masks, sorted_ind[:, :, None, None], axis=1)
+        logits = np.take_along_axis(logits, sorted_ind[:, :, None, None], axis=1)
+        scores = np.take_along_axis(scores, sorted_ind, axis=1)
+        return masks, scores, logits
+
     def _visualize_prediction(self, masks: np.ndarray, scores: np.ndarray,points: Optional[np.ndarray] = None,
                             bbox: Optional[np.ndarray] = None, labels: Optional[np.ndarray] = None) -> None:
         """Visualize the prediction."""
@@ -353,31 +1103,26 @@ class DataProcessor:
         return data
 
     @staticmethod
-    def read_batch(data: Dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
-        """Read a batch of data."""
+    def read_batch(data: Dict, num_points: int = 1) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Read a batch of data, with num_points random interior points per instance."""
         ent = data[np.random.randint(len(data))]
-        Img = cv2.imread(ent["image"])[...,::-1]
-        ann_map = cv2.imread(ent["annotation"])
-
-        r = np.min([1024 / Img.shape[1], 1024 / Img.shape[0]])
-        Img = cv2.resize(Img, (int(Img.shape[1] * r), int(Img.shape[0] * r)))
-        ann_map = cv2.resize(ann_map, (int(ann_map.shape[1] * r), int(ann_map.shape[0] * r)),
-                           interpolation=cv2.INTER_NEAREST)
-
-        mat_map = ann_map[:,:,0]
-        ves_map = ann_map[:,:,2]
-        mat_map[mat_map==0] = ves_map[mat_map==0]*(mat_map.max()+1)
-
-        inds = np.unique(mat_map)[1:]
-        points = []
-        masks = []
-        for ind in inds:
-            mask = (mat_map == ind).astype(np.uint8)
-            masks.append(mask)
-            coords = np.argwhere(mask > 0)
-            yx = np.array(coords[np.random.randint(len(coords))])
-            points.append([[yx[1], yx[0]]])
-        return Img, np.array(masks), np.array(points), np.ones([len(masks),1])
+        Img, ann_map = load_pair(ent["image"], ent["annotation"])
+        masks, points, labels = decode_instances(ann_map, num_points=num_points)
+        return Img, masks, points, labels
+
+    @staticmethod
+    def make_loader(data: Dict, **kwargs) -> torch.utils.data.DataLoader:
+        """
+        Build a prefetching DataLoader over the data, see `trainingdata.make_train_loader`.
+
+        Args:
+            data (Dict): Data dict from load_data
+            **kwargs: make_train_loader arguments (batch_size, num_workers, seed, cache_dir, ...)
+
+        Returns:
+            torch.utils.data.DataLoader: Loader yielding lists of read_batch-style samples
+        """
+        return make_train_loader(data, **kwargs)
 
 class ModelTrainer:
     """Class for training SAM2 models."""
@@ -388,57 +1133,229 @@ class ModelTrainer:
 
         self.checkpoint = sam2_checkpoint
         self.model_cfg = model_cfg
+        self.model_id = f"{model_cfg}:{sam2_checkpoint}"
         self.predictor = SAM2ImagePredictor(build_sam2(model_cfg, sam2_checkpoint, device=device,apply_postprocessing=False))
         self.device = device
 
-    def train(self, data: Dict, epochs: int = 10, lr: float = 1e-6,
-             save_step: int = 10, save_all: bool = False) -> SAM2ImagePredictor:
-        """Train the model."""
+    def train(self, data: Union[Dict, torch.utils.data.DataLoader], epochs: int = 10, lr: float = 1e-6,
+             save_step: int = 10, save_all: bool = False, num_workers: int = 0,
+             seed: Optional[int] = None, cache_dir: Optional[str] = None, batch_size: int = 1,
+             accumulation_steps: int = 1, iterations: Optional[int] = None,
+             log_step: int = 10, feature_store: Optional[Union[str, FeatureStore]] = None,
+             checkpoint_dir: str = './sam_model_checkpoints',
+             keep_checkpoints: Optional[int] = None, evaluator: Optional[SegmentationEvaluator] = None,
+             eval_step: int = 100) -> SAM2ImagePredictor:
+        """
+        Train the model.
+
+        Every optimizer step runs `accumulation_steps` mini-batches of `batch_size` images.
+        The images of a mini-batch are embedded together, each image's prompts are decoded
+        against its own embedding, and the loss is averaged over the images.
+
+        Args:
+            data (Union[Dict, DataLoader]): Data dict from load_data, or a loader from DataProcessor.make_loader
+            epochs (int): Number of passes over the data
+            lr (float): Learning rate
+            save_step (int): Optimizer steps between checkpoints
+            save_all (bool): Whether to keep every checkpoint instead of only the latest one
+            num_workers (int): Loader worker processes when data is a dict
+            seed (Optional[int]): Sampling seed when data is a dict
+            cache_dir (Optional[str]): Directory of pre-resized images when data is a dict
+            batch_size (int): Images per mini-batch when data is a dict
+            accumulation_steps (int): Mini-batches whose gradients are accumulated per optimizer step
+            iterations (Optional[int]): Stop after this many optimizer steps, even mid-epoch
+            log_step (int): Optimizer steps between progress and throughput reports
+            feature_store (Optional[Union[str, FeatureStore]]): Precomputed image features from
+                build_feature_store. The image encoder is then skipped and images are not decoded.
+                A loader passed as data must then yield item indices in place of images
+            checkpoint_dir (str): Directory of the checkpoints. They hold only the mask decoder
+                                  and prompt encoder and are written on a background thread
+            keep_checkpoints (Optional[int]): Number of checkpoints kept. Defaults to all with
+                                              save_all and to the latest one otherwise
+            evaluator (Optional[SegmentationEvaluator]): Held-out evaluator run every eval_step
+                                                         optimizer steps and after training
+            eval_step (int): Optimizer steps between evaluations
+
+        Returns:
+            SAM2ImagePredictor: The trained predictor
+        """
         self.predictor.model.sam_mask_decoder.train(True)
         self.predictor.model.sam_prompt_encoder.train(True)
         
         optimizer = torch.optim.AdamW(params=self.predictor.model.parameters(),
                                     lr=lr, weight_decay=4e-5)
         scaler = GradScaler()
-        
-        os.makedirs("sam_model_checkpoints", exist_ok=True)
 
-        self.mean_iou = 0
-        for itr in range(epochs):
-            with torch.amp.autocast(device_type=self.device):
-                image, mask, input_point, input_label = DataProcessor.read_batch(data)
-                if mask.shape[0] == 0:
-                    continue
+        if keep_checkpoints is None and not save_all:
+            keep_checkpoints = 1
+        self.checkpointer = DeltaCheckpointer(checkpoint_dir, keep_last=keep_checkpoints,
+                                              base_checkpoint=self.checkpoint)
+
+        # drain and join the background writer even when a step raises
+        try:
+            if feature_store is not None:
+                feature_store = self._open_feature_store(feature_store, data)
+            self.feature_store = feature_store
+            if isinstance(data, dict):
+                data = DataProcessor.make_loader(data, batch_size=batch_size, num_workers=num_workers,
+                                                 seed=seed or 0, cache_dir=cache_dir,
+                                                 with_images=feature_store is None)
 
-                self.predictor.set_image(image)
+            self.mean_iou = 0
+            itr = 0
+            micro_steps = 0
+            images = 0
+            t_start = time.time()
+            t_log, images_log = t_start, 0
+            optimizer.zero_grad()
+            for epoch in range(epochs):
+                if hasattr(data.sampler, 'set_epoch'):
+                    data.sampler.set_epoch(epoch)
+                for batch in data:
+                    batch = [sample for sample in batch if sample[1].shape[0] > 0]
+                    if not batch:
+                        continue
+                    with torch.amp.autocast(device_type=self.device):
+                        loss, iou = self._compute_batch_loss(batch)
+                    scaler.scale(loss / accumulation_steps).backward()
+                    micro_steps += 1
+                    images += len(batch)
+                    self.mean_iou = self.mean_iou * 0.99 + 0.01 * iou
+                    if micro_steps % accumulation_steps:
+                        continue
+
+                    scaler.step(optimizer)
+                    scaler.update()
+                    optimizer.zero_grad()
+
+                    if itr % log_step == 0:
+                        now = time.time()
+                        print(f"Epoch {epoch}, Iteration {itr}, Loss: {loss.item()}, Mean IOU: {self.mean_iou}, "
+                              f"{(images - images_log) / max(now - t_log, 1e-9):.2f} images/s")
+                        t_log, images_log = now, images
+                    if itr % save_step == 0:
+                        self._save_checkpoint(itr)
+                    itr += 1
+                    if evaluator is not None and itr % eval_step == 0:
+                        self.evaluate(evaluator, tag=itr)
+                    if iterations is not None and itr >= iterations:
+                        break
+                else:
+                    continue
+                break
 
-                loss = self._compute_loss(itr,mask, input_point, input_label)
-                
-                self.predictor.model.zero_grad()
-                scaler.scale(loss).backward()
+            if micro_steps % accumulation_steps:
                 scaler.step(optimizer)
                 scaler.update()
+                optimizer.zero_grad()
+                itr += 1
+        finally:
+            self.checkpointer.close()
+
+        seconds = time.time() - t_start
+        if evaluator is not None and itr % eval_step:
+            self.evaluate(evaluator, tag=itr)
+        self.stats = {'epochs': epoch + 1 if epochs else 0, 'iterations': itr, 'images': images,
+                      'seconds': seconds, 'images_per_sec': images / max(seconds, 1e-9)}
+        print(f"Trained {itr} iterations on {images} images in {seconds:.1f}s "
+              f"({self.stats['images_per_sec']:.2f} images/s)")
+        return self.predictor
 
-                if itr % save_step == 0:
-                    self._save_checkpoint(itr, save_all)
+    def _compute_batch_loss(self, batch: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]
+                            ) -> Tuple[torch.Tensor, float]:
+        """Embed a mini-batch of images together, or read their stored features, and average the per-image losses."""
+        if self.feature_store is not None:
+            self.feature_store.set_predictor(self.predictor, [sample[0] for sample in batch])
+        else:
+            self.predictor.set_image_batch([np.ascontiguousarray(sample[0]) for sample in batch])
+        losses = []
+        ious = []
+        for img_idx, (_, mask, input_point, input_label) in enumerate(batch):
+            loss, iou = self._compute_loss(mask, input_point, input_label, img_idx)
+            losses.append(loss)
+            ious.append(iou)
+        return torch.stack(losses).mean(), float(np.mean(ious))
+
+    def evaluate(self, evaluator: Union[str, Dict, SegmentationEvaluator], tag: Optional[Union[int, str]] = None,
+                 **kwargs) -> Dict:
+        """
+        Evaluate the predictor on held-out data.
 
-        return self.predictor
+        Args:
+            evaluator (Union[str, Dict, SegmentationEvaluator]): Evaluator, or a held-out CSV path / data dict
+            tag (Optional[Union[int, str]]): Label of the evaluation, e.g. the iteration
+            **kwargs: SegmentationEvaluator arguments when evaluator is not one already
 
-    def _compute_loss(self, itr : int, mask: np.ndarray, input_point: np.ndarray,
-                     input_label: np.ndarray) -> torch.Tensor:
-        """Compute the loss for training."""
+        Returns:
+            Dict: Evaluation summary
+        """
+        if not isinstance(evaluator, SegmentationEvaluator):
+            evaluator = SegmentationEvaluator(evaluator, **kwargs)
+        decoder = self.predictor.model.sam_mask_decoder
+        prompt_encoder = self.predictor.model.sam_prompt_encoder
+        modes = (decoder.training, prompt_encoder.training)
+        decoder.train(False)
+        prompt_encoder.train(False)
+        try:
+            summary = evaluator.evaluate(self.predictor, tag=tag)
+        finally:
+            decoder.train(modes[0])
+            prompt_encoder.train(modes[1])
+        print(SegmentationEvaluator.format_summary(summary))
+        return summary
+
+    def build_feature_store(self, data: Dict, path: str, batch_size: int = 4, dtype: str = 'float16',
+                            cache_dir: Optional[str] = None) -> FeatureStore:
+        """
+        Run the frozen image encoder once over the training images and store the features.
+
+        Only the prompt encoder and mask decoder are trained, so the stored features stay valid
+        for the whole run. An interrupted build resumes where it stopped.
+
+        Args:
+            data (Dict): Data dict from load_data
+            path (str): Directory of the feature store
+            batch_size (int): Images encoded together
+            dtype (str): Storage dtype of the features
+            cache_dir (Optional[str]): Directory of pre-resized images
+
+        Returns:
+            FeatureStore: The feature store, to pass to train
+        """
+        dataset = SAM2TrainDataset(data, cache_dir=cache_dir)
+        keys = [data[k]["image"] for k in dataset.keys]
+        with torch.amp.autocast(device_type=self.device):
+            return FeatureStore.build(path, self.predictor, dataset.images, keys, model_id=self.model_id,
+                                      batch_size=batch_size, dtype=dtype)
+
+    def _open_feature_store(self, feature_store: Union[str, FeatureStore],
+                            data: Union[Dict, torch.utils.data.DataLoader]) -> FeatureStore:
+        """Open a feature store and check that it matches the model and the training data."""
+        if isinstance(feature_store, str):
+            feature_store = FeatureStore(feature_store)
+        if feature_store.model_id != self.model_id:
+            raise ValueError(f"Feature store was computed with {feature_store.model_id}, not {self.model_id}")
+        if not feature_store.complete:
+            raise ValueError("Feature store is incomplete, run build_feature_store again to finish it")
+        if isinstance(data, dict) and feature_store.keys != [str(data[k]["image"]) for k in data]:
+            raise ValueError("Feature store images do not match the training data")
+        return feature_store
+
+    def _compute_loss(self, mask: np.ndarray, input_point: np.ndarray,
+                     input_label: np.ndarray, img_idx: int = -1) -> Tuple[torch.Tensor, float]:
+        """Compute the loss for the prompts of one image, returning the loss and the mean IoU."""
         mask_input, unnorm_coords, labels, unnorm_box = self.predictor._prep_prompts(
-            input_point, input_label, box=None, mask_logits=None, normalize_coords=True)
+            input_point, input_label, box=None, mask_logits=None, normalize_coords=True, img_idx=img_idx)
         
         sparse_embeddings, dense_embeddings = self.predictor.model.sam_prompt_encoder(
             points=(unnorm_coords, labels), boxes=None, masks=None)
 
         batched_mode = unnorm_coords.shape[0] > 1
-        high_res_features = [feat_level[-1].unsqueeze(0)
+        high_res_features = [feat_level[img_idx].unsqueeze(0)
                            for feat_level in self.predictor._features["high_res_feats"]]
         
         low_res_masks, prd_scores, _, _ = self.predictor.model.sam_mask_decoder(
-            image_embeddings=self.predictor._features["image_embed"][-1].unsqueeze(0),
+            image_embeddings=self.predictor._features["image_embed"][img_idx].unsqueeze(0),
             image_pe=self.predictor.model.sam_prompt_encoder.get_dense_pe(),
             sparse_prompt_embeddings=sparse_embeddings,
             dense_prompt_embeddings=dense_embeddings,
@@ -447,7 +1364,7 @@ class ModelTrainer:
             high_res_features=high_res_features)
 
         prd_masks = self.predictor._transforms.postprocess_masks(
-            low_res_masks, self.predictor._orig_hw[-1])
+            low_res_masks, self.predictor._orig_hw[img_idx])
 
         gt_mask = torch.tensor(mask.astype(np.float32)).to(self.device)
         prd_mask = torch.sigmoid(prd_masks[:, 0])
@@ -459,24 +1376,25 @@ class ModelTrainer:
         iou = inter / (gt_mask.sum(1).sum(1) + (prd_mask > 0.5).sum(1).sum(1) - inter)
         score_loss = torch.abs(prd_scores[:, 0] - iou).mean()
         
-        if itr == 0:
-            self.mean_iou = 0
-        self.mean_iou = self.mean_iou * 0.99 + 0.01 * np.mean(iou.cpu().detach().numpy())
+        return seg_loss + score_loss * 0.05, float(np.mean(iou.cpu().detach().numpy()))
 
-        print(f"Iteration {itr}, Segmentation Loss: {seg_loss.item()}, Score Loss: {score_loss.item()}, Mean IOU: {self.mean_iou}")
-        return seg_loss + score_loss * 0.05
+    def _save_checkpoint(self, iteration: int) -> None:
+        """Queue a delta checkpoint of the trainable parameters."""
+        self.checkpointer.save(self.predictor.model, iteration)
 
-    def _save_checkpoint(self, iteration: int, save_all: bool) -> None:
-        """Save model checkpoint."""
-        if save_all:
-            path = f"./sam_model_checkpoints/sam_model_{iteration}.pt"
-        else:
-            path = "./sam_model_checkpoints/sam_model.pt"
-        torch.save(self.predictor.model.state_dict(), path)
+    def _load_checkpoint(self, path: str, base_checkpoint: Optional[str] = None) -> None:
+        """
+        Load model checkpoint.
 
-    def _load_checkpoint(self, path: str) -> None:
-        """Load model checkpoint."""
-        self.predictor.model.load_state_dict(torch.load(path))
+        Args:
+            path (str): Delta checkpoint from training, or a full state dict
+            base_checkpoint (Optional[str]): Full checkpoint to load before a delta
+        """
+        state = torch.load(path, map_location='cpu')
+        if 'prefixes' in state:
+            load_delta(self.predictor.model, state, base_checkpoint)
+        else:
+            self.predictor.model.load_state_dict(state)
 
 
 # Create convenience functions that use the classes
@@ -0,0 +1,251 @@
+"""
+Tiling Module
+
+This module provides tiled automatic mask generation for very large images. The image is
+split into overlapping tiles, SAM2 automatic mask generation runs on one tile at a time,
+and masks are streamed out as soon as no later tile can produce a duplicate of them.
+Duplicates across tile borders are merged with box-level NMS followed by a mask IoU check
+on compact masks, so peak memory is bounded by the tile size rather than the image size.
+"""
+
+import numpy as np
+import cv2
+from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from .boxmatch import BoxMatcher
+from .compactmask import CompactMask
+
+__all__ = ["TiledMaskGenerator"]
+
+
+class TiledMaskGenerator:
+    """
+    A class for streaming automatic mask generation over overlapping image tiles.
+
+    Masks are yielded as dicts with the same keys as SAM2AutomaticMaskGenerator output,
+    in full-image coordinates, with 'segmentation' stored as a CompactMask.
+
+    Attributes:
+        mask_generator (SAM2AutomaticMaskGenerator): Generator run on every tile
+        tile_size (int): Tile height and width in pixels
+        overlap (int): Overlap between neighbouring tiles in pixels
+        iou_thresh (float): Mask IoU above which two masks are duplicates
+        keep_edge_masks (bool): Whether to keep masks touching interior tile edges
+    """
+
+    def __init__(self,
+                 mask_generator: SAM2AutomaticMaskGenerator,
+                 tile_size: int = 1024,
+                 overlap: int = 128,
+                 iou_thresh: float = 0.7,
+                 keep_edge_masks: bool = False) -> None:
+        """
+        Initialize the TiledMaskGenerator.
+
+        Args:
+            mask_generator (SAM2AutomaticMaskGenerator): Generator run on every tile
+            tile_size (int): Tile height and width in pixels
+            overlap (int): Overlap between neighbouring tiles in pixels, should exceed typical object size
+            iou_thresh (float): Mask IoU above which two masks are duplicates
+            keep_edge_masks (bool): Whether to keep all masks touching interior tile edges. When False,
+                                    such a mask is dropped only if another tile fully contains its box
+                                    and so sees at least as much of the object; objects cut by every
+                                    tile (larger than the overlap) are kept and merged across tiles
+        """
+        if overlap >= tile_size:
+            raise ValueError("overlap must be smaller than tile_size")
+        self.mask_generator = mask_generator
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.iou_thresh = iou_thresh
+        self.keep_edge_masks = keep_edge_masks
+
+    @classmethod
+    def from_model(cls, model, points_per_side: int = 32, points_per_batch: int = 64,
+                   generator_kwargs: Optional[Dict] = None, **kwargs) -> "TiledMaskGenerator":
+        """
+        Build a TiledMaskGenerator around a SAM2 model.
+
+        Args:
+            model: SAM2 model, e.g. SAM2Processor.mask_generator.predictor.model
+            points_per_side (int): Points sampled along one side of each tile
+            points_per_batch (int): Points run through the model together
+            generator_kwargs (Optional[Dict]): Extra SAM2AutomaticMaskGenerator arguments
+            **kwargs: TiledMaskGenerator arguments
+
+        Returns:
+            TiledMaskGenerator: The tiled generator
+        """
+        generator = SAM2AutomaticMaskGenerator(model, points_per_side=points_per_side,
+                                               points_per_batch=points_per_batch,
+                                               **(generator_kwargs or {}))
+        return cls(generator, **kwargs)
+
+    def tile_boxes(self, height: int, width: int) -> List[Tuple[int, int, int, int]]:
+        """
+        Compute the tile grid in row-major order.
+
+        Args:
+            height (int): Image height
+            width (int): Image width
+
+        Returns:
+            List[Tuple[int, int, int, int]]: Tiles as (x0, y0, x1, y1)
+        """
+        stride = self.tile_size - self.overlap
+
+        def starts(size: int) -> List[int]:
+            if size <= self.tile_size:
+                return [0]
+            values = list(range(0, size - self.tile_size, stride))
+            return values + [size - self.tile_size]
+
+        return [(x0, y0, min(x0 + self.tile_size, width), min(y0 + self.tile_size, height))
+                for y0 in starts(height) for x0 in starts(width)]
+
+    @staticmethod
+    def _to_global(mask: np.ndarray, x0: int, y0: int, shape: Tuple[int, int]) -> CompactMask:
+        """Encode a tile-local dense mask as a CompactMask in full-image coordinates."""
+        th, tw = mask.shape
+        # pad every column with one background row so runs never cross columns
+        padded = np.zeros((tw, th + 1), dtype=bool)
+        padded[:, :th] = mask.T
+        flat = padded.ravel()
+        change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+        if flat[0]:
+            change = np.concatenate([[0], change])
+        starts, ends = change[0::2], change[1::2]
+        col, row = starts // (th + 1), starts % (th + 1)
+        offset = (x0 + col) * shape[0] + y0 + row
+        return CompactMask.from_intervals(offset, offset + (ends - starts), shape)
+
+    def _touches_interior_edge(self, bbox: List[float], tile: Tuple[int, int, int, int],
+                               height: int, width: int) -> bool:
+        """Check whether a tile-local XYWH box touches a tile edge that is not an image edge."""
+        x0, y0, x1, y1 = tile
+        bx0, by0, bw, bh = bbox
+        return ((x0 > 0 and bx0 <= 1) or (y0 > 0 and by0 <= 1) or
+                (x1 < width and bx0 + bw >= x1 - x0 - 1) or (y1 < height and by0 + bh >= y1 - y0 - 1))
+
+    @staticmethod
+    def _contained_elsewhere(bbox: List[float], x0: int, y0: int, tile_idx: int, tiles: np.ndarray) -> bool:
+        """Check whether another tile fully contains a tile-local XYWH box, so it sees at least as much of the object."""
+        bx0, by0 = bbox[0] + x0, bbox[1] + y0
+        bx1, by1 = bx0 + bbox[2], by0 + bbox[3]
+        inside = ((tiles[:, 0] <= bx0) & (tiles[:, 1] <= by0) & (tiles[:, 2] >= bx1) & (tiles[:, 3] >= by1))
+        inside[tile_idx] = False
+        return bool(inside.any())
+
+    def _tiles_overlapping(self, box: np.ndarray, tiles: np.ndarray) -> np.ndarray:
+        """Get the indices of tiles whose area intersects an XYXY box."""
+        hit = ((tiles[:, 0] < box[2]) & (tiles[:, 2] > box[0]) &
+               (tiles[:, 1] < box[3]) & (tiles[:, 3] > box[1]))
+        return np.flatnonzero(hit)
+
+    def generate(self, image: Union[str, np.ndarray]) -> Iterator[Dict]:
+        """
+        Generate masks tile by tile, yielding each mask once it is final.
+
+        A path to a .npy file, or to an uncompressed TIFF when tifffile is installed, is memory
+        mapped, so only the current tile is read into memory. Other image files are decoded once
+        and each tile is converted to RGB on its own; to keep memory bounded by the tile size for
+        those, convert them to .npy or pass a np.memmap.
+
+        Args:
+            image (Union[str, np.ndarray]): Image path, or RGB array (a np.memmap works too)
+
+        Yields:
+            Dict: Mask record in full-image coordinates with a CompactMask 'segmentation'
+        """
+        bgr = False
+        if isinstance(image, str):
+            image, bgr = self._open(image)
+        height, width = image.shape[:2]
+        tiles = self.tile_boxes(height, width)
+        tile_array = np.array(tiles)
+        pending: List[Dict] = []
+
+        for tile_idx, tile in enumerate(tiles):
+            x0, y0, x1, y1 = tile
+            crop = self._read_tile(image, tile, bgr)
+            for ann in self.mask_generator.generate(crop):
+                if (not self.keep_edge_masks and self._touches_interior_edge(ann['bbox'], tile, height, width)
+                        and self._contained_elsewhere(ann['bbox'], x0, y0, tile_idx, tile_array)):
+                    continue
+                record = self._globalize(ann, x0, y0, (height, width))
+                self._merge(record, pending, tile_array)
+            del crop
+
+            ready = [r for r in pending if r['_last_tile'] <= tile_idx]
+            pending = [r for r in pending if r['_last_tile'] > tile_idx]
+            for record in ready:
+                yield self._finalize(record)
+
+        for record in pending:
+            yield self._finalize(record)
+
+    @staticmethod
+    def _open(path: str) -> Tuple[np.ndarray, bool]:
+        """Open an image path for tile reads, memory-mapped when the file format allows it."""
+        if path.lower().endswith('.npy'):
+            return np.load(path, mmap_mode='r'), False
+        if path.lower().endswith(('.tif', '.tiff')):
+            try:
+                import tifffile
+                return tifffile.memmap(path, mode='r'), False
+            except (ImportError, ValueError):
+                # tifffile missing, or compressed/tiled data that cannot be mapped
+                pass
+        image = cv2.imread(path)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image {path}")
+        return image, True
+
+    @staticmethod
+    def _read_tile(image: np.ndarray, tile: Tuple[int, int, int, int], bgr: bool) -> np.ndarray:
+        """Copy one tile out of the image as a contiguous RGB uint8 array."""
+        x0, y0, x1, y1 = tile
+        crop = image[y0:y1, x0:x1]
+        if crop.ndim == 2:
+            return cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_GRAY2RGB)
+        if bgr:
+            return cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_BGR2RGB)
+        return np.ascontiguousarray(crop[..., :3])
+
+    def _globalize(self, ann: Dict, x0: int, y0: int, shape: Tuple[int, int]) -> Dict:
+        """Move a tile-local mask record to full-image coordinates."""
+        bx, by, bw, bh = ann['bbox']
+        record = dict(ann)
+        record['segmentation'] = self._to_global(ann['segmentation'], x0, y0, shape)
+        record['bbox'] = [bx + x0, by + y0, bw, bh]
+        record['point_coords'] = [[p[0] + x0, p[1] + y0] for p in ann['point_coords']]
+        cx0, cy0, cx1, cy1 = ann['crop_box']
+        record['crop_box'] = [cx0 + x0, cy0 + y0, cx1 + x0, cy1 + y0]
+        return record
+
+    def _merge(self, record: Dict, pending: List[Dict], tiles: np.ndarray) -> None:
+        """Add a mask to the pending list, replacing or dropping duplicates."""
+        bx, by, bw, bh = record['bbox']
+        box = np.array([bx, by, bx + bw, by + bh], dtype=np.float64)
+        record['_box'] = box
+        record['_last_tile'] = int(self._tiles_overlapping(box, tiles).max())
+        if pending:
+            candidates = np.array([r['_box'] for r in pending])
+            box_iou = BoxMatcher.pairwise_iou(box, candidates)[0]
+            # mask IoU can only be high when the boxes overlap substantially
+            for idx in np.flatnonzero(box_iou >= self.iou_thresh * 0.5):
+                other = pending[idx]
+                if record['segmentation'].iou(other['segmentation']) < self.iou_thresh:
+                    continue
+                if record['predicted_iou'] > other['predicted_iou']:
+                    record['_last_tile'] = max(record['_last_tile'], other['_last_tile'])
+                    pending[idx] = record
+                return
+        pending.append(record)
+
+    @staticmethod
+    def _finalize(record: Dict) -> Dict:
+        """Drop internal bookkeeping keys from a mask record."""
+        record.pop('_box', None)
+        record.pop('_last_tile', None)
+        return record
@@ -0,0 +1,431 @@
+"""
+Training Data Module
+
+This module provides a torch Dataset/DataLoader pipeline for SAM2 fine-tuning. Samples
+are decoded in worker processes so loading overlaps with training, images and annotation
+maps can be cached on disk already resized to the 1024 long side, and sampling is driven
+by a seeded sampler so runs are reproducible regardless of the number of workers.
+"""
+
+import hashlib
+import os
+import numpy as np
+import cv2
+from PIL import Image
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from .compactmask import CompactMask
+
+__all__ = ["SAM2TrainDataset", "SeededSampler", "make_train_loader", "collate_samples", "load_pair",
+           "load_annotation", "instance_map", "decode_label_map", "decode_instances"]
+
+Sample = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def load_pair(image_path: str, annotation_path: str, long_side: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read an image and its annotation map, resized so that the long side is `long_side`.
+
+    Args:
+        image_path (str): Path to the image
+        annotation_path (str): Path to the annotation map
+        long_side (int): Target size of the longer image side
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: RGB image and BGR annotation map
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not read image: {image_path}")
+    image = image[..., ::-1]
+
+    r = np.min([long_side / image.shape[1], long_side / image.shape[0]])
+    image = cv2.resize(image, (int(image.shape[1] * r), int(image.shape[0] * r)))
+    return image, _read_annotation(annotation_path, r)
+
+
+def load_annotation(annotation_path: str, long_side: int = 1024, image_path: Optional[str] = None) -> np.ndarray:
+    """
+    Read only an annotation map, resized exactly as load_pair resizes it, without decoding the image.
+
+    Args:
+        annotation_path (str): Path to the annotation map
+        long_side (int): Target size of the longer image side
+        image_path (Optional[str]): Path to the image. Only its header is read, for the resize ratio
+                                    when the image and annotation sizes differ
+
+    Returns:
+        np.ndarray: BGR annotation map
+    """
+    if image_path is not None:
+        try:
+            with Image.open(image_path) as image:
+                width, height = image.size
+        except OSError:
+            raise FileNotFoundError(f"Could not read image: {image_path}")
+        return _read_annotation(annotation_path, np.min([long_side / width, long_side / height]))
+    return _read_annotation(annotation_path, None, long_side)
+
+
+def _read_annotation(annotation_path: str, r: Optional[float], long_side: int = 1024) -> np.ndarray:
+    """Read an annotation map and resize it by `r`, or by its own long side ratio when `r` is None."""
+    ann_map = cv2.imread(annotation_path)
+    if ann_map is None:
+        raise FileNotFoundError(f"Could not read annotation: {annotation_path}")
+    if r is None:
+        r = np.min([long_side / ann_map.shape[1], long_side / ann_map.shape[0]])
+    return cv2.resize(ann_map, (int(ann_map.shape[1] * r), int(ann_map.shape[0] * r)),
+                      interpolation=cv2.INTER_NEAREST)
+
+
+def instance_map(ann_map: np.ndarray) -> np.ndarray:
+    """
+    Build the instance label map of a BGR annotation map.
+
+    Instances are the non-zero values of channel 0, with channel 2 marking an extra
+    instance where channel 0 is zero.
+
+    Args:
+        ann_map (np.ndarray): BGR annotation map of shape (H, W, 3)
+
+    Returns:
+        np.ndarray: Label map of shape (H, W), 0 for background
+    """
+    mat_map = ann_map[:, :, 0].copy()
+    ves_map = ann_map[:, :, 2]
+    mat_map[mat_map == 0] = ves_map[mat_map == 0] * (mat_map.max() + 1)
+    return mat_map
+
+
+def decode_label_map(label_map: np.ndarray, num_points: int = 1, compact: bool = False,
+                     rng=np.random) -> Dict[str, Union[np.ndarray, List[CompactMask]]]:
+    """
+    Decode every instance of a label map in one pass.
+
+    Foreground pixels are grouped by label with a single stable argsort, so masks,
+    boxes, areas and interior points of all instances come from the same sorted
+    pixel list instead of one full-image comparison per instance.
+
+    Args:
+        label_map (np.ndarray): Integer label map of shape (H, W), 0 for background
+        num_points (int): Random interior points drawn per instance
+        compact (bool): Whether to return masks as CompactMask instead of a dense array
+        rng: Random source with a `randint` method, e.g. np.random or a np.random.RandomState
+
+    Returns:
+        Dict: 'ids' (N,), 'masks' (N, H, W) uint8 or list of CompactMask, 'bboxes' (N, 4)
+              in XYWH order, 'areas' (N,) and 'points' (N, num_points, 2) in (x, y) order
+    """
+    height, width = label_map.shape
+    # column-major pixel order, so each instance's pixels come out as RLE-ready runs
+    flat = label_map.T.ravel()
+    pixels = np.flatnonzero(flat)
+    values = flat[pixels]
+    order = np.argsort(values, kind='stable')
+    pixels = pixels[order]
+    values = values[order]
+
+    if len(values) and values[-1] < 2 ** 24:
+        counts = np.bincount(values)
+        ids = np.flatnonzero(counts)
+        counts = counts[ids]
+    else:
+        ids, counts = np.unique(values, return_counts=True)
+    num = len(ids)
+    starts = np.cumsum(counts) - counts
+    ys = pixels % height
+    xs = pixels // height
+
+    if num:
+        x0 = np.minimum.reduceat(xs, starts)
+        y0 = np.minimum.reduceat(ys, starts)
+        bboxes = np.stack([x0, y0, np.maximum.reduceat(xs, starts) - x0 + 1,
+                           np.maximum.reduceat(ys, starts) - y0 + 1], axis=1)
+        picks = starts[:, None] + rng.randint(0, counts[:, None], size=(num, num_points))
+        points = np.stack([xs[picks], ys[picks]], axis=-1)
+    else:
+        bboxes = np.zeros((0, 4), dtype=np.int64)
+        points = np.zeros((0, num_points, 2), dtype=np.int64)
+
+    if compact and num:
+        # a run ends where the next pixel is not adjacent or belongs to the next instance
+        breaks = np.union1d(np.flatnonzero(np.diff(pixels) != 1) + 1, starts[1:])
+        run_starts = np.concatenate([[0], breaks]).astype(np.int64)
+        run_ends = np.concatenate([breaks, [len(pixels)]]).astype(np.int64)
+        bounds = np.searchsorted(run_starts, np.append(starts, len(pixels)))
+        masks = [CompactMask.from_intervals(pixels[run_starts[lo:hi]], pixels[run_ends[lo:hi] - 1] + 1,
+                                            (height, width))
+                 for lo, hi in zip(bounds[:-1], bounds[1:])]
+    elif compact:
+        masks = []
+    else:
+        masks = np.zeros((num, height * width), dtype=np.uint8)
+        masks[np.repeat(np.arange(num), counts), ys * width + xs] = 1
+        masks = masks.reshape(num, height, width)
+
+    return {'ids': ids, 'masks': masks, 'bboxes': bboxes, 'areas': counts, 'points': points}
+
+
+def decode_instances(ann_map: np.ndarray, rng=np.random, num_points: int = 1,
+                     compact: bool = False) -> Tuple[Union[np.ndarray, List[CompactMask]], np.ndarray, np.ndarray]:
+    """
+    Split an annotation map into instance masks with random interior points.
+
+    Args:
+        ann_map (np.ndarray): BGR annotation map of shape (H, W, 3), see instance_map
+        rng: Random source with a `randint` method, e.g. np.random or a np.random.RandomState
+        num_points (int): Random interior points drawn per instance
+        compact (bool): Whether to return masks as CompactMask instead of a dense array
+
+    Returns:
+        Tuple: Masks (N, H, W), points (N, num_points, 2) and labels (N, num_points)
+    """
+    decoded = decode_label_map(instance_map(ann_map), num_points=num_points, compact=compact, rng=rng)
+    return decoded['masks'], decoded['points'], np.ones([len(decoded['ids']), num_points])
+
+
+class SAM2TrainDataset(Dataset):
+    """
+    A Dataset of SAM2 training samples built from a `DataProcessor.load_data` dict.
+
+    Each item is an (image, masks, points, labels) tuple in the format of
+    `DataProcessor.read_batch`. Indices may be plain ints or (index, seed) pairs as yielded
+    by SeededSampler, in which case the interior points are drawn from that seed.
+
+    Attributes:
+        data (Dict): Mapping from index to {"image": path, "annotation": path}
+        long_side (int): Size images are resized to along their longer side
+        cache_dir (Optional[str]): Directory of pre-resized images, None to disable caching
+        num_points (int): Random interior points drawn per instance
+        with_images (bool): Whether samples carry the image. When False the item index takes its
+                            place, for training from a FeatureStore without decoding images
+    """
+
+    def __init__(self, data: Dict, long_side: int = 1024, cache_dir: Optional[str] = None,
+                 num_points: int = 1, with_images: bool = True) -> None:
+        """
+        Initialize the SAM2TrainDataset.
+
+        Args:
+            data (Dict): Mapping from index to {"image": path, "annotation": path}
+            long_side (int): Size images are resized to along their longer side
+            cache_dir (Optional[str]): Directory to keep pre-resized images and annotation
+                                       maps in as .npy files. Defaults to None (no cache)
+            num_points (int): Random interior points drawn per instance
+            with_images (bool): Whether samples carry the image instead of the item index
+        """
+        self.data = data
+        self.keys = list(data.keys())
+        self.long_side = long_side
+        self.cache_dir = cache_dir
+        self.num_points = num_points
+        self.with_images = with_images
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _cache_paths(self, entry: Dict) -> Tuple[str, str]:
+        """Get the cache file paths of an entry, keyed by file identity and target size."""
+        digest = hashlib.sha1(str(self.long_side).encode())
+        for path in (entry["image"], entry["annotation"]):
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        key = digest.hexdigest()
+        return (os.path.join(self.cache_dir, key + '_image.npy'),
+                os.path.join(self.cache_dir, key + '_annotation.npy'))
+
+    @staticmethod
+    def _save_array(path: str, array: np.ndarray) -> None:
+        """Write an array atomically so concurrent workers never see a partial file."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(tmp_path, path)
+
+    def load(self, index: int, with_image: bool = True) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """
+        Load the resized image and annotation map of an item, from the cache when possible.
+
+        Args:
+            index (int): Item index
+            with_image (bool): Whether the image is needed. When False, the image is not decoded
+                               (only its header is read, or nothing with a cache) and None is
+                               returned in its place
+
+        Returns:
+            Tuple[Optional[np.ndarray], np.ndarray]: RGB image and BGR annotation map
+        """
+        entry = self.data[self.keys[index]]
+        if not self.cache_dir:
+            if not with_image:
+                return None, load_annotation(entry["annotation"], self.long_side, entry["image"])
+            return load_pair(entry["image"], entry["annotation"], self.long_side)
+        image_path, ann_path = self._cache_paths(entry)
+        if os.path.exists(image_path) and os.path.exists(ann_path):
+            return (np.load(image_path) if with_image else None), np.load(ann_path)
+        image, ann_map = load_pair(entry["image"], entry["annotation"], self.long_side)
+        self._save_array(image_path, image)
+        self._save_array(ann_path, ann_map)
+        return image, ann_map
+
+    def __getitem__(self, index: Union[int, Tuple[int, int]]) -> Sample:
+        """
+        Get a training sample.
+
+        Args:
+            index (Union[int, Tuple[int, int]]): Item index, or (index, seed) pair
+
+        Returns:
+            Sample: Image (H, W, 3), masks (N, H, W), points (N, K, 2) and labels (N, K)
+        """
+        rng = np.random
+        if isinstance(index, (tuple, list)):
+            index, seed = index
+            rng = np.random.RandomState(seed)
+        image, ann_map = self.load(index, with_image=self.with_images)
+        masks, points, labels = decode_instances(ann_map, rng, num_points=self.num_points)
+        if not self.with_images:
+            return index, masks, points, labels
+        return np.ascontiguousarray(image), masks, points, labels
+
+    @property
+    def images(self) -> "_ImageView":
+        """Sequence view of the resized images, e.g. for FeatureStore.build."""
+        return _ImageView(self)
+
+    def build_cache(self, num_workers: int = 4) -> None:
+        """
+        Fill the cache for every item ahead of training.
+
+        Args:
+            num_workers (int): Number of worker processes used to decode and resize
+        """
+        if not self.cache_dir:
+            raise ValueError("build_cache requires a cache_dir")
+        loader = DataLoader(_CacheFiller(self), batch_size=None, num_workers=num_workers)
+        for _ in loader:
+            pass
+
+
+class _ImageView:
+    """Sequence of the resized images of a SAM2TrainDataset."""
+
+    def __init__(self, dataset: SAM2TrainDataset) -> None:
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.dataset.load(index)[0]
+
+
+class _CacheFiller(Dataset):
+    """Dataset wrapper that only populates the cache of a SAM2TrainDataset."""
+
+    def __init__(self, dataset: SAM2TrainDataset) -> None:
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> int:
+        self.dataset.load(index)
+        return index
+
+
+class SeededSampler(Sampler):
+    """
+    A reproducible random sampler yielding (index, seed) pairs.
+
+    The order of indices and the per-sample seeds depend only on the base seed and the
+    epoch, so the same run is drawn however many workers decode it.
+
+    Attributes:
+        num_items (int): Number of items in the dataset
+        num_samples (int): Number of samples drawn per epoch
+        seed (int): Base seed
+        replacement (bool): Whether to draw uniformly with replacement
+        epoch (int): Current epoch, mixed into the seed
+    """
+
+    def __init__(self, num_items: int, num_samples: Optional[int] = None, seed: int = 0,
+                 replacement: bool = False) -> None:
+        """
+        Initialize the SeededSampler.
+
+        Args:
+            num_items (int): Number of items in the dataset
+            num_samples (Optional[int]): Number of samples per epoch. Defaults to num_items
+            seed (int): Base seed
+            replacement (bool): Whether to draw uniformly with replacement instead of
+                                walking through shuffled permutations
+        """
+        if num_items <= 0:
+            raise ValueError("SeededSampler needs at least one item")
+        self.num_items = num_items
+        self.num_samples = num_samples or num_items
+        self.seed = seed
+        self.replacement = replacement
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch used to derive the sampling order."""
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed * 1000003 + self.epoch)
+        if self.replacement:
+            indices = torch.randint(self.num_items, (self.num_samples,), generator=generator)
+        else:
+            rounds = -(-self.num_samples // self.num_items)
+            indices = torch.cat([torch.randperm(self.num_items, generator=generator)
+                                 for _ in range(rounds)])[:self.num_samples]
+        seeds = torch.randint(2 ** 31 - 1, (self.num_samples,), generator=generator)
+        return iter(zip(indices.tolist(), seeds.tolist()))
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+def collate_samples(batch: List[Sample]) -> List[Sample]:
+    """Keep samples as a list, since images and instance counts differ in size."""
+    return batch
+
+
+def make_train_loader(data: Union[Dict, SAM2TrainDataset], batch_size: int = 1, num_workers: int = 4,
+                      seed: int = 0, num_samples: Optional[int] = None, replacement: bool = False,
+                      cache_dir: Optional[str] = None, long_side: int = 1024, num_points: int = 1,
+                      with_images: bool = True, prefetch_factor: int = 2) -> DataLoader:
+    """
+    Build a DataLoader over SAM2 training samples.
+
+    Every batch is a list of (image, masks, points, labels) samples.
+
+    Args:
+        data (Union[Dict, SAM2TrainDataset]): `DataProcessor.load_data` dict or a dataset
+        batch_size (int): Number of samples per batch
+        num_workers (int): Number of worker processes, 0 to load on the calling thread
+        seed (int): Sampling seed
+        num_samples (Optional[int]): Number of samples per pass over the loader. Defaults to the dataset size
+        replacement (bool): Whether to sample with replacement
+        cache_dir (Optional[str]): Directory of pre-resized images
+        long_side (int): Size images are resized to along their longer side
+        num_points (int): Random interior points drawn per instance
+        with_images (bool): Whether samples carry the image instead of the item index
+        prefetch_factor (int): Batches prefetched per worker
+
+    Returns:
+        DataLoader: The loader. Call `loader.sampler.set_epoch(epoch)` between passes for a new order
+    """
+    dataset = data
+    if not isinstance(data, SAM2TrainDataset):
+        dataset = SAM2TrainDataset(data, long_side, cache_dir, num_points, with_images)
+    sampler = SeededSampler(len(dataset), num_samples=num_samples, seed=seed, replacement=replacement)
+    kwargs = {'prefetch_factor': prefetch_factor, 'persistent_workers': True} if num_workers > 0 else {}
+    return DataLoader(dataset, batch_size=batch_size, sampler=sampler, num_workers=num_workers,
+                      collate_fn=collate_samples, **kwargs)
@@ -0,0 +1,291 @@
+"""
+Video Source Module
+
+This module provides a lazily decoded frame source for SAM2 video prediction. Frames are
+read straight from a video file with OpenCV, resized to the model input size on the fly and
+normalized as SAM2 expects, with a background thread prefetching the frames ahead of the
+one being tracked. This removes the need to dump every frame to disk as JPEG first.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import cv2
+import torch
+from typing import Iterator, Optional, Tuple, Union
+
+__all__ = ["VideoFrameSource", "FrameWindow", "sam2_frames"]
+
+
+class VideoFrameSource:
+    """
+    A sequence of normalized (3, S, S) frame tensors decoded lazily from a video file.
+
+    Behaves like the `images` entry of a SAM2 inference state: it supports len() and
+    integer indexing. Sequential access is served by the prefetch thread, and access
+    to a frame outside the prefetch window seeks the decoder there.
+
+    Attributes:
+        video_path (str): Path to the video file
+        image_size (int): Model input size the frames are resized to
+        offload_video_to_cpu (bool): Whether to keep frames on the CPU
+        prefetch (int): Number of frames decoded ahead of the last requested frame
+        cache_size (int): Maximum number of decoded frames kept in memory
+        video_height (int): Original frame height
+        video_width (int): Original frame width
+    """
+
+    def __init__(self,
+                 video_path: str,
+                 image_size: int = 1024,
+                 offload_video_to_cpu: bool = True,
+                 compute_device: Union[str, torch.device] = 'cpu',
+                 prefetch: int = 16,
+                 cache_size: Optional[int] = None,
+                 async_prefetch: bool = True,
+                 img_mean: Tuple[float, float, float] = (0.485, 0.456, 0.406),
+                 img_std: Tuple[float, float, float] = (0.229, 0.224, 0.225)) -> None:
+        """
+        Initialize the VideoFrameSource.
+
+        Args:
+            video_path (str): Path to the video file
+            image_size (int): Model input size the frames are resized to
+            offload_video_to_cpu (bool): Whether to keep frames on the CPU instead of the compute device
+            compute_device (Union[str, torch.device]): Device of the model
+            prefetch (int): Number of frames decoded ahead of the last requested frame
+            cache_size (Optional[int]): Maximum number of decoded frames kept. Defaults to 2 * prefetch + 2
+            async_prefetch (bool): Whether to decode in a background thread
+            img_mean (Tuple[float, float, float]): Normalization mean
+            img_std (Tuple[float, float, float]): Normalization std
+        """
+        self.video_path = video_path
+        self.image_size = image_size
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.compute_device = torch.device(compute_device)
+        self.prefetch = max(prefetch, 0)
+        self.cache_size = cache_size or 2 * self.prefetch + 2
+        self.img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
+        self.img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
+
+        self._capture = cv2.VideoCapture(video_path)
+        if not self._capture.isOpened():
+            raise FileNotFoundError(f"Could not open video file: {video_path}")
+        self.num_frames = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.video_height = int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.video_width = int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.fps = self._capture.get(cv2.CAP_PROP_FPS)
+
+        self._cache = OrderedDict()
+        self._cond = threading.Condition()
+        self._next = 0
+        self._target = self.prefetch
+        self._seek = None
+        self._closed = False
+        self.exception = None
+        self._thread = None
+        if async_prefetch:
+            self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self._thread.start()
+
+    def _decode_next(self) -> Tuple[int, Optional[np.ndarray]]:
+        """Decode the frame at the decoder position, resized to image_size."""
+        idx = self._next
+        ok, frame = self._capture.read()
+        if not ok:
+            return idx, None
+        frame = cv2.resize(frame, (self.image_size, self.image_size), interpolation=cv2.INTER_LINEAR)
+        return idx, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def _store(self, idx: int, frame: Optional[np.ndarray]) -> None:
+        """Put a decoded frame into the cache, evicting the oldest entries. Caller holds the lock."""
+        self._cache[idx] = frame
+        self._cache.move_to_end(idx)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        self._next = idx + 1
+
+    def _prefetch_loop(self) -> None:
+        """Decode frames ahead of the reader until closed."""
+        try:
+            while True:
+                with self._cond:
+                    while not self._closed and self._seek is None and (
+                            self._next > self._target or self._next >= self.num_frames):
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    if self._seek is not None:
+                        self._capture.set(cv2.CAP_PROP_POS_FRAMES, self._seek)
+                        self._next = self._seek
+                        self._seek = None
+                # decode without holding the lock so cached frames stay readable
+                idx, frame = self._decode_next()
+                with self._cond:
+                    self._store(idx, frame)
+                    self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.exception = e
+                self._cond.notify_all()
+
+    def _request(self, index: int) -> Optional[np.ndarray]:
+        """Get the resized uint8 frame at index, waiting for or triggering its decode."""
+        with self._cond:
+            self._target = index + self.prefetch
+            if index not in self._cache and not (self._next <= index <= self._next + self.prefetch):
+                self._seek = index
+            self._cond.notify_all()
+            if self._thread is None:
+                return self._request_sync(index)
+            while index not in self._cache:
+                if self.exception is not None:
+                    raise RuntimeError("Failure in frame prefetch thread") from self.exception
+                self._cond.wait()
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+    def _request_sync(self, index: int) -> Optional[np.ndarray]:
+        """Decode up to index on the calling thread. Caller holds the lock."""
+        if self._seek is not None:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, self._seek)
+            self._next = self._seek
+            self._seek = None
+        while index not in self._cache:
+            self._store(*self._decode_next())
+        return self._cache[index]
+
+    def __getitem__(self, index: int) -> torch.Tensor:
+        """
+        Get a normalized frame tensor.
+
+        Args:
+            index (int): Frame index
+
+        Returns:
+            torch.Tensor: Frame of shape (3, image_size, image_size)
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame index {index} out of range for {len(self)} frames")
+        frame = self._request(index)
+        if frame is None:
+            raise IndexError(f"Could not decode frame {index} of {self.video_path}")
+        img = torch.from_numpy(frame).permute(2, 0, 1).float() / 255.0
+        img -= self.img_mean
+        img /= self.img_std
+        if not self.offload_video_to_cpu:
+            img = img.to(self.compute_device, non_blocking=True)
+        return img
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def read_original(self, index: int) -> np.ndarray:
+        """
+        Read a frame at its original resolution, e.g. for visualization.
+
+        Args:
+            index (int): Frame index
+
+        Returns:
+            np.ndarray: RGB frame of shape (video_height, video_width, 3)
+        """
+        capture = cv2.VideoCapture(self.video_path)
+        capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ok, frame = capture.read()
+        capture.release()
+        if not ok:
+            raise IndexError(f"Could not decode frame {index} of {self.video_path}")
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self) -> None:
+        """Stop the prefetch thread and release the decoder."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._capture.release()
+
+    def window(self, start: int, stop: int) -> "FrameWindow":
+        """
+        Get a view of frames [start, stop) indexed from 0.
+
+        Args:
+            start (int): First frame of the window
+            stop (int): Frame after the last frame of the window
+
+        Returns:
+            FrameWindow: The window view
+        """
+        return FrameWindow(self, start, stop)
+
+    def as_sam2_frames(self):
+        """
+        Make SAM2VideoPredictor.init_state take its frames from this source.
+
+        Within the context, SAM2's video frame loader returns this source instead of
+        decoding the whole video up front, so init_state can be called with the video path.
+        """
+        return sam2_frames(self)
+
+
+class FrameWindow:
+    """
+    A view of a contiguous range of frames of a VideoFrameSource, indexed from 0.
+
+    Attributes:
+        source (VideoFrameSource): Underlying frame source
+        start (int): First frame of the window in the source
+        stop (int): Frame after the last frame of the window in the source
+    """
+
+    def __init__(self, source: VideoFrameSource, start: int, stop: int) -> None:
+        """
+        Initialize the FrameWindow.
+
+        Args:
+            source (VideoFrameSource): Underlying frame source
+            start (int): First frame of the window in the source
+            stop (int): Frame after the last frame of the window in the source
+        """
+        self.source = source
+        self.start = max(start, 0)
+        self.stop = min(stop, len(source))
+        self.video_height = source.video_height
+        self.video_width = source.video_width
+
+    def __getitem__(self, index: int) -> torch.Tensor:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame index {index} out of range for {len(self)} frames")
+        return self.source[self.start + index]
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+
+@contextmanager
+def sam2_frames(frames: Union[VideoFrameSource, FrameWindow]) -> Iterator[None]:
+    """
+    Make SAM2VideoPredictor.init_state take its frames from a frame source or window.
+
+    Args:
+        frames (Union[VideoFrameSource, FrameWindow]): Frames to hand to init_state
+    """
+    from sam2 import sam2_video_predictor
+
+    original = sam2_video_predictor.load_video_frames
+
+    def load_video_frames(*args, **kwargs):
+        return frames, frames.video_height, frames.video_width
+
+    sam2_video_predictor.load_video_frames = load_video_frames
+    try:
+        yield
+    finally:
+        sam2_video_predictor.load_video_frames = original
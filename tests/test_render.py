@@ -0,0 +1,20 @@
+import numpy as np
+from mb_llm.compactmask import CompactMask
+from mb_llm.render import OverlayRenderer
+
+
+def _masks():
+    a = np.zeros((6, 8), dtype=bool)
+    a[1:5, 1:6] = True
+    b = np.zeros((6, 8), dtype=bool)
+    b[2:4, 3:7] = True
+    return [a, b]
+
+
+def test_label_map_mask_dtypes_match_bool():
+    masks = _masks()
+    expected = OverlayRenderer.label_map(masks)
+    assert expected.max() == 2 and (expected > 0).sum() == (masks[0] | masks[1]).sum()
+    for dtype in (np.float32, np.uint8):
+        np.testing.assert_array_equal(OverlayRenderer.label_map([m.astype(dtype) for m in masks]), expected)
+    np.testing.assert_array_equal(OverlayRenderer.label_map([CompactMask.from_dense(m) for m in masks]), expected)